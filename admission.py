@@ -0,0 +1,255 @@
+"""Admission control for the upstream services: fair queues, concurrency limits and rate limits.
+
+Every Cortex Analyst, OpenAI, Azure AI Search and warehouse call takes a slot from its
+provider first. A provider admits at most `concurrency` calls at once, at most `per_user`
+of them for one caller, and no faster than its token bucket refills. Waiting calls are
+served round-robin across callers, interactive before background (prefetch, batch), so a
+session that floods one provider queues behind its own requests instead of everyone's.
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import metrics
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+# Per provider: calls in flight, calls in flight per caller, sustained calls/second and burst size
+DEFAULT_LIMITS: Dict[str, Dict[str, float]] = {
+    "cortex": {"concurrency": 8, "per_user": 2, "rate": 4.0, "burst": 8},
+    "openai": {"concurrency": 8, "per_user": 2, "rate": 5.0, "burst": 10},
+    "azure_search": {"concurrency": 8, "per_user": 2, "rate": 10.0, "burst": 20},
+    "snowflake": {"concurrency": 8, "per_user": 3, "rate": 20.0, "burst": 20},
+}
+MAX_WAIT_SECONDS = 120
+# Waiters re-check their position (and the token bucket) at least this often
+POLL_SECONDS = 0.25
+
+_caller: contextvars.ContextVar = contextvars.ContextVar("admission_caller", default=None)
+_controller: Optional["AdmissionController"] = None
+
+# Every slot() is a checkout: its count is the histogram's _count, its wait 0 without a controller
+SLOT_WAIT_SECONDS = metrics.histogram("ppp_slot_wait_seconds", "Seconds waited for a provider slot", ["provider"])
+
+
+class AdmissionTimeout(TimeoutError):
+    """A call waited longer than the controller's max_wait for its slot"""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_seconds(self, now: float) -> float:
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class _Ticket:
+    __slots__ = ("user", "priority", "enqueued", "granted")
+
+    def __init__(self, user: str, priority: str):
+        self.user = user
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class ProviderQueue:
+    """Slots of one provider, granted round-robin across callers"""
+
+    def __init__(self, name: str, concurrency: int, per_user: int, rate: float, burst: float):
+        self.name = name
+        self.concurrency = int(concurrency)
+        self.per_user = int(per_user)
+        self.bucket = TokenBucket(rate, burst)
+        self.active = 0
+        self.active_by_user: Dict[str, int] = {}
+        # priority -> caller -> their waiting tickets; the OrderedDict order is the round-robin turn
+        self.waiting: Dict[str, "OrderedDict[str, Deque[_Ticket]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self.condition = threading.Condition()
+        self.stats = {"admitted": 0, "queued": 0, "timeouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def _order(self) -> List[_Ticket]:
+        """Waiting tickets in the order they would be granted if nothing else arrived"""
+        order = []
+        for priority in PRIORITIES:
+            queues = [list(queue) for queue in self.waiting[priority].values()]
+            for turn in range(max((len(queue) for queue in queues), default=0)):
+                order.extend(queue[turn] for queue in queues if turn < len(queue))
+        return order
+
+    def _dispatch(self, now: float):
+        """Grant free slots to the next eligible callers; caller holds the condition"""
+        granted = False
+        while self.active < self.concurrency:
+            ticket = None
+            for priority in PRIORITIES:
+                users = self.waiting[priority]
+                for user in users:
+                    if self.active_by_user.get(user, 0) < self.per_user:
+                        ticket = users[user][0]
+                        break
+                if ticket is not None:
+                    break
+            if ticket is None or not self.bucket.try_take(now):
+                break
+            users = self.waiting[ticket.priority]
+            users[ticket.user].popleft()
+            # The caller goes to the back of the round-robin turn, with or without more tickets waiting
+            if users[ticket.user]:
+                users.move_to_end(ticket.user)
+            else:
+                del users[ticket.user]
+            ticket.granted = True
+            self.active += 1
+            self.active_by_user[ticket.user] = self.active_by_user.get(ticket.user, 0) + 1
+            waited = now - ticket.enqueued
+            self.stats["admitted"] += 1
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            granted = True
+        if granted:
+            self.condition.notify_all()
+
+    def acquire(self, user: str, priority: str, max_wait: float,
+                on_wait: Optional[Callable[[str, int], None]] = None):
+        """Block until a slot is granted; on_wait(provider, position) is told while queued and 0 when admitted"""
+        ticket = _Ticket(user, priority)
+        deadline = ticket.enqueued + max_wait
+        with self.condition:
+            self.waiting[priority].setdefault(user, deque()).append(ticket)
+            self._dispatch(ticket.enqueued)
+            if not ticket.granted:
+                self.stats["queued"] += 1
+            position = None
+            while not ticket.granted:
+                now = time.monotonic()
+                if now >= deadline:
+                    self.waiting[priority][user].remove(ticket)
+                    if not self.waiting[priority][user]:
+                        del self.waiting[priority][user]
+                    self.stats["timeouts"] += 1
+                    raise AdmissionTimeout(f"no {self.name} slot free after {max_wait:.0f}s")
+                if on_wait is not None:
+                    ahead = self._order().index(ticket) + 1
+                    if ahead != position:
+                        position = ahead
+                        on_wait(self.name, position)
+                self.condition.wait(min(POLL_SECONDS, deadline - now, self.bucket.wait_seconds(now) or POLL_SECONDS))
+                self._dispatch(time.monotonic())
+        if on_wait is not None and position is not None:
+            on_wait(self.name, 0)
+
+    def release(self, user: str):
+        with self.condition:
+            self.active -= 1
+            self.active_by_user[user] -= 1
+            if not self.active_by_user[user]:
+                del self.active_by_user[user]
+            self._dispatch(time.monotonic())
+
+    def queued(self) -> int:
+        with self.condition:
+            return sum(len(queue) for users in self.waiting.values() for queue in users.values())
+
+
+class AdmissionController:
+    """One ProviderQueue per upstream service"""
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None, max_wait: float = MAX_WAIT_SECONDS):
+        merged = {name: dict(values) for name, values in DEFAULT_LIMITS.items()}
+        for name, values in (limits or {}).items():
+            merged.setdefault(name, dict(DEFAULT_LIMITS["openai"])).update(values)
+        self.providers = {name: ProviderQueue(name, **values) for name, values in merged.items()}
+        self.max_wait = max_wait
+
+    @contextmanager
+    def slot(self, provider: str, user: str = "anonymous", priority: str = INTERACTIVE,
+             on_wait: Optional[Callable[[str, int], None]] = None) -> Iterator[None]:
+        queue = self.providers[provider]
+        queue.acquire(user, priority, self.max_wait, on_wait)
+        try:
+            yield
+        finally:
+            queue.release(user)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        report = {}
+        for name, queue in self.providers.items():
+            stats = dict(queue.stats)
+            stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+            stats.update(active=queue.active, waiting=queue.queued())
+            report[name] = stats
+        return report
+
+
+def install(controller: Optional[AdmissionController]):
+    """Make the controller govern every slot() in this process (None turns admission control off)"""
+    global _controller
+    _controller = controller
+
+
+@contextmanager
+def caller(user: str, priority: str = INTERACTIVE,
+           on_wait: Optional[Callable[[str, int], None]] = None) -> Iterator[None]:
+    """Attribute the slot() calls made inside the block (on this thread) to one caller"""
+    token = _caller.set((user, priority, on_wait))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def as_caller(fn: Callable[..., Any], user: str, priority: str = BACKGROUND) -> Callable[..., Any]:
+    """fn wrapped to run as the caller, for work handed to another thread"""
+    def run(*args, **kwargs):
+        with caller(user, priority):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+@contextmanager
+def slot(provider: str) -> Iterator[None]:
+    """Hold one of the provider's slots for the current caller; a no-op unless a controller is installed"""
+    controller = _controller
+    if controller is None:
+        SLOT_WAIT_SECONDS.observe(0.0, provider)
+        yield
+        return
+    user, priority, on_wait = _caller.get() or ("anonymous", INTERACTIVE, None)
+    started = time.perf_counter()
+    with controller.slot(provider, user, priority, on_wait):
+        SLOT_WAIT_SECONDS.observe(time.perf_counter() - started, provider)
+        yield
+
+
+def _report_metric(stat: str) -> Callable[[], Dict[tuple, float]]:
+    return lambda: {(name,): stats[stat] for name, stats in (_controller.report() if _controller else {}).items()}
+
+
+metrics.collect("ppp_slots_active", "Provider slots in use", "gauge", _report_metric("active"), ["provider"])
+metrics.collect("ppp_slots_waiting", "Calls queued for a provider slot", "gauge", _report_metric("waiting"),
+                ["provider"])
+metrics.collect("ppp_slot_timeouts_total", "Calls that gave up waiting for a provider slot", "counter",
+                _report_metric("timeouts"), ["provider"])
@@ -0,0 +1,76 @@
+"""Compact multi-turn context for Cortex Analyst requests."""
+from typing import Any, Dict, List
+
+# Prior user/analyst turn pairs sent with a request, and their rough token budget
+MAX_CONTEXT_TURNS = 3
+MAX_CONTEXT_TOKENS = 1500
+# Analyst prose is trimmed to this many characters; SQL is always kept whole
+MAX_ANALYST_TEXT_CHARS = 300
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)"""
+    return max(len(text) // 4, 1)
+
+
+def _trim(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rstrip() + "…"
+
+
+def compact_analyst_content(content: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep SQL statements, trim prose and drop suggestions"""
+    compacted = []
+    for item in content:
+        if item["type"] == "sql":
+            compacted.append({"type": "sql", "statement": item["statement"]})
+        elif item["type"] == "text" and item.get("text", "").strip():
+            compacted.append({"type": "text", "text": _trim(item["text"], MAX_ANALYST_TEXT_CHARS)})
+    return compacted
+
+
+def _content_tokens(content: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(item.get("text") or item.get("statement", "")) for item in content)
+
+
+def collect_turns(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Pair each structured-search user message with the analyst reply that followed it"""
+    turns = []
+    pending_user = None
+    for message in history:
+        if message.get("model"):
+            # Unstructured Chat answers are not part of the Cortex conversation
+            pending_user = None
+            continue
+        if message["role"] == "user":
+            pending_user = message
+        elif pending_user is not None and message.get("request_id") not in (None, "N/A"):
+            analyst_content = compact_analyst_content(message["content"])
+            if any(item["type"] == "sql" for item in analyst_content):
+                user_text = " ".join(item["text"] for item in pending_user["content"] if item["type"] == "text")
+                turns.append({"user": user_text, "analyst": analyst_content})
+            pending_user = None
+    return turns
+
+
+def build_analyst_messages(history: List[Dict[str, Any]], prompt: str) -> List[Dict[str, Any]]:
+    """Build the Cortex Analyst message list: a bounded window of prior turns plus the new question
+
+    Only turns that produced SQL are kept, newest first until the turn or token budget is
+    exhausted, so the list always alternates user/analyst and ends with the user message.
+    """
+    budget = MAX_CONTEXT_TOKENS - estimate_tokens(prompt)
+    window = []
+    for turn in reversed(collect_turns(history)[-MAX_CONTEXT_TURNS:]):
+        cost = estimate_tokens(turn["user"]) + _content_tokens(turn["analyst"])
+        if cost > budget:
+            break
+        budget -= cost
+        window.insert(0, turn)
+
+    messages = []
+    for turn in window:
+        messages.append({"role": "user", "content": [{"type": "text", "text": turn["user"]}]})
+        messages.append({"role": "analyst", "content": turn["analyst"]})
+    messages.append({"role": "user", "content": [{"type": "text", "text": prompt}]})
+    return messages
@@ -0,0 +1,268 @@
+"""Log of Unstructured Chat answers per question and model, written off the request thread.
+
+log() only enqueues; a background writer drains the queue in batches into a SQLite
+file per month (answers-YYYY-MM.db), keeping the newest `retain_months` files. Rows
+are one per (question, model), so adding or removing a model needs no schema change.
+
+    python answer_log.py latency [--since 2025-06-01]
+    python answer_log.py import multimodel_answers_log.csv
+"""
+import argparse
+import atexit
+import csv
+import glob
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import weakref
+from contextlib import closing
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+import metrics
+
+FLUSH_INTERVAL_SECONDS = 2.0
+FLUSH_BATCH_SIZE = 500
+MAX_QUEUED_ROWS = 10_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    logged_at   TEXT NOT NULL,
+    question_id TEXT NOT NULL,
+    session_id  TEXT,
+    question    TEXT NOT NULL,
+    model       TEXT NOT NULL,
+    answer      TEXT,
+    seconds     REAL,
+    sources     TEXT,
+    error       TEXT,
+    cached      INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_answers_logged ON answers(logged_at);
+"""
+FIELDS = ["logged_at", "question_id", "session_id", "question", "model", "answer", "seconds", "sources", "error",
+          "cached"]
+
+
+class AnswerLog:
+    """Buffered, append-only answer log; log() never blocks on disk"""
+
+    def __init__(self, directory: str = "answer_log", retain_months: int = 12,
+                 flush_interval: float = FLUSH_INTERVAL_SECONDS, max_queued: int = MAX_QUEUED_ROWS):
+        self.directory = directory
+        self.retain_months = retain_months
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_queued)
+        self._flushed = threading.Condition()
+        self._lock = threading.Lock()
+        self._written = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._path: Optional[str] = None
+        self.stats = {"logged": 0, "written": 0, "dropped": 0, "batches": 0, "failed": 0}
+        _logs.add(self)
+        self._writer = threading.Thread(target=self._run, name="answer-log-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def log(self, question: str, answers: Dict[str, Dict[str, Any]], session_id: Optional[str] = None) -> str:
+        """Queue one row per model ({"answer", "time", "sources", "error"?, "cached"?}); returns the question id
+
+        For a reused answer, "time" is how long generating it originally took and "cached" is True.
+        """
+        question_id = uuid.uuid4().hex[:12]
+        logged_at = datetime.now().isoformat(timespec="milliseconds")
+        for model, result in answers.items():
+            row = {
+                "logged_at": logged_at, "question_id": question_id, "session_id": session_id,
+                "question": question, "model": model, "answer": result.get("answer"),
+                "seconds": result.get("time"), "sources": json.dumps(result.get("sources") or []),
+                "error": result.get("error"), "cached": int(bool(result.get("cached"))),
+            }
+            with self._lock:
+                try:
+                    self._queue.put_nowait(row)
+                    self.stats["logged"] += 1
+                except queue.Full:
+                    # Losing a log row is better than stalling a chat answer on a slow disk
+                    self.stats["dropped"] += 1
+        return question_id
+
+    def _connection(self, month: str) -> sqlite3.Connection:
+        path = os.path.join(self.directory, f"answers-{month}.db")
+        if path != self._path:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+            if "cached" not in columns:
+                self._conn.execute("ALTER TABLE answers ADD COLUMN cached INTEGER NOT NULL DEFAULT 0")
+            self._path = path
+            self._prune()
+        return self._conn
+
+    def _prune(self):
+        for path in log_files(self.directory)[:-self.retain_months]:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        by_month: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_month.setdefault(row["logged_at"][:7], []).append(row)
+        for month, month_rows in sorted(by_month.items()):
+            conn = self._connection(month)
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO answers ({', '.join(FIELDS)}) VALUES ({', '.join('?' for _ in FIELDS)})",
+                    [[row[field] for field in FIELDS] for row in month_rows],
+                )
+
+    def _run(self):
+        closing = False
+        while not closing:
+            rows = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < FLUSH_BATCH_SIZE:
+                try:
+                    row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    closing = True
+                    break
+                rows.append(row)
+            if rows:
+                try:
+                    self._write(rows)
+                    self.stats["written"] += len(rows)
+                    self.stats["batches"] += 1
+                except Exception as e:
+                    self.stats["failed"] += len(rows)
+                    print(f"[ANSWER LOG] write of {len(rows)} rows failed: {e}")
+            with self._flushed:
+                self._written += len(rows)
+                self._flushed.notify_all()
+        if self._conn is not None:
+            self._conn.close()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything logged so far is on disk"""
+        target = self.stats["logged"]
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._written < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=10)
+
+    def query(self, since: Optional[str] = None) -> pd.DataFrame:
+        return read_answers(self.directory, since)
+
+
+_logs: "weakref.WeakSet[AnswerLog]" = weakref.WeakSet()
+metrics.collect("ppp_answer_log_rows_total", "Answer log rows by outcome (logged, written, dropped, failed)",
+                "counter", lambda: {(outcome,): sum(log.stats[outcome] for log in list(_logs))
+                                    for outcome in ("logged", "written", "dropped", "failed")}, ["outcome"])
+metrics.collect("ppp_answer_log_queued", "Answer log rows waiting for the writer", "gauge",
+                lambda: {(): sum(log._queue.qsize() for log in list(_logs))})
+
+
+def log_files(directory: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(directory, "answers-*.db")))
+
+
+def read_answers(directory: str, since: Optional[str] = None) -> pd.DataFrame:
+    """Rows from every retained month (since an ISO date or timestamp, when given)"""
+    frames = []
+    for path in log_files(directory):
+        if since and os.path.basename(path)[8:15] < since[:7]:
+            continue
+        with closing(sqlite3.connect(path)) as conn:
+            frames.append(pd.read_sql_query(
+                "SELECT * FROM answers WHERE logged_at >= ? ORDER BY id", conn, params=[since or ""]))
+    if not frames:
+        return pd.DataFrame(columns=["id"] + FIELDS)
+    answers = pd.concat(frames, ignore_index=True)
+    # Months written before the cached column existed only hold generated answers
+    answers["cached"] = answers.get("cached", pd.Series(0, index=answers.index)).fillna(0).astype(bool)
+    return answers
+
+
+def latency_summary(answers: pd.DataFrame) -> pd.DataFrame:
+    """Per model: answers, errors, cache reuses and latency percentiles in seconds of the generated answers"""
+    if answers.empty:
+        return pd.DataFrame(columns=["model", "answers", "errors", "cached", "mean", "p50", "p90", "p99"])
+    grouped = answers.groupby("model")
+    # A reused answer's seconds are its original generation time; counting them again would skew the figures
+    generated = answers.loc[~answers["cached"].astype(bool)].groupby("model")["seconds"]
+    summary = pd.DataFrame({
+        "answers": grouped.size(),
+        "errors": grouped["error"].apply(lambda errors: errors.notna().sum()),
+        "cached": grouped["cached"].apply(lambda cached: cached.astype(bool).sum()),
+        "mean": generated.mean(),
+        "p50": generated.quantile(0.5),
+        "p90": generated.quantile(0.9),
+        "p99": generated.quantile(0.99),
+    })
+    return summary.sort_values("p50").reset_index()
+
+
+def import_csv(log: AnswerLog, path: str) -> int:
+    """Load the old multimodel_answers_log.csv (a "<model> Answer/Time/Sources" column triple per model)"""
+    with open(path, newline="") as f:
+        rows = list(csv.reader(f))
+    if not rows:
+        return 0
+    header, imported = rows[0], 0
+    models = [column[:-len(" Answer")] for column in header[1::3]]
+    for row in rows[1:]:
+        answers = {
+            model: {"answer": row[1 + 3 * i], "time": float(row[2 + 3 * i] or "nan"),
+                    "sources": [s for s in row[3 + 3 * i].split("; ") if s]}
+            for i, model in enumerate(models) if len(row) > 3 + 3 * i
+        }
+        log.log(row[0], answers)
+        imported += 1
+    log.flush()
+    return imported
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Query or import the Unstructured Chat answer log")
+    parser.add_argument("--dir", default=os.getenv("ANSWER_LOG_DIR", "answer_log"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    latency = commands.add_parser("latency", help="latency percentiles per model")
+    latency.add_argument("--since", help="ISO date or timestamp")
+    legacy = commands.add_parser("import", help="import a multimodel_answers_log.csv")
+    legacy.add_argument("csv")
+    args = parser.parse_args(argv)
+
+    if args.command == "latency":
+        print(latency_summary(read_answers(args.dir, args.since)).to_string(index=False))
+        return
+    log = AnswerLog(args.dir)
+    print(f"{import_csv(log, args.csv)} questions imported into {args.dir}")
+    log.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""Tail latency of ordinary sessions while one session floods a provider, with and without admission control.
+
+Usage (from the repository root):
+
+    python -m benchmarks.admission --users 10 --flood 30 --seconds 15
+
+The provider is simulated: it serves `--capacity` calls at the base latency, slows down
+proportionally beyond that and rejects calls past twice its capacity (like a 429), which
+the caller retries after a short backoff. Ordinary sessions ask, read for a moment and ask
+again; the flooding session keeps `--flood` requests in flight (suggestion clicks and
+prefetches). Latency is measured from the call to its answer, queueing included.
+"""
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from admission import BACKGROUND, INTERACTIVE, AdmissionController, AdmissionTimeout, caller, install, slot
+from benchmarks.load_test import percentile
+
+RETRY_BACKOFF_SECONDS = 0.5
+MAX_ATTEMPTS = 4
+
+
+class SaturatingService:
+    """Latency grows with calls in flight past capacity; past twice capacity calls are rejected"""
+
+    def __init__(self, capacity: int, latency: float):
+        self.capacity = capacity
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def call(self) -> bool:
+        with self._lock:
+            if self.in_flight >= 2 * self.capacity:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            load = self.in_flight
+        time.sleep(self.latency * max(1.0, load / self.capacity) * random.uniform(0.8, 1.2))
+        with self._lock:
+            self.in_flight -= 1
+        return True
+
+
+def request(service: SaturatingService) -> bool:
+    """One upstream call with the client's retries; False when every attempt was rejected"""
+    for attempt in range(MAX_ATTEMPTS):
+        with slot("cortex"):
+            if service.call():
+                return True
+        time.sleep(RETRY_BACKOFF_SECONDS * (attempt + 1))
+    return False
+
+
+def session(service: SaturatingService, user: str, priority: str, think: float, until: float,
+            latencies: List[float], outcomes: Dict[str, int], lock: threading.Lock):
+    with caller(user, priority):
+        while time.monotonic() < until:
+            started = time.monotonic()
+            try:
+                outcome = "ok" if request(service) else "failed"
+            except AdmissionTimeout:
+                outcome = "busy"
+            with lock:
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+                if outcome == "ok":
+                    latencies.append(time.monotonic() - started)
+            time.sleep(think * random.uniform(0.5, 1.5))
+
+
+def run(args: argparse.Namespace, controller: Optional[AdmissionController]) -> Dict[str, Dict[str, float]]:
+    install(controller)
+    service = SaturatingService(args.capacity, args.latency)
+    until = time.monotonic() + args.seconds
+    lock = threading.Lock()
+    groups = {"ordinary": ([], {}), "flooding": ([], {})}
+    threads = [
+        threading.Thread(target=session, args=(service, f"user-{i}", INTERACTIVE, args.think, until, *groups["ordinary"], lock))
+        for i in range(args.users)
+    ] + [
+        # All flood requests come from one session; its prefetches are background work
+        threading.Thread(target=session, args=(service, "flooder", BACKGROUND if i % 2 else INTERACTIVE, 0.0, until,
+                                               *groups["flooding"], lock))
+        for i in range(args.flood)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    install(None)
+    summary = {}
+    for name, (latencies, outcomes) in groups.items():
+        summary[name] = {
+            "answered": outcomes.get("ok", 0),
+            "failed": outcomes.get("failed", 0) + outcomes.get("busy", 0),
+            "p50": statistics.median(latencies) if latencies else float("nan"),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        }
+    summary["provider"] = {"peak_in_flight": service.peak, "rejected": service.rejected}
+    return summary
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="ordinary sessions")
+    parser.add_argument("--flood", type=int, default=30, help="requests the flooding session keeps in flight")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--capacity", type=int, default=8, help="calls the provider serves at full speed")
+    parser.add_argument("--latency", type=float, default=0.4, help="provider seconds per call when not saturated")
+    parser.add_argument("--think", type=float, default=1.0, help="seconds an ordinary user reads an answer")
+    parser.add_argument("--rate", type=float, default=30.0, help="provider calls/second admitted")
+    args = parser.parse_args(argv)
+
+    limits = {"cortex": {"concurrency": args.capacity, "per_user": 2, "rate": args.rate, "burst": args.rate}}
+    results = {
+        "no admission control": run(args, None),
+        "fair queueing": run(args, AdmissionController(limits, max_wait=args.seconds)),
+    }
+    print(f"{args.users} sessions + 1 session with {args.flood} requests in flight, provider capacity "
+          f"{args.capacity}, {args.seconds:.0f}s each")
+    print(f"{'':<22}{'group':<10}{'answered':>9}{'failed':>8}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}"
+          f"{'peak':>6}{'429s':>6}")
+    for name, summary in results.items():
+        provider = summary["provider"]
+        for group in ("ordinary", "flooding"):
+            row = summary[group]
+            print(f"{name if group == 'ordinary' else '':<22}{group:<10}{row['answered']:>9}{row['failed']:>8}"
+                  f"{row['p50']:>8.2f}{row['p95']:>8.2f}{row['p99']:>8.2f}"
+                  + (f"{provider['peak_in_flight']:>6}{provider['rejected']:>6}" if group == "ordinary" else ""))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
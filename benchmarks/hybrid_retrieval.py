@@ -0,0 +1,189 @@
+"""Recall@4 and latency of hybrid (BM25 + vector, fused and reranked) retrieval against similarity-only.
+
+Usage (from the repository root):
+
+    python -m benchmarks.hybrid_retrieval --projects 150 --depths 10,20,50
+
+The synthetic corpus has one chunk per project and topic (status, risks, budget, ...),
+each naming a project code ("PRJ-1042") and an integration ("Bynder-Matillion") and
+describing its subject area with one of several synonyms. The stand-in embedding is
+semantic the way real ones are: synonyms share a direction, while identifiers and
+filler words contribute only a weak hashed component. Two query sets are scored:
+
+- by name: "What is the status of the Bynder-Matillion integration?" (one relevant chunk)
+- by meaning: "Any open concerns about invoice work?" with different synonyms than the
+  text, no project named (every chunk of that topic and subject area is relevant)
+
+Latency is per query, local embedding included; in the app the OpenAI embedding call
+(the same for both retrievers) comes on top.
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+import numpy as np
+
+from benchmarks.load_test import percentile
+from file_index import LocalFileIndex, content_hash
+from hybrid_search import HybridRetriever, LexicalIndex, local_vector_search
+
+DIMENSIONS = 256
+VENDORS = [
+    "Concur", "Bynder", "Matillion", "Workday", "Salesforce", "SharePoint", "Coupa", "Okta", "ServiceNow",
+    "Jira", "Tableau", "NetSuite", "Zendesk", "Marketo", "Dynamics", "Ariba", "Kronos", "DocuSign",
+    "Greenhouse", "Anaplan",
+]
+TOPICS = {
+    "status": ["status", "progress", "update", "standing"],
+    "risk": ["risk", "concern", "blocker", "issue"],
+    "budget": ["budget", "cost", "spend", "funding"],
+    "timeline": ["timeline", "schedule", "deadline", "milestone"],
+    "owner": ["owner", "lead", "sponsor", "contact"],
+    "scope": ["scope", "requirement", "deliverable", "feature"],
+}
+SUBJECTS = {
+    "expenses": ["expense", "reimbursement", "receipt", "travel"],
+    "assets": ["asset", "image", "media", "artwork"],
+    "payroll": ["payroll", "salary", "wage", "compensation"],
+    "identity": ["identity", "login", "authentication", "password"],
+    "invoices": ["invoice", "billing", "payable", "remittance"],
+    "hiring": ["hiring", "recruiting", "candidate", "interview"],
+    "contracts": ["contract", "agreement", "signature", "clause"],
+    "forecast": ["forecast", "projection", "planning", "scenario"],
+    "tickets": ["ticket", "incident", "helpdesk", "escalation"],
+    "campaigns": ["campaign", "marketing", "lead generation", "audience"],
+    "reporting": ["reporting", "dashboard", "visualization", "metric"],
+    "warehouse": ["pipeline", "ingestion", "warehouse", "transformation"],
+}
+FILLER = [
+    "The team met on Tuesday to walk through the open items.",
+    "Notes from the weekly sync are attached below.",
+    "Follow-up actions were assigned during the review.",
+    "The vendor confirmed the details by email.",
+    "This page is updated after every steering meeting.",
+    "Questions should go to the shared channel.",
+    "The previous version of this document is archived.",
+    "Stakeholders from finance and IT attended.",
+]
+
+
+class ConceptEmbedding:
+    """Synonyms share one direction; every other word adds a weak hashed direction"""
+
+    def __init__(self, identifier_weight: float, dimensions: int = DIMENSIONS):
+        self.identifier_weight = identifier_weight
+        self.dimensions = dimensions
+        self.concepts = {
+            word: group for groups in (TOPICS, SUBJECTS) for group, words in groups.items()
+            for phrase in words for word in phrase.split()
+        }
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    def _direction(self, name: str) -> np.ndarray:
+        if name not in self._vectors:
+            seed = int.from_bytes(hashlib.md5(name.encode()).digest()[:4], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            self._vectors[name] = vector / np.linalg.norm(vector)
+        return self._vectors[name]
+
+    def __call__(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in "".join(c if c.isalnum() else " " for c in text.lower()).split():
+            if len(word) > 3 and word.endswith("s") and word[:-1] in self.concepts:
+                word = word[:-1]
+            if word in self.concepts:
+                vector += self._direction(f"concept:{self.concepts[word]}")
+            else:
+                vector += self.identifier_weight * self._direction(word)
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+
+def build_corpus(projects: int, seed: int) -> Tuple[List[Dict], List[Tuple[str, Set[str], str]]]:
+    """Chunks, and (query, relevant chunk ids, query set) triples"""
+    rng = random.Random(seed)
+    pairs = rng.sample([(a, b) for a in VENDORS for b in VENDORS if a != b], projects)
+    chunks, queries = [], []
+    by_meaning: Dict[Tuple[str, str], Set[str]] = {}
+    for number, (a, b) in enumerate(pairs):
+        code = f"PRJ-{1000 + number}"
+        subject = rng.choice(list(SUBJECTS))
+        for chunk_index, topic in enumerate(TOPICS):
+            words = SUBJECTS[subject]
+            text = (f"{code} {a}-{b} integration. The {rng.choice(TOPICS[topic])} of the {rng.choice(words)} "
+                    f"work was discussed, covering {rng.choice(words)} handling between {a} and {b}. "
+                    + " ".join(rng.sample(FILLER, 2)))
+            chunk_id = hashlib.sha1(f"{code}:{chunk_index}".encode()).hexdigest()
+            chunks.append({"id": chunk_id, "content": text, "content_hash": content_hash(text),
+                           "filename": f"{code}.docx", "chunk_index": chunk_index, "source_page": 1})
+            by_meaning.setdefault((topic, subject), set()).add(chunk_id)
+            if rng.random() < 0.3:
+                name = rng.choice([f"the {a}-{b} integration", f"{code}", f"{a} {b}"])
+                queries.append((f"What is the {rng.choice(TOPICS[topic])} of {name}?", {chunk_id}, "by name"))
+    for (topic, subject), relevant in sorted(by_meaning.items()):
+        queries.append((f"Any open {rng.choice(TOPICS[topic])} about {rng.choice(SUBJECTS[subject])} work?",
+                        relevant, "by meaning"))
+    return chunks, queries
+
+
+def evaluate(search: Callable[[str], List[Dict]], queries: List[Tuple[str, Set[str], str]],
+             ids: Dict[Tuple[str, int], str]) -> Dict[str, Dict[str, float]]:
+    hits: Dict[str, List[bool]] = {}
+    latencies = []
+    for query, relevant, kind in queries:
+        started = time.perf_counter()
+        results = search(query)
+        latencies.append(time.perf_counter() - started)
+        found = {ids[(hit["filename"], hit["chunk_index"])] for hit in results[:4]}
+        hits.setdefault(kind, []).append(bool(found & relevant))
+    summary = {kind: sum(values) / len(values) for kind, values in hits.items()}
+    summary["all"] = sum(sum(values) for values in hits.values()) / len(queries)
+    summary["p50_ms"] = statistics.median(latencies) * 1000
+    summary["p95_ms"] = percentile(latencies, 95) * 1000
+    return summary
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=150, help="projects (6 chunks each)")
+    parser.add_argument("--depths", default="10,20,50", help="candidate depths to try for the hybrid retriever")
+    parser.add_argument("--identifier-weight", type=float, default=0.3,
+                        help="embedding weight of words outside the synonym groups")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    embed = ConceptEmbedding(args.identifier_weight)
+    chunks, queries = build_corpus(args.projects, args.seed)
+    directory = tempfile.mkdtemp(prefix="ppp_hybrid_")
+    index = LocalFileIndex(os.path.join(directory, "file_index.db"))
+    index.upsert([{**chunk, "content_vector": embed(chunk["content"])} for chunk in chunks])
+    lexical = LexicalIndex(os.path.join(directory, "lexical_index.db"))
+    lexical.sync(chunks)
+    ids = {(chunk["filename"], chunk["chunk_index"]): chunk["id"] for chunk in chunks}
+    vector_search = local_vector_search(index, embed)
+    # Warm both in-memory indexes so the first query does not pay for loading them
+    vector_search("warm up", 1)
+    lexical.search("warm up", 1)
+
+    results = {"similarity only": evaluate(lambda query: vector_search(query, 4), queries, ids)}
+    for depth in [int(value) for value in args.depths.split(",")]:
+        hybrid = HybridRetriever(vector_search, lexical, depth=depth, k=4)
+        results[f"hybrid, depth {depth}"] = evaluate(hybrid.search, queries, ids)
+
+    kinds = sorted({kind for _, _, kind in queries})
+    counts = {kind: sum(1 for _, _, k in queries if k == kind) for kind in kinds}
+    print(f"{len(chunks)} chunks, {len(queries)} queries ("
+          + ", ".join(f"{counts[kind]} {kind}" for kind in kinds) + ")")
+    print(f"{'':<20}" + "".join(f"{'R@4 ' + kind:>16}" for kind in kinds) + f"{'R@4 all':>10}{'p50 ms':>9}{'p95 ms':>9}")
+    for name, summary in results.items():
+        print(f"{name:<20}" + "".join(f"{summary[kind]:>16.1%}" for kind in kinds)
+              + f"{summary['all']:>10.1%}{summary['p50_ms']:>9.2f}{summary['p95_ms']:>9.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
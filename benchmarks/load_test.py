@@ -0,0 +1,236 @@
+"""Simulate concurrent analyst sessions against local stand-ins and report throughput/latency/memory.
+
+Usage (from the repository root):
+
+    python -m benchmarks.load_test --sessions 50 --questions 3 --rows 5000
+
+Each simulated session is a headless Streamlit AppTest of new_UI_Vn.py; asking a question goes
+through process_message()/display_content() exactly as in the browser, and a follow-up plain
+rerun measures the cost of re-rendering the history.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.mock_services import MockSettings, SUGGESTIONS, install_fake_snowflake, start_mock_server
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "new_UI_Vn.py")
+
+FOLLOW_UP = "Now break that down by sector"
+
+SECRETS = {
+    "database": "BRIDGEHORN_SANDBOX", "schema": "CORTEX_ANALYST", "stage": "MODELS",
+    "yaml_name": "pppcdmai.yaml", "warehouse": "BENCH_WH", "host": "localhost",
+    "account": "bench", "user_name": "bench", "password": "bench", "role": "BENCH",
+}
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def session_state_bytes(state: Any) -> int:
+    """Approximate footprint of cached results and history held in one session"""
+    import json
+    total = 0
+    try:
+        for result in state["result_cache"].values():
+            # Spilled results keep only a memory-mapped file
+            if result["df"] is not None:
+                total += result["memory_bytes"] + result["arrow"].nbytes
+    except KeyError:
+        pass
+    try:
+        total += len(json.dumps(list(state["messages"]), default=str))
+    except KeyError:
+        pass
+    return total
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def share_script_bytecode():
+    """Compile the app once per process, as the real server does
+
+    AppTest builds a fresh ScriptCache on every run, so concurrent sessions would call
+    ast.parse in parallel, which is not thread-safe on CPython 3.11.
+    """
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    compile_script = ScriptCache.get_bytecode
+    compiled: Dict[str, Any] = {}
+    compile_lock = threading.Lock()
+
+    def get_bytecode(self, script_path: str) -> Any:
+        with compile_lock:
+            if script_path not in compiled:
+                compiled[script_path] = compile_script(self, script_path)
+            return compiled[script_path]
+
+    ScriptCache.get_bytecode = get_bytecode
+
+
+def install_secrets():
+    """Install the benchmark secrets process-wide
+
+    Setting AppTest.secrets swaps the global st.secrets for the duration of each run,
+    which races between concurrent sessions.
+    """
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    secrets = Secrets()
+    secrets._secrets = dict(SECRETS)
+    st.secrets = secrets
+
+
+def start_stand_ins(settings: MockSettings):
+    """Start the mock HTTP server, point the app at it and install the fake Snowflake connector"""
+    server = start_mock_server(settings)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    workdir = tempfile.mkdtemp(prefix="ppp_bench_")
+    os.environ.update({
+        "CORTEX_BASE_URL": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_API_KEY": "sk-mock",
+        "CONVERSATION_DB_PATH": os.path.join(workdir, "conversations.db"),
+        "SEMANTIC_CACHE_DB_PATH": os.path.join(workdir, "semantic_cache.db"),
+        "USAGE_DB_PATH": os.path.join(workdir, "usage.db"),
+        "ANSWER_LOG_DIR": os.path.join(workdir, "answer_log"),
+    })
+    install_fake_snowflake(settings)
+    share_script_bytecode()
+    install_secrets()
+    return server
+
+
+def session_questions() -> List[str]:
+    """The app's sample questions, then a follow-up that needs the conversation's context"""
+    # Imported late: structured_pipeline reads its settings at import, after start_stand_ins() set them
+    from structured_pipeline import SAMPLE_QUESTIONS
+
+    return SAMPLE_QUESTIONS + [FOLLOW_UP]
+
+
+def new_session(timeout: float):
+    """A fresh headless browser session of the app"""
+    from streamlit.testing.v1 import AppTest
+
+    return AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+
+def run_session(session_index: int, questions: int, timeout: float, results: Dict[str, List[float]],
+                lock: threading.Lock, follow_suggestions: bool = False) -> Dict[str, Any]:
+    app = new_session(timeout)
+
+    timings: Dict[str, List[float]] = {"initial_load": [], "question": [], "suggestion": [], "rerun": []}
+    errors = 0
+
+    start = time.perf_counter()
+    app.run()
+    timings["initial_load"].append(time.perf_counter() - start)
+    errors += len(app.exception)
+
+    pool = session_questions()
+    for turn in range(questions):
+        kind = "suggestion" if follow_suggestions and turn > 0 else "question"
+        if kind == "suggestion":
+            # Same path as clicking the suggestion button: process_message(suggestion)
+            question = SUGGESTIONS[(session_index + turn) % len(SUGGESTIONS)]
+            # Give the background prefetch the think time an analyst would
+            time.sleep(1.0)
+        else:
+            question = pool[(session_index + turn) % len(pool)]
+        start = time.perf_counter()
+        app.chat_input(key="chat_input").set_value(question).run()
+        timings[kind].append(time.perf_counter() - start)
+        errors += len(app.exception)
+
+        start = time.perf_counter()
+        app.run()
+        timings["rerun"].append(time.perf_counter() - start)
+        errors += len(app.exception)
+
+    with lock:
+        for kind, values in timings.items():
+            results.setdefault(kind, []).extend(values)
+    prefetch = [c.value for c in app.sidebar.caption if c.value.startswith("Prefetch hit rate")]
+    return {"errors": errors, "state_bytes": session_state_bytes(app.session_state),
+            "prefetch": prefetch[0] if prefetch else None}
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated analysts")
+    parser.add_argument("--questions", type=int, default=3, help="questions asked per session")
+    parser.add_argument("--rows", type=int, default=1000, help="rows in each synthetic result set")
+    parser.add_argument("--cortex-latency", type=float, default=0.5)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--sql-latency", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=120, help="per-interaction script timeout")
+    parser.add_argument("--follow-suggestions", action="store_true",
+                        help="after the first question, ask Cortex's suggested follow-ups with prefetch enabled")
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(cortex_latency=args.cortex_latency, llm_latency=args.llm_latency,
+                            sql_latency=args.sql_latency, rows=args.rows)
+    server = start_stand_ins(settings)
+    if args.follow_suggestions:
+        os.environ["PREFETCH_SUGGESTIONS"] = "1"
+
+    results: Dict[str, List[float]] = {}
+    lock = threading.Lock()
+    rss_before = rss_bytes()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        sessions = list(pool.map(
+            lambda i: run_session(i, args.questions, args.timeout, results, lock, args.follow_suggestions),
+            range(args.sessions)
+        ))
+    wall = time.perf_counter() - wall_start
+    rss_after = rss_bytes()
+    server.shutdown()
+
+    questions_answered = len(results.get("question", []))
+    print(f"Sessions: {args.sessions}  questions/session: {args.questions}  rows/result: {args.rows}")
+    print(f"Wall time: {wall:.2f}s  throughput: {questions_answered / wall:.2f} questions/s "
+          f"({questions_answered / wall * 60:.1f}/min)")
+    print(f"{'interaction':<14}{'count':>7}{'p50 (s)':>10}{'p95 (s)':>10}{'max (s)':>10}")
+    for kind in ("initial_load", "question", "suggestion", "rerun"):
+        values = results.get(kind, [])
+        if values:
+            print(f"{kind:<14}{len(values):>7}{statistics.median(values):>10.3f}"
+                  f"{percentile(values, 95):>10.3f}{max(values):>10.3f}")
+    state_sizes = [s["state_bytes"] for s in sessions]
+    print(f"Memory: RSS delta {(rss_after - rss_before) / 2**20:.1f} MiB "
+          f"(~{(rss_after - rss_before) / max(args.sessions, 1) / 2**20:.2f} MiB/session), "
+          f"session state mean {statistics.mean(state_sizes) / 2**20:.2f} MiB")
+    print(f"Upstream calls: {settings.counts}")
+    if args.follow_suggestions:
+        print(sessions[-1]["prefetch"])
+    print(f"Script errors: {sum(s['errors'] for s in sessions)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""Local stand-ins for Cortex Analyst, the OpenAI API, the Snowflake connector and a shared cache.
+
+The HTTP stand-ins run in a background thread on localhost; point the app at them with
+CORTEX_BASE_URL and OPENAI_BASE_URL. The Snowflake stand-in replaces
+snowflake.connector.connect in-process and serves synthetic result sets. The key-value
+stand-in speaks the Redis protocol subset the shared cache uses (CACHE_URL).
+"""
+import base64
+import hashlib
+import json
+import random
+import socketserver
+import struct
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+EMBEDDING_DIMENSIONS = 256
+
+DEFAULT_SQL = (
+    "SELECT c.COMPANY_NAME, c.SECTOR, o.CLOSE_DATE, COUNT(o.OPPORTUNITY_ID) AS DEAL_COUNT, "
+    "SUM(o.AMOUNT) AS DEAL_VALUE FROM PPP_CDM_COMPANY c JOIN PPP_CDM_OPPORTUNITIES o "
+    "ON o.COMPANY_ID = c.COMPANY_ID GROUP BY 1, 2, 3"
+)
+
+SUGGESTIONS = ["Break that down by sector", "Show the trend by month", "Which companies closed the most deals?"]
+
+SECTORS = ["Healthcare", "Industrials", "Technology", "Consumer", "Financials", "Energy"]
+
+
+class MockSettings:
+    """Latencies (seconds) and result shape shared by all stand-ins"""
+
+    def __init__(self, cortex_latency: float = 0.5, llm_latency: float = 0.3, sql_latency: float = 0.2,
+                 rows: int = 1000, embedding_latency: float = 0.05):
+        self.cortex_latency = cortex_latency
+        self.llm_latency = llm_latency
+        self.sql_latency = sql_latency
+        self.embedding_latency = embedding_latency
+        self.rows = rows
+        self.counts: Dict[str, int] = {}
+        # Query id -> rows, shared by every connection like Snowflake's result cache is per user
+        self.results: Dict[str, List[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def fake_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> List[float]:
+    """Deterministic hashed bag-of-words embedding so similar questions land close together"""
+    vector = [0.0] * dimensions
+    for token in text.lower().split():
+        token = token.strip("?.,!")
+        if len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        digest = hashlib.md5(token.encode()).digest()
+        vector[int.from_bytes(digest[:2], "little") % dimensions] += 1.0 if digest[2] % 2 else -1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    settings: MockSettings
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.settings.count("openai_models")
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "mock"}
+                for model in ("o3-mini", "text-embedding-3-small")
+            ]})
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.rstrip("/")
+        if path.endswith("/api/v2/cortex/analyst/message"):
+            self._cortex(body)
+        elif path.endswith("/chat/completions"):
+            self._chat(body)
+        elif path.endswith("/embeddings"):
+            self._embeddings(body)
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def _cortex(self, body: Dict[str, Any]):
+        self.settings.count("cortex")
+        time.sleep(self.settings.cortex_latency)
+        question = body["messages"][-1]["content"][0]["text"]
+        content = [
+            {"type": "text", "text": f"This is our interpretation of your question: {question[:200]}"},
+            {"type": "sql", "statement": DEFAULT_SQL},
+            {"type": "suggestions", "suggestions": SUGGESTIONS},
+        ]
+        request_id = hashlib.md5(f"{question}{time.time()}".encode()).hexdigest()
+        self._send_json(200, {"message": {"role": "analyst", "content": content}},
+                        headers={"X-Snowflake-Request-Id": request_id})
+
+    def _chat(self, body: Dict[str, Any]):
+        self.settings.count("openai_chat")
+        time.sleep(self.settings.llm_latency)
+        prompt = body["messages"][-1]["content"]
+        answer = "Mock answer: " + " ".join(str(prompt).split()[-20:])
+        prompt_tokens = len(str(prompt)) // 4
+        completion_tokens = len(answer) // 4
+        self._send_json(200, {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def _embeddings(self, body: Dict[str, Any]):
+        self.settings.count("openai_embeddings")
+        time.sleep(self.settings.embedding_latency)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(str(text), body.get("dimensions") or EMBEDDING_DIMENSIONS)
+            if body.get("encoding_format") == "base64":
+                encoded: Any = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode()
+            else:
+                encoded = vector
+            data.append({"object": "embedding", "index": index, "embedding": encoded})
+        tokens = sum(len(str(text)) // 4 for text in inputs)
+        self._send_json(200, {"object": "list", "data": data, "model": body.get("model", "mock"),
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+
+def start_mock_server(settings: MockSettings, port: int = 0) -> ThreadingHTTPServer:
+    """Serve the Cortex Analyst and OpenAI stand-ins on localhost; returns the running server"""
+    handler = type("MockHandler", (_Handler,), {"settings": settings})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_rows(rows: int, seed: int = 7) -> List[tuple]:
+    rng = random.Random(seed)
+    start = date(2022, 1, 1)
+    return [
+        (
+            f"Company {rng.randint(1, max(rows // 10, 5))}",
+            rng.choice(SECTORS),
+            start + timedelta(days=rng.randint(0, 900)),
+            rng.randint(1, 40),
+            Decimal(rng.randint(10_000, 5_000_000)) / 100,
+        )
+        for _ in range(rows)
+    ]
+
+
+class FakeCursor:
+    description = [("COMPANY_NAME",), ("SECTOR",), ("CLOSE_DATE",), ("DEAL_COUNT",), ("DEAL_VALUE",)]
+
+    def __init__(self, connection: "FakeSnowflakeConnection"):
+        self.connection = connection
+        self.sfqid: Optional[str] = None
+        self._rows: List[tuple] = []
+
+    def execute(self, sql: str, params: Any = None, **kwargs):
+        settings = self.connection.settings
+        if sql.upper().startswith("EXPLAIN"):
+            # Compiled only: a plan scanning every synthetic row, with the statement's joins
+            settings.count("snowflake_explain")
+            joins = sql.upper().split().count("JOIN")
+            stats = {"partitionsTotal": 1, "partitionsAssigned": 1, "bytesAssigned": 100 * settings.rows}
+            plan = {"GlobalStats": stats,
+                    "Operations": [[{"id": 0, "operation": "TableScan", "objects": ["SYNTHETIC"]}]
+                                   + [{"id": i + 1, "operation": "InnerJoin"} for i in range(joins)]]}
+            self._rows = [(json.dumps(plan),)]
+            return self
+        settings.count("snowflake_execute")
+        if self.connection.connect_kwargs.get("warehouse"):
+            settings.count(f"snowflake_execute:{self.connection.connect_kwargs['warehouse']}")
+        time.sleep(settings.sql_latency)
+        self.sfqid = hashlib.md5(f"{sql}{time.time()}".encode()).hexdigest()
+        self._rows = self.connection.rows
+        self.connection.results[self.sfqid] = self._rows
+        return self
+
+    def get_results_from_sfqid(self, sfqid: str):
+        """Served from the stored result: no warehouse time, like Snowflake's 24-hour result cache"""
+        self.connection.settings.count("snowflake_result_fetch")
+        if sfqid not in self.connection.results:
+            raise RuntimeError(f"Result for query {sfqid} has expired")
+        self.sfqid = sfqid
+        self._rows = self.connection.results[sfqid]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
+
+
+class _FakeRest:
+    token = "mock-session-token"
+
+
+class FakeSnowflakeConnection:
+    def __init__(self, settings: MockSettings, **connect_kwargs):
+        self.settings = settings
+        self.connect_kwargs = connect_kwargs
+        self.rest = _FakeRest()
+        self.rows = synthetic_rows(settings.rows)
+        self.results = settings.results
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def install_fake_snowflake(settings: MockSettings):
+    """Replace snowflake.connector.connect in this process with the synthetic stand-in"""
+    import snowflake.connector
+
+    snowflake.connector.connect = lambda **kwargs: FakeSnowflakeConnection(settings, **kwargs)
+
+
+class _KeyValueHandler(socketserver.StreamRequestHandler):
+    """GET, SET [EX|PX n] [NX], DEL, PING, AUTH and SELECT over the Redis protocol"""
+    settings: MockSettings
+    store: Dict[bytes, tuple]
+    lock: threading.Lock
+
+    def _command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        parts = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return parts
+
+    def handle(self):
+        while True:
+            parts = self._command()
+            if parts is None:
+                return
+            name = parts[0].upper().decode()
+            self.settings.count(f"kv_{name.lower()}")
+            now = time.time()
+            with self.lock:
+                if name == "GET":
+                    entry = self.store.get(parts[1])
+                    if entry and entry[1] is not None and entry[1] < now:
+                        self.store.pop(parts[1], None)
+                        entry = None
+                    reply = b"$-1\r\n" if entry is None else b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+                elif name == "SET":
+                    options = [option.upper() for option in parts[3:]]
+                    expires = None
+                    if b"PX" in options:
+                        expires = now + int(parts[3 + options.index(b"PX") + 1]) / 1000
+                    elif b"EX" in options:
+                        expires = now + int(parts[3 + options.index(b"EX") + 1])
+                    current = self.store.get(parts[1])
+                    live = current is not None and (current[1] is None or current[1] >= now)
+                    if b"NX" in options and live:
+                        reply = b"$-1\r\n"
+                    else:
+                        self.store[parts[1]] = (parts[2], expires)
+                        reply = b"+OK\r\n"
+                elif name == "DEL":
+                    reply = b":%d\r\n" % sum(self.store.pop(key, None) is not None for key in parts[1:])
+                elif name == "PING":
+                    reply = b"+PONG\r\n"
+                elif name in ("AUTH", "SELECT"):
+                    reply = b"+OK\r\n"
+                else:
+                    reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+def start_mock_kv_server(settings: MockSettings, port: int = 0) -> socketserver.ThreadingTCPServer:
+    """Serve the key-value stand-in on localhost; CACHE_URL=redis://127.0.0.1:<port>/0"""
+    handler = type("KeyValueHandler", (_KeyValueHandler,), {
+        "settings": settings, "store": {}, "lock": threading.Lock(),
+    })
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
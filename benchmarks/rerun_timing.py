@@ -0,0 +1,74 @@
+"""Per-interaction rerun cost of a result card widget with a long history, with and without fragments.
+
+Usage (from the repository root):
+
+    python -m benchmarks.rerun_timing --questions 12 --trials 10
+
+Builds a session with 2 x --questions messages, then repeatedly changes the chart type of the
+newest result card, in two sessions:
+
+- before: RESULT_CARD_FRAGMENT=0, so every change reruns the whole script; timed end to end.
+- after: render_result_card() is a fragment, so in a browser only that card reruns. AppTest
+  cannot rerun a fragment alone, so this is the card's own render time
+  (st.session_state.card_render_times), without Streamlit's per-rerun overhead.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from chart_profile import CHART_TYPES
+from benchmarks.load_test import new_session, percentile, session_questions, start_stand_ins
+from benchmarks.mock_services import MockSettings
+
+
+def time_chart_changes(args: argparse.Namespace, fragment: bool) -> Dict[str, List[float]]:
+    """Wall time of each chart type change and the card's own render time, in a fresh session"""
+    # The app reads RESULT_CARD_FRAGMENT on every script run
+    os.environ["RESULT_CARD_FRAGMENT"] = "1" if fragment else "0"
+    app = new_session(args.timeout)
+    app.run()
+    pool = session_questions()
+    for turn in range(args.questions):
+        app.chat_input(key="chat_input").set_value(f"{pool[turn % len(pool)]} #{turn}").run()
+    app.run()
+
+    message_id = app.session_state["messages"][-1]["id"]
+    timings: Dict[str, List[float]] = {"script": [], "card": []}
+    for trial in range(args.trials):
+        chart_type = CHART_TYPES[(trial + 1) % len(CHART_TYPES)]
+        start = time.perf_counter()
+        app.selectbox(key=f"chart_type_{message_id}").set_value(chart_type).run()
+        timings["script"].append(time.perf_counter() - start)
+        timings["card"].append(app.session_state["card_render_times"][message_id])
+    if app.exception:
+        print(f"{len(app.exception)} script errors with RESULT_CARD_FRAGMENT={int(fragment)}")
+    return timings
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=12, help="questions asked to build history")
+    parser.add_argument("--trials", type=int, default=10, help="chart type changes to time")
+    parser.add_argument("--rows", type=int, default=1000, help="rows in each synthetic result set")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(cortex_latency=0.0, llm_latency=0.0, sql_latency=0.0, rows=args.rows,
+                            embedding_latency=0.0)
+    server = start_stand_ins(settings)
+    before = time_chart_changes(args, fragment=False)
+    after = time_chart_changes(args, fragment=True)
+    server.shutdown()
+
+    print(f"History: {args.questions * 2} messages, {args.rows} rows per result")
+    print(f"{'interaction cost':<36}{'p50 (ms)':>10}{'p95 (ms)':>10}")
+    for label, values in (("before: full rerun, no fragments", before["script"]),
+                          ("after: card fragment (render time)", after["card"])):
+        print(f"{label:<36}{statistics.median(values) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Memory held per cached result before and after compaction / spilling.
+
+Usage (from the repository root):
+
+    python -m benchmarks.result_memory --rows 10000 100000
+
+Builds results shaped like Snowflake returns them for the PPP_CDM tables (VARCHAR ids, stages
+and free text as strings, NUMBER as Decimal, DATE as datetime.date, BOOLEAN) and compares the
+old representation (raw frame + chart copy + Arrow copy) with the compacted one, and with the
+spilled one (memory-mapped Arrow file, nothing on the heap between reruns).
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List
+
+import pandas as pd
+
+from chart_profile import prepare_chart_frame, profile_result
+from data_table import to_arrow
+from result_frames import compact_frame, frame_bytes, spill_table
+
+STAGES = ["Prospect", "Qualified", "Proposal", "Negotiation", "Closed Won", "Closed Lost"]
+SECTORS = ["Healthcare", "Industrials", "Technology", "Consumer", "Financials", "Energy"]
+
+
+def representative_result(rows: int, seed: int = 11) -> pd.DataFrame:
+    rng = random.Random(seed)
+    start = date(2021, 1, 1)
+    records = [
+        (
+            f"OPP-{index:07d}",
+            f"Company {rng.randint(1, max(rows // 20, 5))}",
+            rng.choice(SECTORS),
+            rng.choice(STAGES),
+            Decimal(rng.randint(1, 40_000)),
+            Decimal(rng.randint(10_000, 50_000_000)) / 100,
+            start + timedelta(days=rng.randint(0, 1400)),
+            rng.random() < 0.3,
+            f"Engagement notes for opportunity {index}: follow-up with {rng.choice(SECTORS).lower()} team",
+        )
+        for index in range(rows)
+    ]
+    return pd.DataFrame(records, columns=[
+        "OPPORTUNITY_ID", "COMPANY_NAME", "SECTOR", "OPPORTUNITY_STAGE", "EMPLOYEE_COUNT",
+        "DEAL_VALUE", "ESTIMATED_CLOSE_DATE", "IS_STRATEGIC", "NOTES",
+    ])
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args(argv)
+
+    spill_dir = tempfile.mkdtemp(prefix="ppp_results_bench_")
+    print(f"{'rows':>9}{'raw df':>10}{'+chart':>10}{'+arrow':>10}{'before':>10}"
+          f"{'compact':>10}{'+arrow':>10}{'after':>10}{'file':>10}   (MiB; a spilled result holds only the file)")
+    for rows in args.rows:
+        raw = representative_result(rows)
+        raw_profile = profile_result(raw)
+        chart = prepare_chart_frame(raw, raw_profile)
+        converted = [col for col, info in raw_profile.items() if info["parse_datetime"] or info.get("parse_numeric")]
+        chart_bytes = frame_bytes(chart[converted]) if converted else 0
+        raw_arrow = to_arrow(raw)
+        before = frame_bytes(raw) + chart_bytes + raw_arrow.nbytes
+
+        compact = compact_frame(raw, raw_profile)
+        compact_arrow = to_arrow(compact)
+        after = frame_bytes(compact) + compact_arrow.nbytes
+        # A spilled result keeps no frame and maps its Arrow file: its bytes live in the page cache
+        _, path = spill_table(compact_arrow, spill_dir)
+        spilled = os.path.getsize(path)
+
+        mib = 2 ** 20
+        print(f"{rows:>9}{frame_bytes(raw) / mib:>10.1f}{chart_bytes / mib:>10.1f}{raw_arrow.nbytes / mib:>10.1f}"
+              f"{before / mib:>10.1f}{frame_bytes(compact) / mib:>10.1f}{compact_arrow.nbytes / mib:>10.1f}"
+              f"{after / mib:>10.1f}{spilled / mib:>10.1f}")
+    print("dtypes after compaction:", dict(compact.dtypes.astype(str)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
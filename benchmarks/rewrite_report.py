@@ -0,0 +1,61 @@
+"""How often the prompt rewrite is skipped or templated, and how those answers fared.
+
+Usage (from the repository root):
+
+    python -m benchmarks.rewrite_report [--db conversations.db]
+    python -m benchmarks.rewrite_report --questions benchmarks/data/labeled_questions.jsonl
+
+With --db it reads the stored conversations: every standalone answer records the rewrite
+mode and grounding score, so answer quality (share that produced SQL, share that failed)
+can be compared per mode. With --questions it only shows the decisions for a question set.
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List
+
+from conversation_store import ConversationStore
+from prompt_grounding import GroundingIndex, rewrite_mode, summarize_modes
+from structured_pipeline import SAMPLE_QUESTIONS
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.getenv("CONVERSATION_DB_PATH", "conversations.db"))
+    parser.add_argument("--questions", help="JSONL file with a 'question' field per line")
+    parser.add_argument("--model", default="pppcdmai.yaml")
+    args = parser.parse_args(argv)
+
+    if args.questions:
+        index = GroundingIndex(args.model, canned_questions=SAMPLE_QUESTIONS)
+        counts = {}
+        with open(args.questions) as f:
+            for line in f:
+                question = json.loads(line)["question"]
+                grounding = index.score(question)
+                mode = rewrite_mode(grounding)
+                counts[mode] = counts.get(mode, 0) + 1
+                print(f"{mode:<9}{grounding['score']:>6.2f}  {question}")
+        total = sum(counts.values()) or 1
+        print({mode: f"{count} ({count / total:.0%})" for mode, count in counts.items()})
+        return
+
+    store = ConversationStore(args.db)
+    messages = [
+        message
+        for session in store.list_sessions(None, limit=1_000_000)
+        for message in store.load_all(session["session_id"])
+    ]
+    summary = summarize_modes(messages)
+    total = sum(entry["answers"] for entry in summary.values()) or 1
+    print(f"{'mode':<10}{'answers':>8}{'share':>8}{'score':>8}{'with SQL':>10}{'failed':>8}")
+    for mode in ("skip", "template", "llm"):
+        entry = summary.get(mode)
+        if entry:
+            print(f"{mode:<10}{entry['answers']:>8}{entry['answers'] / total:>8.0%}{entry['mean_score']:>8.2f}"
+                  f"{entry['sql_rate']:>10.0%}{entry['failure_rate']:>8.0%}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
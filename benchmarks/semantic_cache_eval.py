@@ -0,0 +1,102 @@
+"""Precision/recall and lookup latency of the semantic answer cache on a labeled question set.
+
+Usage (from the repository root):
+
+    python -m benchmarks.semantic_cache_eval                 # local stand-in embedding
+    OPENAI_API_KEY=... python -m benchmarks.semantic_cache_eval --openai
+
+Only a run with --openai measures the app's embedding model; the stand-in's similarities are
+on a different scale, so its thresholds say nothing about SEMANTIC_CACHE_THRESHOLD.
+
+The first question of every labeled group is answered "for real" and stored. Every other
+question is then looked up: paraphrases should hit their own group's entry, questions with a
+null group (near-misses that need different SQL) should miss. Near-misses marked
+entity_near_miss differ from a stored question only in the customer or system they name;
+any hit on one of them, at any threshold, fails the run.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from semantic_cache import LiteralExtractor, SemanticCache
+from structured_pipeline import EMBEDDING_MODEL, SEMANTIC_MODEL_PATH
+from benchmarks.load_test import percentile
+from benchmarks.mock_services import fake_embedding
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "labeled_questions.jsonl")
+MODEL_HASH = "benchmark"
+
+
+def load_questions(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--openai", action="store_true", help=f"use {EMBEDDING_MODEL} instead of the stand-in")
+    parser.add_argument("--thresholds", default="0.40,0.60,0.80,0.85,0.90,0.95")
+    args = parser.parse_args(argv)
+
+    if args.openai:
+        import openai
+        client = openai.Client(api_key=os.environ["OPENAI_API_KEY"])
+
+        def embed(text: str) -> List[float]:
+            return client.embeddings.create(model=EMBEDDING_MODEL, input=text).data[0].embedding
+    else:
+        embed = fake_embedding
+
+    questions = load_questions(DATA_PATH)
+    seeded, probes = {}, []
+    for row in questions:
+        if row["group"] and row["group"] not in seeded:
+            seeded[row["group"]] = row["question"]
+        else:
+            probes.append(row)
+
+    print(f"Seeded {len(seeded)} answers, {len(probes)} probe questions, "
+          f"embedding: {EMBEDDING_MODEL if args.openai else 'local stand-in'}")
+    print(f"{'threshold':>9}{'precision':>11}{'recall':>8}{'hits':>6}{'p50 ms':>9}{'p95 ms':>9}")
+    literals = LiteralExtractor.from_model(SEMANTIC_MODEL_PATH)
+    safest, wrong_entity = None, []
+    for threshold in sorted(float(t) for t in args.thresholds.split(",")):
+        cache = SemanticCache(os.path.join(tempfile.mkdtemp(), "cache.db"), embed, threshold=threshold,
+                              literals=literals)
+        for group, question in seeded.items():
+            cache.add(question, MODEL_HASH, [{"type": "sql", "statement": f"-- {group}"}])
+
+        correct = hits = expected = 0
+        latencies = []
+        for probe in probes:
+            start = time.perf_counter()
+            hit = cache.lookup(probe["question"], MODEL_HASH)
+            latencies.append(time.perf_counter() - start)
+            expected += probe["group"] is not None
+            if hit:
+                hits += 1
+                if probe.get("entity_near_miss"):
+                    wrong_entity.append(f"{threshold:.2f}: {probe['question']!r} -> {hit['question']!r}")
+                correct += hit["content"][0]["statement"] == f"-- {probe['group']}"
+        # Without hits there is nothing to be precise about
+        precision = f"{correct / hits:.2f}" if hits else "n/a"
+        recall = correct / expected if expected else 0.0
+        if hits and correct == hits and safest is None:
+            safest = (threshold, recall)
+        print(f"{threshold:>9.2f}{precision:>11}{recall:>8.2f}{hits:>6}"
+              f"{statistics.median(latencies) * 1000:>9.2f}{percentile(latencies, 95) * 1000:>9.2f}")
+    if safest is not None:
+        print(f"Lowest threshold without a wrong hit: {safest[0]:.2f} (recall {safest[1]:.2f})"
+              + ("" if args.openai else "; rerun with --openai before using it as SEMANTIC_CACHE_THRESHOLD"))
+    if wrong_entity:
+        print("Answers reused across different entities:\n  " + "\n  ".join(wrong_entity))
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Upstream calls saved by the shared cache tier when several replicas serve the same questions.
+
+Usage (from the repository root):
+
+    python -m benchmarks.shared_cache --replicas 3 --repeats 2 [--backend redis|disk|memory]
+
+Each replica is a StructuredPipeline with its own Snowflake connection and in-process tier;
+with --backend redis they share the key-value stand-in, with disk a temporary directory.
+Every replica answers the labeled questions --repeats times, first without the cache and
+then with it, and the Cortex, o3-mini and warehouse calls are compared. A final round sends
+one new question to every replica at once to show it is computed only once.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from benchmarks.mock_services import MockSettings, install_fake_snowflake, start_mock_kv_server, start_mock_server
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "labeled_questions.jsonl")
+COUNTED = ("cortex", "openai_chat", "snowflake_execute")
+SECRETS = {
+    "user_name": "bench", "password": "bench", "account": "bench", "host": "127.0.0.1",
+    "warehouse": "BENCH_WH", "role": "BENCH_ROLE",
+}
+
+
+def load_questions(limit: int) -> List[str]:
+    with open(QUESTIONS_PATH) as f:
+        return [json.loads(line)["question"] for line in f if line.strip()][:limit]
+
+
+def build_replicas(replicas: int, cache_factory: Any) -> List[Any]:
+    from structured_pipeline import StructuredPipeline, build_grounding_index, connect, llm_rewrite
+
+    grounding = build_grounding_index()
+    return [
+        StructuredPipeline(connect(SECRETS), os.environ["CORTEX_BASE_URL"], "@DB.SCHEMA.STAGE/model.yaml",
+                           grounding=grounding, shared_cache=cache_factory(), rewrite=llm_rewrite)
+        for _ in range(replicas)
+    ]
+
+
+def run_round(settings: MockSettings, pipelines: List[Any], questions: List[str], repeats: int,
+              concurrency: int) -> Dict[str, Any]:
+    """Every replica answers every question; returns upstream call counts and wall time"""
+    settings.counts.clear()
+    jobs = [(pipeline, question) for _ in range(repeats) for pipeline in pipelines for question in questions]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        answers = list(pool.map(lambda job: job[0].ask(job[1]), jobs))
+    errors = sum(bool(answer["response"].get("error") or answer["sql_error"]) for answer in answers)
+    return {**{name: settings.counts.get(name, 0) for name in COUNTED},
+            "answers": len(answers), "errors": errors, "seconds": time.perf_counter() - started}
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=2, help="times each replica answers each question")
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--backend", choices=["redis", "disk", "memory"], default="redis")
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(cortex_latency=0.3, llm_latency=0.2, sql_latency=0.2, rows=args.rows)
+    server = start_mock_server(settings)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.update({"CORTEX_BASE_URL": base_url, "OPENAI_BASE_URL": f"{base_url}/v1",
+                       "OPENAI_API_KEY": "sk-mock"})
+    install_fake_snowflake(settings)
+
+    from shared_cache import DiskBackend, MemoryBackend, RedisBackend, SharedCache, TieredBackend
+
+    kv_server = start_mock_kv_server(settings)
+    url = f"redis://127.0.0.1:{kv_server.server_address[1]}/0"
+    directory = tempfile.mkdtemp(prefix="ppp_cache_")
+    shared_memory = MemoryBackend()
+    shared_tier = {
+        "redis": lambda: RedisBackend(url),
+        "disk": lambda: DiskBackend(directory),
+        # One LRU for all replicas: the tiering and stampede logic without a network hop
+        "memory": lambda: shared_memory,
+    }[args.backend]
+    caches: List[SharedCache] = []
+
+    def cache_factory() -> SharedCache:
+        caches.append(SharedCache(TieredBackend(MemoryBackend(), shared_tier())))
+        return caches[-1]
+
+    questions = load_questions(args.questions)
+    print(f"{args.replicas} replicas x {len(questions)} questions x {args.repeats} repeats, "
+          f"{args.backend} shared tier")
+    rounds = {
+        "no cache": run_round(settings, build_replicas(args.replicas, lambda: None), questions, args.repeats,
+                              args.concurrency),
+        "shared cache": run_round(settings, build_replicas(args.replicas, cache_factory), questions,
+                                  args.repeats, args.concurrency),
+    }
+    print(f"{'':<14}{'answers':>8}{'cortex':>8}{'o3-mini':>9}{'warehouse':>11}{'errors':>8}{'seconds':>9}")
+    for name, result in rounds.items():
+        print(f"{name:<14}{result['answers']:>8}{result['cortex']:>8}{result['openai_chat']:>9}"
+              f"{result['snowflake_execute']:>11}{result['errors']:>8}{result['seconds']:>9.1f}")
+    baseline, cached = rounds["no cache"], rounds["shared cache"]
+    for name, label in zip(COUNTED, ("Cortex", "o3-mini", "warehouse")):
+        saved = baseline[name] - cached[name]
+        print(f"{label} calls saved: {saved} ({saved / (baseline[name] or 1):.0%})")
+
+    # Stampede: the same unseen question reaches every replica at once
+    pipelines = build_replicas(args.replicas, cache_factory)
+    settings.counts.clear()
+    question = "Which companies in the newest cohort raised the largest rounds this quarter?"
+    with ThreadPoolExecutor(max_workers=args.replicas * 4) as pool:
+        list(pool.map(lambda pipeline: pipeline.ask(question), pipelines * 4))
+    print(f"stampede: {args.replicas * 4} concurrent requests -> {settings.counts.get('cortex', 0)} Cortex, "
+          f"{settings.counts.get('openai_chat', 0)} o3-mini, {settings.counts.get('snowflake_execute', 0)} "
+          "warehouse calls")
+    totals = {name: sum(cache.report()[name] for cache in caches) for name in ("hits", "misses", "waited", "errors")}
+    print(f"cache: {totals}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
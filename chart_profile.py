@@ -0,0 +1,160 @@
+"""One-pass column profiling of a query result and chart type / axis recommendation."""
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+CHART_TYPES = ["Bar Chart 📊", "Line Chart 📈", "Scatter Plot 📍", "Area Chart 🏔️", "Pie Chart 🥧"]
+
+# Rows sampled when checking whether a text column holds dates
+DATETIME_SAMPLE_SIZE = 50
+MAX_BAR_CATEGORIES = 30
+MAX_PIE_CATEGORIES = 6
+MAX_COLOR_CATEGORIES = 10
+
+
+def _looks_like_datetime(series: pd.Series) -> bool:
+    sample = series.dropna().astype(str).head(DATETIME_SAMPLE_SIZE)
+    if sample.empty or sample.str.fullmatch(r"-?\d+(\.\d+)?").all():
+        return False
+    parsed = pd.to_datetime(sample, errors="coerce", format="mixed")
+    return parsed.notna().mean() >= 0.9
+
+
+def _is_decimal(series: pd.Series) -> bool:
+    sample = series.dropna().head(DATETIME_SAMPLE_SIZE)
+    return not sample.empty and sample.map(lambda v: isinstance(v, Decimal)).all()
+
+
+def profile_result(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """Profile every column once: kind, cardinality, nulls, monotonicity and numeric range"""
+    row_count = len(df)
+    cardinality = df.nunique(dropna=True)
+    null_share = df.isna().mean() if row_count else pd.Series(0.0, index=df.columns)
+    profile: Dict[str, Dict[str, Any]] = {}
+
+    for col in df.columns:
+        series = df[col]
+        info: Dict[str, Any] = {
+            "cardinality": int(cardinality[col]),
+            "null_share": float(null_share[col]),
+            "all_null": bool(series.isna().all()),
+            "parse_datetime": False,
+        }
+        if pd.api.types.is_bool_dtype(series):
+            info["kind"] = "categorical"
+        elif pd.api.types.is_numeric_dtype(series):
+            info["kind"] = "numeric"
+            info["min"] = series.min()
+            info["max"] = series.max()
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            info["kind"] = "datetime"
+        elif series.dtype == object and _is_decimal(series):
+            # Snowflake NUMBER columns arrive as Decimal objects
+            info["kind"] = "numeric"
+            numeric = pd.to_numeric(series, errors="coerce")
+            info["min"] = numeric.min()
+            info["max"] = numeric.max()
+            info["parse_numeric"] = True
+        elif _looks_like_datetime(series):
+            info["kind"] = "datetime"
+            info["parse_datetime"] = True
+        else:
+            info["kind"] = "categorical" if info["cardinality"] <= MAX_BAR_CATEGORIES else "text"
+
+        info["monotonic"] = bool(
+            info["kind"] in ("numeric", "datetime") and not info["parse_datetime"]
+            and not info.get("parse_numeric") and row_count > 1
+            and (series.is_monotonic_increasing or series.is_monotonic_decreasing)
+        )
+        info["id_like"] = bool(
+            col.upper().endswith("_ID") or col.upper() == "ID"
+            or (info["kind"] == "numeric" and row_count > 1 and info["cardinality"] == row_count and info["monotonic"])
+        )
+        profile[col] = info
+    return profile
+
+
+def prepare_chart_frame(df: pd.DataFrame, profile: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    """Return a frame with detected date strings and Decimal columns converted for charting"""
+    converted = {}
+    for col, info in profile.items():
+        if info["parse_datetime"]:
+            converted[col] = pd.to_datetime(df[col], errors="coerce", format="mixed")
+        elif info.get("parse_numeric"):
+            converted[col] = pd.to_numeric(df[col], errors="coerce")
+    return df.assign(**converted) if converted else df
+
+
+def altair_type(profile: Dict[str, Dict[str, Any]], col: str) -> str:
+    kind = profile[col]["kind"]
+    if kind == "datetime":
+        return "temporal"
+    if kind == "numeric":
+        return "quantitative"
+    return "nominal"
+
+
+def suggest_chart_type(profile: Dict[str, Dict[str, Any]], x_col: str, y_col: str) -> str:
+    """Suggest a chart type for an x/y pair from the column profile"""
+    x_info, y_info = profile[x_col], profile[y_col]
+    if y_info["kind"] != "numeric":
+        return CHART_TYPES[0]
+    if x_info["kind"] == "datetime":
+        return "Line Chart 📈"
+    if x_info["kind"] == "numeric" and not x_info["id_like"]:
+        return "Line Chart 📈" if x_info["monotonic"] else "Scatter Plot 📍"
+    if x_info["cardinality"] <= MAX_PIE_CATEGORIES and (y_info.get("min") is None or y_info["min"] >= 0):
+        return "Pie Chart 🥧"
+    return "Bar Chart 📊"
+
+
+def _x_score(info: Dict[str, Any]) -> float:
+    if info["all_null"]:
+        return -1.0
+    if info["kind"] == "datetime":
+        return 4.0
+    if info["kind"] == "categorical":
+        return 3.0 + (0.5 if info["cardinality"] > 1 else 0.0)
+    if info["kind"] == "numeric":
+        return 2.0 if info["monotonic"] and not info["id_like"] else 1.0
+    return 0.5
+
+
+def _y_score(info: Dict[str, Any]) -> float:
+    if info["all_null"]:
+        return -1.0
+    return (0.0 if info["id_like"] else 2.0) + (1.0 - info["null_share"])
+
+
+def recommend_chart(profile: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Rank x/y/color candidates and pick a default chart type"""
+    columns = list(profile)
+    x_candidates = sorted(columns, key=lambda c: _x_score(profile[c]), reverse=True)
+    numeric = [c for c in columns if profile[c]["kind"] == "numeric"]
+    y_candidates = sorted(numeric, key=lambda c: _y_score(profile[c]), reverse=True)
+
+    x_col: Optional[str] = None
+    y_col: Optional[str] = None
+    for candidate in x_candidates:
+        remaining = [c for c in y_candidates if c != candidate]
+        if remaining:
+            x_col, y_col = candidate, remaining[0]
+            break
+    if x_col is None:
+        x_col = x_candidates[0] if x_candidates else None
+
+    color_candidates: List[str] = [
+        c for c in columns
+        if c not in (x_col, y_col) and profile[c]["kind"] == "categorical"
+        and 1 < profile[c]["cardinality"] <= MAX_COLOR_CATEGORIES
+    ]
+    return {
+        "chart_type": suggest_chart_type(profile, x_col, y_col) if x_col and y_col else CHART_TYPES[0],
+        "x": x_col,
+        "y": y_col,
+        "color": color_candidates[0] if color_candidates else None,
+        "x_candidates": x_candidates,
+        "y_candidates": y_candidates,
+        "color_candidates": color_candidates,
+    }
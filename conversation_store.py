@@ -0,0 +1,155 @@
+"""SQLite-backed conversation persistence with paged history loading."""
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    title      TEXT,
+    chat_mode  TEXT,
+    owner      TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL REFERENCES sessions(session_id),
+    role       TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id);
+"""
+# Placeholder rows holding a reply's id while it is generated; never loaded as messages
+PENDING_ROLE = "pending"
+
+
+class ConversationStore:
+    """Stores chat sessions and their messages; safe to share across Streamlit sessions"""
+
+    def __init__(self, path: str = "conversations.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "owner" not in columns:
+            # Sessions stored before owners were recorded stay unowned, so nobody can list or open them
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN owner TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_owner ON sessions(owner, updated_at)")
+        self._lock = threading.Lock()
+
+    def create_session(self, owner: str, chat_mode: Optional[str] = None) -> str:
+        session_id = uuid.uuid4().hex[:12]
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, title, chat_mode, owner, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (session_id, None, chat_mode, owner, now, now),
+            )
+        return session_id
+
+    def session_exists(self, session_id: str, owner: str) -> bool:
+        """Whether the session exists and belongs to owner"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ? AND owner = ?", (session_id, owner)
+            ).fetchone()
+        return row is not None
+
+    def list_sessions(self, owner: Optional[str], limit: int = 20) -> List[Dict[str, Any]]:
+        """The owner's most recently active sessions first; owner None lists everyone's, for offline reports"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.session_id, s.title, s.updated_at, COUNT(m.id) FROM sessions s "
+                "LEFT JOIN messages m ON m.session_id = s.session_id AND m.role != ? "
+                "WHERE ? IS NULL OR s.owner = ? GROUP BY s.session_id ORDER BY s.updated_at DESC LIMIT ?",
+                (PENDING_ROLE, owner, owner, limit),
+            ).fetchall()
+        return [
+            {"session_id": row[0], "title": row[1] or "Untitled", "updated_at": row[2], "message_count": row[3]}
+            for row in rows
+        ]
+
+    def append(self, session_id: str, message: Dict[str, Any]) -> int:
+        """Persist a message and return its id"""
+        now = datetime.now().isoformat()
+        payload = json.dumps({k: v for k, v in message.items() if k != "id"}, default=str)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, role, payload, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, message["role"], payload, now),
+            )
+            title = None
+            if message["role"] == "user":
+                title = next((item["text"] for item in message["content"] if item["type"] == "text"), None)
+            self._conn.execute(
+                "UPDATE sessions SET updated_at = ?, title = COALESCE(title, ?) WHERE session_id = ?",
+                (now, title[:80] if title else None, session_id),
+            )
+        return cursor.lastrowid
+
+    def reserve(self, session_id: str) -> int:
+        """Id for a message stored later with update(), e.g. a reply still being generated"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO messages (session_id, role, payload, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, PENDING_ROLE, "{}", datetime.now().isoformat()),
+            )
+        return cursor.lastrowid
+
+    def update(self, message_id: int, message: Dict[str, Any]):
+        """Overwrite the stored payload of an existing (or reserved) message"""
+        payload = json.dumps({k: v for k, v in message.items() if k != "id"}, default=str)
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE messages SET role = ?, payload = ? WHERE id = ?",
+                               (message["role"], payload, message_id))
+            self._conn.execute(
+                "UPDATE sessions SET updated_at = ? WHERE session_id = (SELECT session_id FROM messages WHERE id = ?)",
+                (datetime.now().isoformat(), message_id),
+            )
+
+    def delete(self, message_id: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def load_recent(self, session_id: str, owner: str, limit: int) -> List[Dict[str, Any]]:
+        """Last `limit` messages of the owner's session, oldest first; none if someone else owns it"""
+        if not self.session_exists(session_id, owner):
+            return []
+        return self.load_page(session_id, before_id=None, limit=limit)
+
+    def load_page(self, session_id: str, before_id: Optional[int], limit: int) -> List[Dict[str, Any]]:
+        """Up to `limit` messages older than `before_id`, oldest first"""
+        query = "SELECT id, payload FROM messages WHERE session_id = ? AND role != ?"
+        params: List[Any] = [session_id, PENDING_ROLE]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [{**json.loads(payload), "id": message_id} for message_id, payload in reversed(rows)]
+
+    def load_all(self, session_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, payload FROM messages WHERE session_id = ? AND role != ? ORDER BY id",
+                (session_id, PENDING_ROLE),
+            ).fetchall()
+        return [{**json.loads(payload), "id": message_id} for message_id, payload in rows]
+
+    def count_before(self, session_id: str, before_id: Optional[int]) -> int:
+        if before_id is None:
+            return 0
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND id < ? AND role != ?",
+                (session_id, before_id, PENDING_ROLE),
+            ).fetchone()
+        return row[0]
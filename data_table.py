@@ -0,0 +1,155 @@
+"""Paged, server-side sorted and filtered data table backed by an Arrow copy of a query result."""
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import streamlit as st
+
+PAGE_SIZE_OPTIONS = [25, 50, 100, 250]
+NO_COLUMN = "—"
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """Convert a result frame to an Arrow table, stringifying columns Arrow cannot type"""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        mixed = {col: "string" for col in df.columns if df[col].dtype == object}
+        return pa.Table.from_pandas(df.astype(mixed), preserve_index=False)
+
+
+def filter_table(table: pa.Table, column: str, text: str) -> pa.Table:
+    """Keep rows whose value in `column` contains `text` (case-insensitive)"""
+    if not text or column not in table.column_names:
+        return table
+    values = table[column]
+    if not pa.types.is_string(values.type) and not pa.types.is_large_string(values.type):
+        values = pc.cast(values, pa.string())
+    mask = pc.fill_null(pc.match_substring(values, text, ignore_case=True), False)
+    return table.filter(mask)
+
+
+def sort_table(table: pa.Table, column: Optional[str], ascending: bool = True) -> pa.Table:
+    """Sort the table by a single column, nulls last"""
+    if not column or column not in table.column_names:
+        return table
+    order = "ascending" if ascending else "descending"
+    values = table[column]
+    if pa.types.is_dictionary(values.type):
+        # Arrow has no sort kernel for dictionary (categorical) columns; sort by the decoded values
+        decoded = pc.cast(values, values.type.value_type).combine_chunks()
+        return table.take(pc.array_sort_indices(decoded, order=order, null_placement="at_end"))
+    return table.sort_by([(column, order)])
+
+
+def page_slice(table: pa.Table, page: int, page_size: int) -> pd.DataFrame:
+    """Materialize only the requested page as a pandas frame"""
+    offset = max(page - 1, 0) * page_size
+    return table.slice(offset, page_size).to_pandas()
+
+
+def page_count(num_rows: int, page_size: int) -> int:
+    return max((num_rows + page_size - 1) // page_size, 1)
+
+
+def column_stats(table: pa.Table, column: str) -> Dict[str, Any]:
+    """Compute summary statistics for one column"""
+    values = table[column]
+    if pa.types.is_dictionary(values.type):
+        values = pc.cast(values, values.type.value_type)
+    stats: Dict[str, Any] = {
+        "Type": str(values.type),
+        "Nulls": values.null_count,
+        "Distinct": pc.count_distinct(values, mode="only_valid").as_py(),
+    }
+    if pa.types.is_integer(values.type) or pa.types.is_floating(values.type) or pa.types.is_decimal(values.type):
+        min_max = pc.min_max(values)
+        stats["Min"] = min_max["min"].as_py()
+        stats["Max"] = min_max["max"].as_py()
+        stats["Mean"] = pc.mean(pc.cast(values, pa.float64())).as_py()
+    elif pa.types.is_temporal(values.type):
+        min_max = pc.min_max(values)
+        stats["Min"] = min_max["min"].as_py()
+        stats["Max"] = min_max["max"].as_py()
+    else:
+        counts = pc.value_counts(pc.drop_null(values))
+        if len(counts):
+            order = pc.sort_indices(counts.field("counts"), sort_keys=[("", "descending")])[:5]
+            top = counts.take(order)
+            stats["Top values"] = [
+                f"{value} ({count})"
+                for value, count in zip(top.field("values").to_pylist(), top.field("counts").to_pylist())
+            ]
+    return stats
+
+
+def _view_for(table: pa.Table, key: str, filter_col: str, filter_text: str,
+              sort_col: str, ascending: bool, view_cache: Dict[str, Any]) -> pa.Table:
+    """Return the filtered/sorted view, reusing the last one if the controls did not change"""
+    params = (id(table), filter_col, filter_text, sort_col, ascending)
+    cached = view_cache.get(key)
+    if cached and cached[0] == params:
+        return cached[1]
+    view = table
+    if filter_col != NO_COLUMN:
+        view = filter_table(view, filter_col, filter_text)
+    if sort_col != NO_COLUMN:
+        view = sort_table(view, sort_col, ascending)
+    # An unfiltered, unsorted view is the table itself; only a real copy is worth remembering
+    if view is table:
+        view_cache.pop(key, None)
+    else:
+        view_cache[key] = (params, view)
+    return view
+
+
+def render_paged_table(table: pa.Table, key: str, stats_cache: Optional[Dict[str, Dict[str, Any]]] = None,
+                       view_cache: Optional[Dict[str, Any]] = None):
+    """Render a paged table; only the visible page is sent to the browser
+
+    The sorted/filtered view is kept in view_cache, which the caller owns: keeping it with
+    the result frees the view together with the result.
+    """
+    columns: List[str] = table.column_names
+
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
+    with col1:
+        filter_col = st.selectbox("Filter column", [NO_COLUMN] + columns, key=f"{key}_filter_col")
+    with col2:
+        filter_text = st.text_input("Contains", key=f"{key}_filter_text",
+                                    disabled=filter_col == NO_COLUMN)
+    with col3:
+        sort_col = st.selectbox("Sort by", [NO_COLUMN] + columns, key=f"{key}_sort_col")
+    with col4:
+        ascending = st.radio("Order", ["Asc", "Desc"], key=f"{key}_sort_dir",
+                             horizontal=True, disabled=sort_col == NO_COLUMN) == "Asc"
+
+    view = _view_for(table, key, filter_col, filter_text, sort_col, ascending,
+                     view_cache if view_cache is not None else {})
+
+    page_col1, page_col2, page_col3 = st.columns([1, 1, 3])
+    with page_col1:
+        page_size = st.selectbox("Rows per page", PAGE_SIZE_OPTIONS, key=f"{key}_page_size")
+    pages = page_count(view.num_rows, page_size)
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with page_col2:
+        page = st.number_input("Page", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    page = min(int(page), pages)
+
+    st.dataframe(page_slice(view, page, page_size), use_container_width=True, hide_index=True)
+    first_row = (page - 1) * page_size + 1 if view.num_rows else 0
+    last_row = min(page * page_size, view.num_rows)
+    with page_col3:
+        st.caption(f"Showing rows {first_row:,}–{last_row:,} of {view.num_rows:,}"
+                   + (f" (filtered from {table.num_rows:,})" if view.num_rows != table.num_rows else ""))
+
+    # Column statistics are only computed for the column the user expands
+    stats_col = st.selectbox("🔎 Column details", [NO_COLUMN] + columns, key=f"{key}_stats_col")
+    if stats_col != NO_COLUMN:
+        stats_cache = stats_cache if stats_cache is not None else {}
+        if stats_col not in stats_cache:
+            stats_cache[stats_col] = column_stats(table, stats_col)
+        st.json({name: value if isinstance(value, (int, float, str, list, type(None))) else str(value)
+                 for name, value in stats_cache[stats_col].items()}, expanded=True)
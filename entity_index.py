@@ -0,0 +1,289 @@
+"""Index of distinct warehouse values for the string dimensions, used to resolve literals in questions.
+
+Values are pulled with one DISTINCT query per column, persisted to JSON, refreshed
+incrementally from the table's time dimension and matched against question spans by
+exact form, word prefix or trigram similarity.
+"""
+import bisect
+import json
+import math
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+import yaml
+
+from local_mirror import mirrored_tables
+from semantic_cache import normalize_question
+from verified_queries import STOPWORDS
+
+# Free text, links and identifiers are not useful literals
+EXCLUDED_COLUMNS = re.compile(r"URL|WEBSITE|DESCRIPTION|SUMMARY|SUBJECT|_ID$|^ID$|CODE")
+MAX_VALUES_PER_COLUMN = 50_000
+MAX_VALUE_LENGTH = 100
+# Columns where at least this share of values are comma-separated lists are also indexed per element
+LIST_VALUE_SHARE = 0.2
+MAX_SPAN_TOKENS = 5
+FUZZY_THRESHOLD_SINGLE = 0.75
+FUZZY_THRESHOLD_MULTI = 0.7
+MAX_PREFIX_MATCHES = 3
+# Shorter and longer spans only match exactly or by prefix
+MIN_FUZZY_LENGTH = 5
+MAX_FUZZY_TOKENS = 3
+IGNORED_VALUES = {"other", "others", "yes", "no", "none", "true", "false", "n a", "na", "unknown", "0", "1"}
+
+
+def entity_columns(model_path: str) -> List[Dict[str, Any]]:
+    """String dimensions worth indexing, with their table's watermark column"""
+    with open(model_path, "r") as f:
+        model = yaml.safe_load(f)
+    watermarks = {table["name"]: table for table in mirrored_tables(model_path)}
+    columns = []
+    for table in model.get("tables") or []:
+        base = table["base_table"]
+        for dimension in table.get("dimensions") or []:
+            if not dimension.get("data_type", "").upper().startswith("VARCHAR"):
+                continue
+            if EXCLUDED_COLUMNS.search(dimension["name"].upper()):
+                continue
+            columns.append({
+                "column": f"{table['name']}.{dimension['name']}",
+                "expr": dimension["expr"],
+                "table": watermarks[base["table"]]["qualified"],
+                "watermark": watermarks[base["table"]]["watermark"],
+            })
+    return columns
+
+
+def _padded(normalized: str) -> str:
+    """Spaceless form with the padding that marks the first and last characters"""
+    return "  " + normalized.replace(" ", "") + " "
+
+
+def _trigrams(padded: str) -> Set[str]:
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class EntityIndex:
+    """Distinct values of string dimensions with exact, prefix and trigram lookup"""
+
+    def __init__(self, model_path: str, path: str, fetch: Callable[[str], pd.DataFrame],
+                 full_refresh_hours: float = 24):
+        self.columns = entity_columns(model_path)
+        self.path = path
+        self.fetch = fetch
+        self.full_refresh_seconds = full_refresh_hours * 3600
+        self._refresh_lock = threading.Lock()
+        # column -> {"values": [...], "watermark", "full_at", "refreshed_at"}
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.state = json.load(f)
+        self._index: Dict[str, Any] = self._build(self.state)
+
+    def _extract(self, column: Dict[str, Any], since: Optional[str]) -> Tuple[Set[str], Optional[str]]:
+        """Distinct values (changed since the watermark, when given) and the new watermark"""
+        expr = column["expr"]
+        if column["watermark"]:
+            sql = (f"SELECT {expr} AS VALUE, MAX({column['watermark']}) AS WATERMARK FROM {column['table']} "
+                   f"WHERE {expr} IS NOT NULL")
+            if since:
+                sql += f" AND {column['watermark']} >= '{since}'"
+            sql += f" GROUP BY {expr} LIMIT {MAX_VALUES_PER_COLUMN + 1}"
+        else:
+            sql = f"SELECT DISTINCT {expr} AS VALUE FROM {column['table']} WHERE {expr} IS NOT NULL " \
+                  f"LIMIT {MAX_VALUES_PER_COLUMN + 1}"
+        df = self.fetch(sql)
+        df.columns = [str(name).upper() for name in df.columns]
+        values = {str(value) for value in df["VALUE"] if len(str(value)) <= MAX_VALUE_LENGTH}
+        watermark = None
+        if "WATERMARK" in df.columns and df["WATERMARK"].notna().any():
+            latest = df["WATERMARK"].max()
+            watermark = str(latest.date() if hasattr(latest, "date") else latest)
+        return values, watermark
+
+    def refresh(self, full: bool = False) -> Dict[str, int]:
+        """Re-extract every column (incrementally where possible) and swap in a new index; returns new values per column"""
+        added = {}
+        with self._refresh_lock:
+            state = dict(self.state)
+            now = time.time()
+            for column in self.columns:
+                previous = state.get(column["column"])
+                incremental = (
+                    not full and previous is not None and column["watermark"] and previous.get("watermark")
+                    and now - previous["full_at"] < self.full_refresh_seconds
+                )
+                try:
+                    values, watermark = self._extract(column, previous["watermark"] if incremental else None)
+                except Exception as e:
+                    print(f"[ENTITY INDEX] {column['column']} failed: {e}")
+                    continue
+                if len(values) > MAX_VALUES_PER_COLUMN:
+                    # Too many distinct values to be a useful literal vocabulary (names of rows, not categories)
+                    state.pop(column["column"], None)
+                    continue
+                known = set(previous["values"]) if previous else set()
+                new_values = values - known
+                if incremental:
+                    values |= known
+                    watermark = watermark or previous["watermark"]
+                state[column["column"]] = {
+                    "values": sorted(values),
+                    "watermark": watermark,
+                    "full_at": previous["full_at"] if incremental else now,
+                    "refreshed_at": now,
+                }
+                added[column["column"]] = len(new_values)
+            index = self._build(state)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+            self.state, self._index = state, index
+        return added
+
+    def start_schedule(self, interval_minutes: float):
+        """Refresh now and then every interval on a daemon thread"""
+        def loop():
+            while True:
+                self.refresh()
+                time.sleep(interval_minutes * 60)
+
+        threading.Thread(target=loop, name="entity-index-refresh", daemon=True).start()
+
+    @staticmethod
+    def _build(state: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Exact map, sorted prefix list and trigram postings over the distinct normalized values"""
+        terms: Dict[str, List[Tuple[str, str, str]]] = {}  # normalized -> [(value, column, "equals" | "contains")]
+        for column, column_state in state.items():
+            values = column_state["values"]
+            is_list = values and sum(", " in value for value in values) >= LIST_VALUE_SHARE * len(values)
+            for value in values:
+                parts = [(value, "equals")]
+                if is_list and ", " in value:
+                    parts.extend((part, "contains") for part in value.split(", ") if part.strip())
+                for text, match in parts:
+                    normalized = normalize_question(text)
+                    if len(normalized) < 3 or normalized in IGNORED_VALUES or normalized in STOPWORDS:
+                        continue
+                    entries = terms.setdefault(normalized, [])
+                    if not any(entry[1] == column for entry in entries):
+                        entries.append((text, column, match))
+
+        keys = sorted(terms)
+        postings: Dict[str, List[int]] = {}
+        padded_forms: List[str] = []
+        trigram_counts: List[int] = []
+        for term_id, normalized in enumerate(keys):
+            padded_forms.append(_padded(normalized))
+            trigrams = _trigrams(padded_forms[-1])
+            trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(term_id)
+        return {
+            "keys": keys,
+            "ids": {normalized: term_id for term_id, normalized in enumerate(keys)},
+            "entries": [terms[normalized] for normalized in keys],
+            "postings": postings,
+            "padded": padded_forms,
+            "trigram_counts": trigram_counts,
+        }
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._index["entries"])
+
+    @staticmethod
+    def _lookup(index: Dict[str, Any], span: str, tokens: int) -> List[Tuple[float, int]]:
+        """(score, term id) of the values the span may name"""
+        if span in index["ids"]:
+            return [(1.0, index["ids"][span])]
+
+        # Word-prefix: "recipharm" -> "recipharm ab", only when it is nearly unambiguous
+        keys = index["keys"]
+        start = bisect.bisect_left(keys, span + " ")
+        end = bisect.bisect_left(keys, span + "!")
+        if 0 < end - start <= MAX_PREFIX_MATCHES and len(span) >= 4:
+            return [(0.9, term_id) for term_id in range(start, end)]
+
+        if len(span) < MIN_FUZZY_LENGTH or tokens > MAX_FUZZY_TOKENS:
+            return []
+        # Prefix filtering: a value reaching the threshold shares at least ceil(t * n) of the span's n
+        # trigrams, so it appears in one of the n - ceil(t * n) + 1 rarest postings; only those are scanned
+        threshold = FUZZY_THRESHOLD_SINGLE if tokens == 1 else FUZZY_THRESHOLD_MULTI
+        trigrams = _trigrams(_padded(span))
+        postings = sorted((index["postings"].get(trigram, ()) for trigram in trigrams), key=len)
+        required = math.ceil(threshold * len(trigrams))
+        # ...and has between t * n and n / t trigrams itself
+        counts = index["trigram_counts"]
+        shortest, longest = threshold * len(trigrams), len(trigrams) / threshold
+        candidates = {
+            term_id for posting in postings[:len(trigrams) - required + 1] for term_id in posting
+            if shortest <= counts[term_id] <= longest
+        }
+        matches = []
+        for term_id in candidates:
+            padded = index["padded"][term_id]
+            shared = sum(trigram in padded for trigram in trigrams)
+            similarity = shared / (len(trigrams) + counts[term_id] - shared)
+            if similarity >= threshold:
+                matches.append((similarity, term_id))
+        return matches
+
+    def resolve(self, question: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Values the question most likely mentions, best first, with non-overlapping mentions"""
+        index = self._index
+        if not index["keys"]:
+            return []
+        tokens = normalize_question(question).split()
+        candidates = []
+        for size in range(min(MAX_SPAN_TOKENS, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                words = tokens[start:start + size]
+                if words[0] in STOPWORDS or words[-1] in STOPWORDS:
+                    continue
+                span = " ".join(words)
+                if len(span) < 3 or (size == 1 and len(span) < 4):
+                    continue
+                for score, term_id in self._lookup(index, span, size):
+                    candidates.append((score, size, start, term_id, span))
+
+        candidates.sort(key=lambda c: (c[0], c[1]), reverse=True)
+        taken: Set[int] = set()
+        resolved = []
+        mentions = 0
+        for score, size, start, term_id, span in candidates:
+            positions = set(range(start, start + size))
+            if positions & taken:
+                continue
+            taken |= positions
+            # One value can occur in several columns; they are reported together
+            resolved.extend(
+                {"mention": span, "value": value, "column": column, "match": match, "score": score}
+                for value, column, match in index["entries"][term_id]
+            )
+            mentions += 1
+            if mentions >= limit:
+                break
+        return resolved
+
+
+def literal_hints(resolved: List[Dict[str, Any]]) -> str:
+    """Filter expressions for the resolved values, for the text sent to Cortex"""
+    hints = []
+    for entity in resolved:
+        value = entity["value"]
+        if entity["match"] == "contains":
+            hints.append(f"{entity['column']} ILIKE {sql_literal('%' + value.strip() + '%')}")
+        elif value != value.strip():
+            hints.append(f"TRIM({entity['column']}) = {sql_literal(value.strip())}")
+        else:
+            hints.append(f"{entity['column']} = {sql_literal(value)}")
+    return "Exact values mentioned: " + "; ".join(hints) + "." if hints else ""
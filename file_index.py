@@ -0,0 +1,475 @@
+"""Build and refresh the document index behind Unstructured Chat.
+
+Documents are loaded page by page, split into overlapping chunks and written to the
+Azure AI Search "file-index" (fields id, content, content_vector, filename, chunk_index,
+source_page) or to a local SQLite index. A manifest of chunk content hashes makes
+re-runs cheap: unchanged chunks are skipped, and chunks whose text was seen before
+reuse the stored embedding instead of being embedded again. The chunk text is also kept
+in the BM25 index hybrid retrieval reads (hybrid_search.py, --lexical-path).
+
+    python file_index.py ingest docs/ [--target azure|local] [--prune]
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from admission import slot
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+try:
+    import docx
+except ImportError:
+    docx = None
+
+INDEX_NAME = "file-index"
+EMBEDDING_MODEL = "text-embedding-3-small"
+AZURE_API_VERSION = "2023-11-01"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBED_BATCH_SIZE = 128
+EMBED_CONCURRENCY = 4
+# Azure AI Search accepts at most 1000 actions per indexing request
+UPSERT_BATCH_SIZE = 500
+TEXT_EXTENSIONS = (".txt", ".md", ".csv", ".json", ".html", ".htm")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id           TEXT PRIMARY KEY,
+    source       TEXT NOT NULL,
+    chunk_index  INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+CREATE TABLE IF NOT EXISTS embeddings (
+    content_hash TEXT PRIMARY KEY,
+    embedding    BLOB NOT NULL
+);
+"""
+
+LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id             TEXT PRIMARY KEY,
+    content        TEXT NOT NULL,
+    content_vector BLOB NOT NULL,
+    filename       TEXT NOT NULL,
+    chunk_index    INTEGER NOT NULL,
+    source_page    INTEGER NOT NULL
+);
+"""
+
+
+def load_pages(path: str) -> List[Tuple[int, str]]:
+    """(1-based page number, text) of a document; formats without pages are a single page"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        if PdfReader is None:
+            raise ImportError("pypdf is required to ingest PDF files")
+        return [(number, page.extract_text() or "") for number, page in enumerate(PdfReader(path).pages, start=1)]
+    if extension == ".docx":
+        if docx is None:
+            raise ImportError("python-docx is required to ingest Word files")
+        return [(1, "\n".join(paragraph.text for paragraph in docx.Document(path).paragraphs))]
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return [(1, f.read())]
+
+
+def supported(path: str) -> bool:
+    return path.lower().endswith((".pdf", ".docx") + TEXT_EXTENSIONS)
+
+
+def discover(paths: Iterable[str]) -> List[str]:
+    """Supported files under the given files and directories"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in sorted(names) if supported(name))
+        elif supported(path):
+            found.append(path)
+    return found
+
+
+def split_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Chunks of at most chunk_size characters, cut at paragraph, line or word boundaries where possible"""
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = window.rfind(separator)
+                if cut > chunk_size // 2:
+                    end = start + cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_document(path: str, root: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Chunks of one document with the fields the index stores"""
+    source = os.path.relpath(path, root) if root else path
+    chunks = []
+    for page, text in load_pages(path):
+        for chunk in split_text(text):
+            chunk_index = len(chunks)
+            chunks.append({
+                # Azure keys allow letters, digits, '_', '-' and '='
+                "id": hashlib.sha1(f"{source}:{chunk_index}".encode("utf-8")).hexdigest(),
+                "source": source,
+                "filename": os.path.basename(path),
+                "chunk_index": chunk_index,
+                "source_page": page,
+                "content": chunk,
+                "content_hash": content_hash(chunk),
+            })
+    return chunks
+
+
+def openai_embedder(model: str = EMBEDDING_MODEL) -> Callable[[List[str]], List[List[float]]]:
+    """Batch embedding function over the OpenAI API (honours OPENAI_BASE_URL)"""
+    import openai
+
+    client = openai.Client(api_key=os.getenv("OPENAI_API_KEY"), max_retries=5)
+
+    def embed(texts: List[str]) -> List[List[float]]:
+        with slot("openai"):
+            response = client.embeddings.create(model=model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    return embed
+
+
+class AzureSearchIndex:
+    """Bulk writes to an Azure AI Search index through its REST API"""
+
+    def __init__(self, endpoint: str, api_key: str, index_name: str = INDEX_NAME):
+        self.url = f"{endpoint.rstrip('/')}/indexes/{index_name}/docs/index?api-version={AZURE_API_VERSION}"
+        self.session = requests.Session()
+        self.session.headers.update({"api-key": api_key, "Content-Type": "application/json"})
+
+    def _post(self, actions: List[Dict[str, Any]]):
+        resp = self.session.post(self.url, json={"value": actions}, timeout=120)
+        resp.raise_for_status()
+        failed = [item for item in resp.json().get("value", []) if not item.get("status")]
+        if failed:
+            raise RuntimeError(f"{len(failed)} documents were rejected, first: {failed[0].get('errorMessage')}")
+
+    def upsert(self, documents: List[Dict[str, Any]]):
+        self._post([{"@search.action": "mergeOrUpload", **document} for document in documents])
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            self._post([{"@search.action": "delete", "id": doc_id} for doc_id in ids[start:start + UPSERT_BATCH_SIZE]])
+
+
+class LocalFileIndex:
+    """File-index documents in SQLite with brute-force cosine search"""
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(LOCAL_SCHEMA)
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._version: Optional[int] = None
+
+    def upsert(self, documents: List[Dict[str, Any]]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (id, content, content_vector, filename, chunk_index, source_page) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(d["id"], d["content"], np.asarray(d["content_vector"], dtype=np.float32).tobytes(),
+                  d["filename"], d["chunk_index"], d["source_page"]) for d in documents],
+            )
+
+    def delete(self, ids: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def _load(self):
+        """(Re)load the unit-normalized vectors when the database changed; caller holds the lock"""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0] + self._conn.total_changes
+        if version == self._version:
+            return
+        rows = self._conn.execute("SELECT id, content_vector FROM documents").fetchall()
+        self._ids = [row[0] for row in rows]
+        if rows:
+            matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            self._matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        else:
+            self._matrix = None
+        self._version = version
+
+    def search(self, vector: List[float], k: int = 4) -> List[Dict[str, Any]]:
+        """The k most similar chunks, best first"""
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            self._load()
+            if self._matrix is None:
+                return []
+            scores = self._matrix @ query
+            best = np.argsort(-scores)[:k]
+            ids = [self._ids[position] for position in best]
+            rows = {
+                row[0]: row for row in self._conn.execute(
+                    f"SELECT id, content, filename, chunk_index, source_page FROM documents "
+                    f"WHERE id IN ({','.join('?' * len(ids))})", ids,
+                )
+            }
+        return [
+            {"content": rows[doc_id][1], "filename": rows[doc_id][2], "chunk_index": rows[doc_id][3],
+             "source_page": rows[doc_id][4], "score": float(scores[position])}
+            for doc_id, position in zip(ids, best)
+        ]
+
+    def as_retriever(self, embed_query: Callable[[str], List[float]], k: int = 4):
+        """LangChain retriever returning Documents with the same metadata as the Azure index"""
+        from langchain_core.documents import Document
+        from langchain_core.retrievers import BaseRetriever
+
+        index = self
+
+        class LocalFileIndexRetriever(BaseRetriever):
+            def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+                return [
+                    Document(page_content=hit["content"], metadata={
+                        "filename": hit["filename"], "chunk_index": hit["chunk_index"],
+                        "source_page": hit["source_page"],
+                    })
+                    for hit in index.search(embed_query(query), k)
+                ]
+
+        return LocalFileIndexRetriever()
+
+
+def admitted_retriever(retriever: Any, provider: str = "azure_search"):
+    """LangChain retriever that takes a provider slot (see admission.py) around each search"""
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+
+    class AdmittedRetriever(BaseRetriever):
+        def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+            with slot(provider):
+                return retriever.invoke(query)
+
+    return AdmittedRetriever()
+
+
+class Ingestor:
+    """Chunk, deduplicate, embed and upsert documents into an index"""
+
+    def __init__(self, state_path: str, index: Any, embed: Callable[[List[str]], List[List[float]]],
+                 batch_size: int = EMBED_BATCH_SIZE, concurrency: int = EMBED_CONCURRENCY, lexical: Any = None):
+        self.index = index
+        # hybrid_search.LexicalIndex kept in step with the index, for BM25 retrieval
+        self.lexical = lexical
+        self.embed = embed
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._conn = sqlite3.connect(state_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def _known(self, sources: List[str]) -> Dict[str, Tuple[str, str]]:
+        """id -> (source, content hash) of every chunk last written for these sources"""
+        known = {}
+        for start in range(0, len(sources), 500):
+            batch = sources[start:start + 500]
+            known.update({
+                row[0]: (row[1], row[2]) for row in self._conn.execute(
+                    f"SELECT id, source, content_hash FROM chunks WHERE source IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            })
+        return known
+
+    def _cached_embeddings(self, hashes: List[str]) -> Dict[str, np.ndarray]:
+        cached = {}
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            cached.update({
+                row[0]: np.frombuffer(row[1], dtype=np.float32) for row in self._conn.execute(
+                    f"SELECT content_hash, embedding FROM embeddings "
+                    f"WHERE content_hash IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            })
+        return cached
+
+    def _write(self, documents: List[Dict[str, Any]]):
+        """Upsert into the index, then record the chunks as written"""
+        self.index.upsert([
+            {key: document[key] for key in
+             ("id", "content", "content_vector", "filename", "chunk_index", "source_page")}
+            for document in documents
+        ])
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, source, chunk_index, content_hash) VALUES (?, ?, ?, ?)",
+                [(d["id"], d["source"], d["chunk_index"], d["content_hash"]) for d in documents],
+            )
+
+    def ingest(self, paths: Iterable[str], root: Optional[str] = None, prune: bool = False) -> Dict[str, Any]:
+        """Bring the index in line with the documents; returns counts and throughput"""
+        started = time.perf_counter()
+        files = discover(paths)
+        chunks: List[Dict[str, Any]] = []
+        failed: List[str] = []
+        for path in files:
+            try:
+                chunks.extend(chunk_document(path, root))
+            except Exception as e:
+                failed.append(os.path.relpath(path, root) if root else path)
+                print(f"[INGEST] skipping {path}: {e}")
+        sources = sorted({chunk["source"] for chunk in chunks})
+        known = self._known(sources)
+
+        changed = [chunk for chunk in chunks if known.get(chunk["id"], (None, None))[1] != chunk["content_hash"]]
+        current_ids = {chunk["id"] for chunk in chunks}
+        stale = [doc_id for doc_id in known if doc_id not in current_ids]
+        if prune:
+            # Documents that failed to load keep their previous chunks
+            seen = set(sources) | set(failed)
+            stale += [row[0] for row in self._conn.execute("SELECT id, source FROM chunks") if row[1] not in seen]
+
+        # Identical text (repeated boilerplate, moved paragraphs) is embedded once
+        by_hash: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in changed:
+            by_hash.setdefault(chunk["content_hash"], []).append(chunk)
+        cached = self._cached_embeddings(list(by_hash))
+        pending: List[Dict[str, Any]] = []
+        written = 0
+
+        def ready(content_hash: str, vector: Any):
+            nonlocal written
+            for chunk in by_hash[content_hash]:
+                pending.append({**chunk, "content_vector": [float(x) for x in vector]})
+            while len(pending) >= UPSERT_BATCH_SIZE:
+                self._write(pending[:UPSERT_BATCH_SIZE])
+                written += UPSERT_BATCH_SIZE
+                del pending[:UPSERT_BATCH_SIZE]
+
+        for digest, vector in cached.items():
+            ready(digest, vector)
+
+        to_embed = [digest for digest in by_hash if digest not in cached]
+        batches = [to_embed[start:start + self.batch_size] for start in range(0, len(to_embed), self.batch_size)]
+        embed_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {
+                pool.submit(self.embed, [by_hash[digest][0]["content"] for digest in batch]): batch
+                for batch in batches
+            }
+            # Batches are upserted as they complete, so writes overlap the remaining embedding calls
+            for future in as_completed(futures):
+                batch = futures[future]
+                vectors = [np.asarray(vector, dtype=np.float32) for vector in future.result()]
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embeddings (content_hash, embedding) VALUES (?, ?)",
+                        [(digest, vector.tobytes()) for digest, vector in zip(batch, vectors)],
+                    )
+                for digest, vector in zip(batch, vectors):
+                    ready(digest, vector)
+        embed_seconds = time.perf_counter() - embed_started
+        if pending:
+            self._write(pending)
+            written += len(pending)
+
+        if stale:
+            self.index.delete(stale)
+            with self._conn:
+                self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in stale])
+        # Every current chunk is offered, so a lexical index added after the vector index catches up
+        lexical_written = 0
+        if self.lexical is not None:
+            lexical_written = self.lexical.sync(chunks)
+            if stale:
+                self.lexical.delete(stale)
+
+        seconds = time.perf_counter() - started
+        return {
+            "files": len(files),
+            "failed_files": len(failed),
+            "chunks": len(chunks),
+            "unchanged": len(chunks) - len(changed),
+            "embedded": len(to_embed),
+            "reused_embeddings": len(changed) - len(to_embed),
+            "written": written,
+            "deleted": len(stale),
+            "lexical_written": lexical_written,
+            "embed_requests": len(batches),
+            "seconds": seconds,
+            "chunks_per_second": len(chunks) / seconds if seconds else 0.0,
+            "embedded_per_second": len(to_embed) / embed_seconds if to_embed and embed_seconds else 0.0,
+        }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Build or refresh the Unstructured Chat document index")
+    parser.add_argument("command", choices=["ingest"])
+    parser.add_argument("paths", nargs="+", help="files or directories to ingest")
+    parser.add_argument("--target", choices=["azure", "local"], default=os.getenv("FILE_INDEX_TARGET", "azure"))
+    parser.add_argument("--index-name", default=INDEX_NAME)
+    parser.add_argument("--local-path", default=os.getenv("LOCAL_FILE_INDEX_PATH", "file_index.db"))
+    parser.add_argument("--state", default=os.getenv("FILE_INDEX_STATE_PATH", "file_index_state.db"),
+                        help="manifest of written chunks and cached embeddings")
+    parser.add_argument("--lexical-path", default=os.getenv("LEXICAL_INDEX_PATH", "lexical_index.db"),
+                        help="BM25 chunk index for hybrid retrieval ('' to skip)")
+    parser.add_argument("--root", help="directory document names are recorded relative to")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=EMBED_CONCURRENCY, help="embedding requests in flight")
+    parser.add_argument("--prune", action="store_true", help="delete chunks of documents no longer present")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if args.target == "azure":
+        index = AzureSearchIndex(os.getenv("AZURE_SEARCH_SERVICE"), os.getenv("AZURE_SEARCH_API_KEY"),
+                                 args.index_name)
+    else:
+        index = LocalFileIndex(args.local_path)
+    lexical = None
+    if args.lexical_path:
+        from hybrid_search import LexicalIndex
+
+        lexical = LexicalIndex(args.lexical_path)
+    ingestor = Ingestor(args.state, index, openai_embedder(), batch_size=args.batch_size,
+                        concurrency=args.concurrency, lexical=lexical)
+    report = ingestor.ingest(args.paths, root=args.root, prune=args.prune)
+    print(f"{report['files']} files ({report['failed_files']} failed), {report['chunks']} chunks: "
+          f"{report['unchanged']} unchanged, {report['embedded']} embedded in {report['embed_requests']} requests, "
+          f"{report['reused_embeddings']} reused embeddings, {report['written']} written, {report['deleted']} deleted, "
+          f"{report['lexical_written']} written to the lexical index")
+    print(f"{report['seconds']:.1f}s, {report['chunks_per_second']:.1f} chunks/s "
+          f"({report['embedded_per_second']:.1f} embedded chunks/s)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Hybrid lexical + vector retrieval for Unstructured Chat.
+
+Embedding similarity blurs exact identifiers such as project codes ("PRJ-1042") and
+integration names ("Bynder-Matillion"). A BM25 inverted index over the chunk text, kept
+in SQLite and refreshed by `file_index.py ingest`, finds them; its ranking is fused with
+the vector search by reciprocal-rank fusion, and the fused candidates are reordered by a
+local scorer that reads the question and each passage together. `depth` candidates are
+taken from each side; the retriever returns the best `k`.
+"""
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from admission import slot
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal-rank fusion constant: larger values flatten the gap between ranks
+RRF_K = 60
+CANDIDATE_DEPTH = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id           TEXT PRIMARY KEY,
+    content      TEXT NOT NULL,
+    terms        TEXT NOT NULL,
+    filename     TEXT,
+    chunk_index  INTEGER,
+    source_page  INTEGER,
+    content_hash TEXT NOT NULL
+);
+"""
+
+TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+SEPARATORS = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be by can could did do does for from had has have how i in is it its me my of on or "
+    "our so that the their there these this those to was we were what when where which who why will with "
+    "would you your".split()
+)
+
+# Weights of the feature scorer: query-term coverage, phrase match, proximity and the fused rank
+SCORE_WEIGHTS = (0.4, 0.2, 0.1, 0.3)
+
+
+def _stem(word: str) -> str:
+    """Light plural folding: integrations -> integration, policies -> policy"""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms in order; hyphenated and dotted words also yield their joined form"""
+    terms = []
+    for match in TOKEN.finditer(text.lower()):
+        parts = SEPARATORS.split(match.group())
+        terms.extend(_stem(part) for part in parts if part not in STOPWORDS)
+        if len(parts) > 1:
+            # "Bynder-Matillion" matches "bynder matillion" and "byndermatillion"
+            terms.append("".join(parts))
+    return terms
+
+
+class LexicalIndex:
+    """Chunk text in SQLite with an in-memory BM25 inverted index"""
+
+    def __init__(self, path: str, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        # term -> (document positions, precomputed BM25 weights)
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._idf: Dict[str, float] = {}
+        self._max_idf = 0.0
+        self._version: Optional[int] = None
+
+    def sync(self, chunks: List[Dict[str, Any]]) -> int:
+        """Write the chunks whose text changed (file_index.chunk_document fields); returns how many"""
+        with self._lock:
+            known = {}
+            ids = [chunk["id"] for chunk in chunks]
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                known.update(self._conn.execute(
+                    f"SELECT id, content_hash FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch,
+                ).fetchall())
+            changed = [chunk for chunk in chunks if known.get(chunk["id"]) != chunk["content_hash"]]
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks (id, content, terms, filename, chunk_index, source_page, "
+                    "content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(c["id"], c["content"], " ".join(tokenize(c["content"])), c["filename"], c["chunk_index"],
+                      c["source_page"], c["content_hash"]) for c in changed],
+                )
+        return len(changed)
+
+    def delete(self, ids: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def _load(self):
+        """(Re)build the postings when the database changed; caller holds the lock"""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0] + self._conn.total_changes
+        if version == self._version:
+            return
+        rows = self._conn.execute("SELECT id, terms FROM chunks").fetchall()
+        self._ids = [row[0] for row in rows]
+        lengths = np.zeros(len(rows), dtype=np.float32)
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for position, (_, terms) in enumerate(rows):
+            counts = Counter(terms.split())
+            lengths[position] = sum(counts.values())
+            for term, tf in counts.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(position)
+                tfs.append(tf)
+        count = len(rows)
+        norms = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()) if count else 0.0, 1.0))
+        self._postings, self._idf = {}, {}
+        for term, (docs, tfs) in postings.items():
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            positions = np.asarray(docs, dtype=np.int32)
+            tf = np.asarray(tfs, dtype=np.float32)
+            self._postings[term] = (positions, (idf * tf * (self.k1 + 1) / (tf + norms[positions])).astype(np.float32))
+            self._idf[term] = idf
+        # A term the index has never seen is as rare as it gets
+        self._max_idf = math.log(1 + (count + 0.5) / 0.5)
+        self._version = version
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    def idf(self, terms: List[str]) -> Dict[str, float]:
+        with self._lock:
+            self._load()
+            return {term: self._idf.get(term, self._max_idf) for term in terms}
+
+    def search(self, query: str, k: int = 4) -> List[Dict[str, Any]]:
+        """The k best BM25 matches, best first; chunks sharing no term with the query are never returned"""
+        terms = set(tokenize(query))
+        with self._lock:
+            self._load()
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term in terms:
+                if term in self._postings:
+                    docs, weights = self._postings[term]
+                    scores[docs] += weights
+            matched = np.flatnonzero(scores)
+            if not len(matched):
+                return []
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            best = matched[np.argsort(-scores[matched])]
+            ids = [self._ids[position] for position in best]
+            rows = {
+                row[0]: row for row in self._conn.execute(
+                    f"SELECT id, content, filename, chunk_index, source_page FROM chunks "
+                    f"WHERE id IN ({','.join('?' * len(ids))})", ids,
+                )
+            }
+        return [
+            {"content": rows[doc_id][1], "filename": rows[doc_id][2], "chunk_index": rows[doc_id][3],
+             "source_page": rows[doc_id][4], "score": float(scores[position])}
+            for doc_id, position in zip(ids, best)
+        ]
+
+
+def hit_key(hit: Dict[str, Any]) -> Any:
+    """The same chunk from either side: its file and position, or its text when the store lacks them"""
+    if hit.get("filename") is not None and hit.get("chunk_index") is not None:
+        return hit["filename"], int(hit["chunk_index"])
+    return hit["content"]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], k: int = RRF_K) -> List[Dict[str, Any]]:
+    """Hits of every ranking merged by sum(1 / (k + rank)), best first, with the sum as "fused" """
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, 1):
+            entry = fused.setdefault(hit_key(hit), {**hit, "fused": 0.0})
+            entry["fused"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: -hit["fused"])
+
+
+def _window(positions: Dict[str, List[int]]) -> int:
+    """Length of the shortest token span containing every term in positions"""
+    events = sorted((position, term) for term, found in positions.items() for position in found)
+    counts: Dict[str, int] = {}
+    best, start = events[-1][0] - events[0][0] + 1, 0
+    for position, term in events:
+        counts[term] = counts.get(term, 0) + 1
+        while len(counts) == len(positions):
+            best = min(best, position - events[start][0] + 1)
+            first = events[start][1]
+            counts[first] -= 1
+            if not counts[first]:
+                del counts[first]
+            start += 1
+    return best
+
+
+class FeatureScorer:
+    """Scores (question, passage) pairs from IDF-weighted term coverage, phrase and proximity matches and the fused rank"""
+
+    def __init__(self, lexical: Optional[LexicalIndex] = None, weights: Tuple[float, ...] = SCORE_WEIGHTS):
+        self.lexical = lexical
+        self.weights = weights
+
+    def score(self, query: str, hits: List[Dict[str, Any]]) -> List[float]:
+        sequence = tokenize(query)
+        terms = list(dict.fromkeys(sequence))
+        if not terms:
+            return [hit.get("fused", 0.0) for hit in hits]
+        idf = self.lexical.idf(terms) if self.lexical is not None else {term: 1.0 for term in terms}
+        total = sum(idf.values()) or 1.0
+        bigrams = set(zip(sequence, sequence[1:]))
+        top = max((hit.get("fused", 0.0) for hit in hits), default=0.0) or 1.0
+        w_coverage, w_phrase, w_proximity, w_rank = self.weights
+        scores = []
+        for hit in hits:
+            passage = tokenize(hit["content"])
+            positions: Dict[str, List[int]] = {}
+            for position, term in enumerate(passage):
+                if term in idf:
+                    positions.setdefault(term, []).append(position)
+            coverage = sum(idf[term] for term in positions) / total
+            phrase = len(bigrams & set(zip(passage, passage[1:]))) / len(bigrams) if bigrams else 0.0
+            proximity = len(positions) / _window(positions) if len(positions) > 1 else float(bool(positions))
+            scores.append(w_coverage * coverage + w_phrase * phrase + w_proximity * proximity
+                          + w_rank * hit.get("fused", 0.0) / top)
+        return scores
+
+
+class CrossEncoderScorer:
+    """A sentence-transformers cross-encoder run locally (RERANK_MODEL), for when one is installed"""
+
+    def __init__(self, model: str):
+        self.model = CrossEncoder(model)
+
+    def score(self, query: str, hits: List[Dict[str, Any]]) -> List[float]:
+        return [float(score) for score in self.model.predict([(query, hit["content"]) for hit in hits])]
+
+
+def build_scorer(lexical: Optional[LexicalIndex], model: Optional[str] = None):
+    """The cross-encoder when a model is configured and sentence-transformers is installed, else FeatureScorer"""
+    if model:
+        if CrossEncoder is not None:
+            return CrossEncoderScorer(model)
+        print(f"[HYBRID] sentence-transformers is not installed; reranking with FeatureScorer instead of {model}")
+    return FeatureScorer(lexical)
+
+
+def local_vector_search(index: Any, embed_query: Callable[[str], List[float]]) -> Callable[[str, int], List[Dict]]:
+    """Vector side backed by file_index.LocalFileIndex"""
+    return lambda query, k: index.search(embed_query(query), k)
+
+
+def azure_vector_search(vector_store: Any) -> Callable[[str, int], List[Dict[str, Any]]]:
+    """Vector side backed by a LangChain AzureSearch store, holding an azure_search slot per search"""
+    def search(query: str, k: int) -> List[Dict[str, Any]]:
+        with slot("azure_search"):
+            results = vector_store.similarity_search_with_relevance_scores(query, k=k)
+        return [
+            {"content": doc.page_content, "filename": doc.metadata.get("filename"),
+             "chunk_index": doc.metadata.get("chunk_index"), "source_page": doc.metadata.get("source_page"),
+             "score": float(score)}
+            for doc, score in results
+        ]
+
+    return search
+
+
+class HybridRetriever:
+    """Vector and BM25 candidates fused by reciprocal rank, then reranked"""
+
+    def __init__(self, vector_search: Callable[[str, int], List[Dict[str, Any]]],
+                 lexical: Optional[LexicalIndex] = None, scorer: Any = None,
+                 depth: int = CANDIDATE_DEPTH, k: int = 4):
+        self.vector_search = vector_search
+        self.lexical = lexical
+        self.scorer = scorer if scorer is not None else FeatureScorer(lexical)
+        self.depth = max(depth, k)
+        self.k = k
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        k = k or self.k
+        rankings = [self.vector_search(query, self.depth)]
+        if self.lexical is not None:
+            rankings.append(self.lexical.search(query, self.depth))
+        candidates = reciprocal_rank_fusion(rankings)[:self.depth]
+        for hit, score in zip(candidates, self.scorer.score(query, candidates)):
+            hit["score"] = score
+        return sorted(candidates, key=lambda hit: -hit["score"])[:k]
+
+    def as_retriever(self):
+        """LangChain retriever returning Documents with the same metadata as the Azure index"""
+        from langchain_core.documents import Document
+        from langchain_core.retrievers import BaseRetriever
+
+        hybrid = self
+
+        class HybridSearchRetriever(BaseRetriever):
+            def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+                return [
+                    Document(page_content=hit["content"], metadata={
+                        "filename": hit["filename"], "chunk_index": hit["chunk_index"],
+                        "source_page": hit["source_page"],
+                    })
+                    for hit in hybrid.search(query)
+                ]
+
+        return HybridSearchRetriever()
@@ -0,0 +1,273 @@
+"""Local columnar mirror of the semantic-model tables: Parquet files queried with DuckDB.
+
+Each table is kept as one Parquet file and exposed under its Snowflake name
+(DATABASE.SCHEMA.TABLE), so Cortex-generated SQL runs unchanged. Tables with a
+primary key and a modification or load timestamp sync incrementally from that
+watermark; the others (and every table once per full-refresh period) are reloaded
+whole. Business dates such as ESTIMATED_CLOSE_DATE are never watermarks: they can lie
+in the future and do not move when a row changes, so rows edited later would be
+skipped. The watermark is a time dimension named like a modification timestamp
+(LAST_MODIFIED_AT, UPDATED_AT, LOADED_AT, ...), or the column MIRROR_WATERMARKS
+names for the table ({"PPP_CDM_COMPANY": "_LOADED_AT"}).
+
+    python local_mirror.py sync [--full]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import yaml
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+WATERMARK_TYPES = ("DATE", "TIMESTAMP")
+MODIFICATION_COLUMN = re.compile(r"MODIFIED|UPDATED|CHANGED|LOADED|INGESTED|SYNCED|_LOAD_", re.IGNORECASE)
+# Table -> column that changes whenever a row is written, for tables whose model has none
+WATERMARK_COLUMNS: Dict[str, str] = json.loads(os.getenv("MIRROR_WATERMARKS", "{}"))
+
+# Snowflake functions Cortex commonly emits that DuckDB lacks under the same name
+SNOWFLAKE_MACROS = [
+    "CREATE MACRO iff(cond, a, b) AS CASE WHEN cond THEN a ELSE b END",
+    "CREATE MACRO nvl(a, b) AS coalesce(a, b)",
+    "CREATE MACRO zeroifnull(a) AS coalesce(a, 0)",
+    "CREATE MACRO nullifzero(a) AS nullif(a, 0)",
+    "CREATE MACRO div0(a, b) AS CASE WHEN b = 0 THEN 0 ELSE a / b END",
+]
+# Constructs that bind in DuckDB but mean something else there, or only exist in Snowflake
+INCOMPATIBLE_SQL = re.compile(r"\b(FLATTEN|LATERAL|SAMPLE|TABLESAMPLE|CONNECT\s+BY|MATCH_RECOGNIZE)\b|\w:\w",
+                              re.IGNORECASE)
+
+
+def mirrored_tables(model_path: str, watermark_columns: Dict[str, str] = WATERMARK_COLUMNS) -> List[Dict[str, Any]]:
+    """Base table, primary key and watermark column (None: no modification timestamp) of every model table"""
+    with open(model_path, "r") as f:
+        model = yaml.safe_load(f)
+    tables = []
+    for table in model.get("tables") or []:
+        base = table["base_table"]
+        watermark = next(
+            (dim for dim in table.get("time_dimensions") or []
+             if dim.get("data_type", "").upper().startswith(WATERMARK_TYPES)
+             and MODIFICATION_COLUMN.search(dim["expr"])),
+            None,
+        )
+        if base["table"] in watermark_columns:
+            # A configured column need not be in the model; compared as a timestamp
+            watermark = {"expr": watermark_columns[base["table"]], "data_type": "TIMESTAMP"}
+        tables.append({
+            "name": base["table"],
+            "qualified": f"{base['database']}.{base['schema']}.{base['table']}",
+            "database": base["database"],
+            "schema": base["schema"],
+            "primary_key": (table.get("primary_key") or {}).get("columns") or [],
+            "watermark": watermark["expr"] if watermark else None,
+            "watermark_is_date": bool(watermark) and watermark["data_type"].upper() == "DATE",
+        })
+    return tables
+
+
+class LocalMirror:
+    """Syncs the semantic-model tables into Parquet and answers SQL over them when it can"""
+
+    def __init__(self, model_path: str, mirror_dir: str, fetch: Callable[[str], pd.DataFrame],
+                 full_refresh_hours: float = 24, max_staleness_minutes: float = 60):
+        if duckdb is None:
+            raise ImportError("duckdb is required for the local mirror")
+        self.tables = mirrored_tables(model_path)
+        self.mirror_dir = mirror_dir
+        self.fetch = fetch
+        self.full_refresh_seconds = full_refresh_hours * 3600
+        self.max_staleness_seconds = max_staleness_minutes * 60
+        self._state_path = os.path.join(mirror_dir, "mirror_state.json")
+        self._sync_lock = threading.Lock()
+        self._ddl_lock = threading.Lock()
+        os.makedirs(mirror_dir, exist_ok=True)
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self._state_path):
+            with open(self._state_path, "r") as f:
+                self.state = json.load(f)
+
+        self._db = duckdb.connect()
+        self._db.execute("SET default_null_order = 'nulls_last_on_asc_first_on_desc'")
+        for macro in SNOWFLAKE_MACROS:
+            self._db.execute(macro)
+        for database in {table["database"] for table in self.tables}:
+            self._db.execute(f'ATTACH \':memory:\' AS "{database}"')
+        for table in self.tables:
+            self._db.execute(f'CREATE SCHEMA IF NOT EXISTS "{table["database"]}"."{table["schema"]}"')
+            if table["name"] in self.state:
+                self._expose(table, self.state[table["name"]]["file"])
+
+    def _expose(self, table: Dict[str, Any], file_name: str):
+        path = os.path.join(self.mirror_dir, file_name).replace("'", "''")
+        with self._ddl_lock:
+            self._db.execute(
+                f'CREATE OR REPLACE VIEW "{table["database"]}"."{table["schema"]}"."{table["name"]}" '
+                f"AS SELECT * FROM read_parquet('{path}')"
+            )
+
+    def _save_state(self):
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self._state_path)
+
+    def sync_table(self, table: Dict[str, Any], full: bool = False) -> int:
+        """Bring one table up to date; returns the number of rows fetched from Snowflake"""
+        previous = self.state.get(table["name"])
+        now = time.time()
+        incremental = (
+            not full and previous is not None and table["watermark"] and table["primary_key"]
+            and previous.get("watermark") is not None
+            and now - previous["full_at"] < self.full_refresh_seconds
+            # Another process may have pruned this process's copy once it went stale
+            and os.path.exists(os.path.join(self.mirror_dir, previous["file"]))
+        )
+        sql = f"SELECT * FROM {table['qualified']}"
+        if incremental:
+            # Re-read the watermark day itself: rows stamped with it may have arrived after the last sync
+            sql += f" WHERE {table['watermark']} >= '{previous['watermark']}'"
+        fetched = pa.Table.from_pandas(self.fetch(sql), preserve_index=False)
+
+        if incremental:
+            current = pq.read_table(os.path.join(self.mirror_dir, previous["file"]))
+            keys = table["primary_key"]
+            if len(keys) == 1:
+                unchanged = pc.invert(pc.is_in(current[keys[0]], value_set=fetched[keys[0]]))
+                current = current.filter(unchanged)
+            else:
+                fetched_keys = set(zip(*(fetched[key].to_pylist() for key in keys)))
+                current = current.filter(pa.array([
+                    row not in fetched_keys for row in zip(*(current[key].to_pylist() for key in keys))
+                ]))
+            merged = pa.concat_tables([current, fetched.cast(current.schema)])
+        else:
+            merged = fetched
+
+        file_name = f"{table['name']}-{int(now * 1000)}.parquet"
+        pq.write_table(merged, os.path.join(self.mirror_dir, file_name))
+        self._expose(table, file_name)
+
+        watermark = None
+        if table["watermark"] and table["watermark"] in merged.column_names and merged.num_rows:
+            latest = pc.max(merged[table["watermark"]]).as_py()
+            if latest is not None:
+                if table["watermark_is_date"] and hasattr(latest, "date"):
+                    latest = latest.date()
+                watermark = latest.isoformat()
+        self.state[table["name"]] = {
+            "file": file_name,
+            "rows": merged.num_rows,
+            "watermark": watermark,
+            "synced_at": now,
+            "full_at": previous["full_at"] if incremental else now,
+        }
+        self._save_state()
+        self._prune(table, now)
+        return fetched.num_rows
+
+    def _prune(self, table: Dict[str, Any], now: float):
+        """Delete the table's superseded Parquet files once no process can still be reading them
+
+        Other processes (replicas, the cron sync) keep views on the file they last synced or loaded
+        and stop querying it once it is older than the staleness limit, so older copies are safe to drop.
+        """
+        copies = re.compile(rf"{re.escape(table['name'])}-\d+\.parquet")
+        for file_name in os.listdir(self.mirror_dir):
+            if not copies.fullmatch(file_name) or file_name == self.state[table["name"]]["file"]:
+                continue
+            path = os.path.join(self.mirror_dir, file_name)
+            try:
+                if now - os.path.getmtime(path) > self.max_staleness_seconds:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def sync(self, full: bool = False) -> Dict[str, int]:
+        """Sync every table; a failing table keeps its previous copy"""
+        fetched = {}
+        with self._sync_lock:
+            for table in self.tables:
+                try:
+                    fetched[table["name"]] = self.sync_table(table, full=full)
+                except Exception as e:
+                    print(f"[MIRROR] sync of {table['name']} failed: {e}")
+        return fetched
+
+    def start_schedule(self, interval_minutes: float):
+        """Sync now and then every interval on a daemon thread"""
+        def loop():
+            while True:
+                self.sync()
+                time.sleep(interval_minutes * 60)
+
+        threading.Thread(target=loop, name="mirror-sync", daemon=True).start()
+
+    @property
+    def fresh(self) -> bool:
+        """Every table has a copy no older than the staleness limit"""
+        now = time.time()
+        return all(
+            table["name"] in self.state and now - self.state[table["name"]]["synced_at"] < self.max_staleness_seconds
+            for table in self.tables
+        )
+
+    def synced_at(self) -> Optional[float]:
+        """When the oldest mirrored table was last synced"""
+        if not self.state:
+            return None
+        return min(entry["synced_at"] for entry in self.state.values())
+
+    def query(self, sql: str) -> Optional[pd.DataFrame]:
+        """Run the statement locally, or None when it must go to Snowflake
+
+        Anything DuckDB cannot bind (unmirrored tables, Snowflake-only functions) falls back.
+        """
+        if not self.fresh or INCOMPATIBLE_SQL.search(sql):
+            return None
+        try:
+            with self._ddl_lock:
+                cursor = self._db.cursor()
+            return cursor.execute(sql).df()
+        except duckdb.Error as e:
+            print(f"[MIRROR] falling back to Snowflake: {str(e).splitlines()[0]}")
+            return None
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Sync the local mirror of the semantic-model tables")
+    parser.add_argument("command", choices=["sync"])
+    parser.add_argument("--full", action="store_true", help="reload every table instead of syncing from watermarks")
+    parser.add_argument("--model", default="pppcdmai.yaml")
+    parser.add_argument("--mirror-dir", default=os.getenv("MIRROR_DIR", "mirror"))
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    args = parser.parse_args(argv)
+
+    import tomllib
+    import snowflake.connector
+
+    with open(args.secrets, "rb") as f:
+        secrets = tomllib.load(f)
+    conn = snowflake.connector.connect(
+        user=secrets["user_name"], password=secrets["password"], account=secrets["account"],
+        host=secrets["host"], port=443, warehouse=secrets["warehouse"], role=secrets["role"],
+    )
+    mirror = LocalMirror(args.model, args.mirror_dir, lambda sql: pd.read_sql(sql, conn))
+    for name, rows in mirror.sync(full=args.full).items():
+        print(f"{name}: {rows} rows fetched, {mirror.state[name]['rows']} mirrored")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
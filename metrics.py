@@ -0,0 +1,250 @@
+"""In-process metrics (counters, gauges, histograms) in the Prometheus text exposition format.
+
+Metrics are created once per process, at import, in the module-level registry, and observed
+with positional label values:
+
+    CORTEX_SECONDS = metrics.histogram("ppp_cortex_request_seconds", "Cortex Analyst request latency")
+    CORTEX_SECONDS.observe(elapsed)
+    RESPONSES = metrics.counter("ppp_cortex_responses_total", "Cortex Analyst responses", ["status"])
+    RESPONSES.inc("200")
+
+An observation is a dict lookup, a bisect and a few additions under an uncontended lock
+(see benchmarks/metrics_overhead.py). State that already lives elsewhere (cache stats,
+admission queues) is read at scrape time through collect() callbacks instead.
+serve() exposes GET /metrics on a local port; the API serves it on its own port.
+"""
+import bisect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds, from a cache hit to a slow warehouse query
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _check(self, values: Tuple[Any, ...]):
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {values}")
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, *labels: Any, amount: float = 1.0):
+        with self._lock:
+            if labels not in self._values:
+                self._check(labels)
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: Any):
+        with self._lock:
+            if labels not in self._values:
+                self._check(labels)
+            self._values[labels] = value
+
+    def dec(self, *labels: Any, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (+Inf last), sum]; made cumulative when rendered
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: Any):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                self._check(labels)
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels: Any) -> "_Timer":
+        """Context manager observing the seconds its block took"""
+        return _Timer(self, labels)
+
+    def count(self, *labels: Any) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[Any, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class _Collected(_Metric):
+    """Values computed by a callback at scrape time: {label values tuple: value}"""
+
+    def __init__(self, name: str, help: str, kind: str, labels: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[Any, ...], float]]):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"[METRICS] {self.name} collection failed: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Registry:
+    """Named metrics; asking for an existing name returns it, so re-run scripts do not duplicate them"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, _Collected):
+                if existing.kind != metric.kind or existing.labels != metric.labels:
+                    raise ValueError(f"{metric.name} is already registered as a {existing.kind} {existing.labels}")
+                return existing
+            # A callback registered again (a rebuilt resource) replaces the previous one
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._get_or_add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_add(Histogram(name, help, labels, buckets))
+
+    def collect(self, name: str, help: str, kind: str, callback: Callable[[], Dict[Tuple[Any, ...], float]],
+                labels: Sequence[str] = ()):
+        """Register a callback computing a gauge's or counter's values when scraped"""
+        self._get_or_add(_Collected(name, help, kind, labels, callback))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+collect = REGISTRY.collect
+
+
+def serve(port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve GET /metrics in a background thread; returns the running server"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"[METRICS] serving http://{host}:{server.server_address[1]}/metrics")
+    return server
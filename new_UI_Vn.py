@@ -1,7 +1,5 @@
 from typing import Any, Dict, List, Optional
 import pandas as pd
-import requests
-import snowflake.connector
 import streamlit as st
 from dotenv import load_dotenv
 import json
@@ -10,7 +8,7 @@ import google.generativeai as genai
 import time
 import random
 import altair as alt
-from datetime import datetime
+from datetime import datetime, timedelta
 from io import BytesIO
 import xlsxwriter
 import streamlit.components.v1 as components
@@ -18,13 +16,38 @@ import html
 from datetime import datetime
 from anthropic import Anthropic
 import openai
-import csv
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_anthropic.chat_models import ChatAnthropic
 from langchain_xai import ChatXAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.vectorstores.azuresearch import AzureSearch as AzureSearchStore
 from langchain.chains import RetrievalQA    
+from data_table import render_paged_table, to_arrow
+from conversation_store import ConversationStore
+from analyst_context import build_analyst_messages
+from pipeline import SQL_CACHE_TTL_SECONDS, load_result
+from file_index import LocalFileIndex, admitted_retriever
+from qa_cache import AnswerCache, fixed_retriever
+from shared_cache import MemoryBackend, SharedCache
+from hybrid_search import HybridRetriever, LexicalIndex, azure_vector_search, build_scorer, local_vector_search
+from answer_log import AnswerLog
+from admission import BACKGROUND, as_caller, caller, slot
+from usage import UsageLedger, attribute, attributed, record, record_openai, summarize
+from langchain_community.callbacks import get_openai_callback
+from contextlib import contextmanager
+from structured_pipeline import (
+    CACHE_ANSWER_TTL_SECONDS, SAMPLE_QUESTIONS, StructuredPipeline, build_admission_controller,
+    build_entity_index, build_grounding_index, build_local_mirror, build_semantic_cache, build_shared_cache,
+    WARMUP_ENABLED, build_usage_ledger, build_verified_store, build_warehouse_router, connect, cortex_base_url,
+    openai_client, semantic_model_file, start_warmer,
+)
+from result_frames import compact_frame, frame_bytes, prune_spill_files, release_result, result_frame, spill_table
+import tempfile
+from prefetch import SuggestionPrefetcher
+from chart_profile import CHART_TYPES, altair_type, prepare_chart_frame, profile_result, recommend_chart
+import metrics
+
+script_started = time.perf_counter()
 
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -32,32 +55,58 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 load_dotenv()
 
 # Constants
-DATABASE = st.secrets["database"]
-SCHEMA = st.secrets["schema"]
-STAGE = st.secrets["stage"]
-FILE = st.secrets["yaml_name"]
-WAREHOUSE = st.secrets["warehouse"]
-HOST = st.secrets["host"]
-ACCOUNT = st.secrets["account"]
-USER = st.secrets["user_name"]
-PASSWORD = st.secrets["password"]
-ROLE = st.secrets["role"]
+CORTEX_BASE_URL = cortex_base_url(st.secrets)
+SEMANTIC_MODEL_FILE = semantic_model_file(st.secrets)
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+# Speculative execution of Cortex follow-up suggestions (off unless enabled)
+PREFETCH_SUGGESTIONS = os.getenv("PREFETCH_SUGGESTIONS", "0") == "1"
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "2"))
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "4"))
+PREFETCH_USER_LIMIT = int(os.getenv("PREFETCH_USER_LIMIT", "20"))  # prefetches per user per hour, all their sessions
+PREFETCH_WAREHOUSE_SECONDS = float(os.getenv("PREFETCH_WAREHOUSE_SECONDS", "300"))  # per hour, all sessions
+# Where Unstructured Chat retrieves from: the Azure "file-index" or a local index built by file_index.py
+FILE_INDEX_TARGET = os.getenv("FILE_INDEX_TARGET", "azure")
+LOCAL_FILE_INDEX_PATH = os.getenv("LOCAL_FILE_INDEX_PATH", "file_index.db")
+# "hybrid" fuses BM25 over LEXICAL_INDEX_PATH with the vector search and reranks the candidates
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "similarity")
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))  # taken from each side before reranking
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index.db")
+RERANK_MODEL = os.getenv("RERANK_MODEL")  # optional sentence-transformers cross-encoder
+# Unstructured Chat answers per question and model, one SQLite file per month
+ANSWER_LOG_DIR = os.getenv("ANSWER_LOG_DIR", "answer_log")
+# Results larger than this (after compaction) are kept in a memory-mapped file instead of the heap
+RESULT_SPILL_BYTES = int(float(os.getenv("RESULT_SPILL_MB", "32")) * 2**20)
+# One spill directory for all sessions, pruned by age and total size at startup and after each spill
+RESULT_SPILL_DIR = os.getenv("RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "ppp_results"))
+RESULT_SPILL_MAX_BYTES = int(float(os.getenv("RESULT_SPILL_MAX_MB", "2048")) * 2**20)
+RESULT_SPILL_MAX_AGE_SECONDS = float(os.getenv("RESULT_SPILL_MAX_AGE_HOURS", "12")) * 3600
+# Only behind an authenticating proxy that sets X-Forwarded-Email/-User: otherwise any visitor could send them
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "0") == "1"
+# Comma-separated users who may see everyone's usage in the sidebar; others see only their own
+USAGE_ADMINS = {user.strip() for user in os.getenv("USAGE_ADMINS", "").split(",") if user.strip()}
+# Result cards rerun on their own when their widgets change; 0 reruns the whole script (the benchmark baseline)
+RESULT_CARD_FRAGMENT = os.getenv("RESULT_CARD_FRAGMENT", "1") == "1"
+# Local port serving GET /metrics for this process (0: off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+SESSION_ACTIVE_SECONDS = 300  # a session with a script run this recent counts as active
+
+SCRIPT_RUN_SECONDS = metrics.histogram("ppp_script_run_seconds", "Streamlit script run durations")
+SESSIONS_STARTED = metrics.counter("ppp_sessions_started_total", "Chat sessions started or resumed", ["kind"])
+RESULT_ROWS = metrics.histogram("ppp_result_rows", "Rows per loaded query result", ["source"], metrics.SIZE_BUCKETS)
+RESULT_BYTES = metrics.histogram("ppp_result_bytes", "In-memory bytes per loaded query result (after compaction)",
+                                 ["source"], metrics.SIZE_BUCKETS)
+
+# Conversation history: messages rendered in full, kept in session memory, and fetched per page
+HISTORY_EAGER_MESSAGES = 10
+HISTORY_MEMORY_CAP = 40
+HISTORY_PAGE_SIZE = 20
 
 chat_mode = "Select Chat Mode"
 
 @st.cache_resource
 def get_snowflake_connection():
     try:
-        conn = snowflake.connector.connect(
-            user=USER,
-            password=PASSWORD,
-            account=ACCOUNT,
-            host=HOST,
-            port=443,
-            warehouse=WAREHOUSE,
-            role=ROLE,
-        )
-        return conn
+        return connect(st.secrets)
     except Exception as e:
         st.error(f"Failed to establish Snowflake connection: {str(e)}")
         return None
@@ -80,6 +129,141 @@ def execute_query(query: str):
         cursor.close()
 
 
+@st.cache_resource
+def get_conversation_store():
+    return ConversationStore(CONVERSATION_DB_PATH)
+
+
+@st.cache_resource
+def get_verified_query_store():
+    return build_verified_store()
+
+
+@st.cache_resource
+def get_spill_dir() -> str:
+    """The shared spill directory, cleared on first use of what earlier runs left behind"""
+    os.makedirs(RESULT_SPILL_DIR, exist_ok=True)
+    deleted = prune_spill_files(RESULT_SPILL_DIR, RESULT_SPILL_MAX_BYTES, RESULT_SPILL_MAX_AGE_SECONDS)
+    if deleted:
+        print(f"[SPILL] removed {deleted} stale spill files from {RESULT_SPILL_DIR}")
+    return RESULT_SPILL_DIR
+
+
+@st.cache_resource
+def get_local_mirror():
+    return build_local_mirror(get_snowflake_connection())
+
+
+@st.cache_resource
+def get_prefetcher():
+    return SuggestionPrefetcher(max_workers=PREFETCH_WORKERS, top_k=PREFETCH_TOP_K,
+                                user_limit=PREFETCH_USER_LIMIT,
+                                warehouse_seconds_per_hour=PREFETCH_WAREHOUSE_SECONDS)
+
+
+@st.cache_resource
+def get_entity_index():
+    return build_entity_index(get_snowflake_connection(), get_local_mirror())
+
+
+@st.cache_resource
+def get_local_file_index():
+    return LocalFileIndex(LOCAL_FILE_INDEX_PATH)
+
+
+@st.cache_resource
+def get_lexical_index():
+    return LexicalIndex(LEXICAL_INDEX_PATH)
+
+
+@st.cache_resource
+def get_reranker():
+    return build_scorer(get_lexical_index(), RERANK_MODEL)
+
+
+@st.cache_resource
+def get_qa_cache():
+    # Without a configured shared tier, answers are still reused within this process
+    return AnswerCache(get_shared_cache() or SharedCache(MemoryBackend(), name="qa"), ttl=CACHE_ANSWER_TTL_SECONDS)
+
+
+@st.cache_resource
+def get_answer_log():
+    return AnswerLog(ANSWER_LOG_DIR)
+
+
+@st.cache_resource
+def get_grounding_index():
+    return build_grounding_index()
+
+
+@st.cache_resource
+def get_semantic_cache():
+    return build_semantic_cache()
+
+
+@st.cache_resource
+def get_shared_cache():
+    return build_shared_cache()
+
+
+@st.cache_resource
+def get_admission_controller():
+    return build_admission_controller()
+
+
+@st.cache_resource
+def get_usage_ledger():
+    return build_usage_ledger(get_snowflake_connection())
+
+
+@st.cache_resource
+def get_warehouse_router():
+    return build_warehouse_router(get_snowflake_connection(), st.secrets)
+
+
+@st.cache_resource
+def get_metrics_server():
+    return metrics.serve(METRICS_PORT) if METRICS_PORT > 0 else None
+
+
+@st.cache_resource
+def get_session_activity() -> Dict[str, float]:
+    """Last script run time per session id, behind the ppp_sessions_active gauge"""
+    activity: Dict[str, float] = {}
+
+    def active() -> Dict[tuple, float]:
+        cutoff = time.time() - SESSION_ACTIVE_SECONDS
+        for session_id, seen in list(activity.items()):
+            if seen < cutoff:
+                activity.pop(session_id, None)
+        return {(): len(activity)}
+
+    metrics.collect("ppp_sessions_active", f"Sessions with a script run in the last {SESSION_ACTIVE_SECONDS}s",
+                    "gauge", active)
+    return activity
+
+
+@st.cache_resource
+def get_warmer():
+    """Warm-up of this process's connections and caches, repeated when the app has been idle"""
+    return start_warmer(get_pipeline()) if WARMUP_ENABLED else None
+
+
+@st.cache_resource
+def get_pipeline():
+    """The headless question pipeline over this app's shared connection and caches"""
+    return StructuredPipeline(
+        get_snowflake_connection(), CORTEX_BASE_URL, SEMANTIC_MODEL_FILE,
+        semantic_cache=get_semantic_cache(),
+        verified_store=get_verified_query_store(),
+        grounding=get_grounding_index(),
+        entity_index=get_entity_index(),
+        mirror=get_local_mirror(),
+        shared_cache=get_shared_cache(),
+    )
+
+
 
 
     
@@ -532,6 +716,12 @@ if "tutorial_step" not in st.session_state:
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
+if "result_cache" not in st.session_state:
+    st.session_state.result_cache = {}
+
+if "card_render_times" not in st.session_state:
+    st.session_state.card_render_times = {}
+
 # Check URL parameters for tutorial advancement
 query_params = st.query_params
 if "tutorial_step" in query_params:
@@ -543,6 +733,92 @@ if "tutorial_step" in query_params:
 if "tutorial_complete" in query_params:
     st.session_state.first_visit = False
 
+if "earlier_messages" not in st.session_state:
+    st.session_state.earlier_messages = []
+
+
+def set_result_cache(result_cache: Dict[str, Dict[str, Any]]):
+    """Replace the session's result cache, deleting spill files of results that were dropped"""
+    for sql, result in st.session_state.result_cache.items():
+        if sql not in result_cache:
+            release_result(result)
+    st.session_state.result_cache = result_cache
+
+
+def current_user() -> str:
+    """Signed-in user when the app has authentication, else the trusted proxy's forwarded user"""
+    try:
+        if st.user.is_logged_in:
+            return st.user.email
+    except Exception:
+        pass
+    if not TRUST_PROXY_HEADERS:
+        return "anonymous"
+    headers = st.context.headers
+    return headers.get("X-Forwarded-Email") or headers.get("X-Forwarded-User") or "anonymous"
+
+
+def session_owner() -> Optional[str]:
+    """Who stored sessions belong to; None for anonymous visitors, who cannot list or resume any"""
+    user = current_user()
+    return None if user == "anonymous" else user
+
+
+def start_session(session_id: Optional[str] = None):
+    """Switch to one of the user's stored sessions (or a fresh one) and load only its most recent messages
+
+    A session id belonging to someone else, e.g. from a shared ?session= link, starts a fresh session.
+    """
+    store = get_conversation_store()
+    owner = session_owner()
+    if session_id and owner and store.session_exists(session_id, owner):
+        st.session_state.messages = store.load_recent(session_id, owner, HISTORY_MEMORY_CAP)
+        SESSIONS_STARTED.inc("resumed")
+    else:
+        session_id = store.create_session(owner, st.session_state.get("chat_mode"))
+        st.session_state.messages = []
+        SESSIONS_STARTED.inc("new")
+    st.session_state.session_id = session_id
+    st.session_state.earlier_messages = []
+    set_result_cache({})
+    st.query_params["session"] = session_id
+
+
+def add_message(message: Dict[str, Any], reserved_id: Optional[int] = None):
+    """Append a message to the history, persist it (under reserved_id if given) and enforce the memory cap"""
+    store = get_conversation_store()
+    if reserved_id is None:
+        message["id"] = store.append(st.session_state.session_id, message)
+    else:
+        store.update(reserved_id, message)
+        message["id"] = reserved_id
+    st.session_state.messages.append(message)
+    if len(st.session_state.messages) > HISTORY_MEMORY_CAP:
+        st.session_state.messages = st.session_state.messages[-HISTORY_MEMORY_CAP:]
+        st.session_state.earlier_messages = []
+    # Only results for eagerly rendered messages stay cached
+    live_sql = {
+        item["statement"]
+        for msg in st.session_state.messages[-HISTORY_EAGER_MESSAGES:]
+        for item in msg["content"] if item["type"] == "sql"
+    }
+    set_result_cache({sql: result for sql, result in st.session_state.result_cache.items() if sql in live_sql})
+
+
+if "session_id" not in st.session_state:
+    start_session(query_params.get("session"))
+
+# Install the process-wide scheduler and usage ledger before this run makes any provider call
+get_admission_controller()
+get_usage_ledger()
+get_warehouse_router()
+get_metrics_server()
+get_session_activity()[st.session_state.session_id] = time.time()
+# Every script run counts as activity, which holds off the idle warm-up
+warmer = get_warmer()
+if warmer is not None:
+    warmer.touch()
+
 
 st.markdown("""
     <style>
@@ -587,6 +863,45 @@ st.markdown("""
 
 
 # Enhanced sidebar with modern styling
+def render_usage_dashboard():
+    """Tokens, Cortex messages, warehouse usage and estimated cost of this session or the user's last day
+
+    Only USAGE_ADMINS also get the last day of every user, by user.
+    """
+    ledger = get_usage_ledger()
+    if ledger is None:
+        st.caption("Usage accounting is off (USAGE_DB_PATH is empty).")
+        return
+    user = session_owner()
+    scopes = ["This session"]
+    if user:
+        scopes.append("My last 24 hours")
+        if user in USAGE_ADMINS:
+            scopes.append("Everyone, 24 hours")
+    scope = st.radio("Scope", scopes, horizontal=True, key="usage_scope", label_visibility="collapsed")
+    since = (datetime.now() - timedelta(days=1)).isoformat()
+    if scope == "This session":
+        events, by = ledger.events(session_id=st.session_state.session_id), "question"
+    elif scope == "My last 24 hours":
+        events, by = ledger.events(since=since, user=user), "question"
+    else:
+        events, by = ledger.events(since=since), "user"
+    if events.empty:
+        st.caption("Nothing recorded yet.")
+        return
+    total = summarize(events, None).iloc[0]
+    col1, col2 = st.columns(2)
+    col1.metric("OpenAI tokens", f"{total['openai_tokens']:,.0f}")
+    col2.metric("Cortex messages", f"{total['cortex_messages']:,.0f}")
+    col1.metric("Queries", f"{total['queries']:,.0f}", help=f"{total['bytes_scanned'] / 1e9:,.2f} GB scanned")
+    col2.metric("Est. cost", f"${total['cost_usd']:,.2f}",
+                help="Warehouse figures arrive from QUERY_HISTORY a few minutes after each query")
+    st.dataframe(summarize(events, by)[[by, "openai_tokens", "cortex_messages", "queries", "cost_usd"]],
+                 hide_index=True, use_container_width=True)
+    st.download_button("Export JSONL", UsageLedger.to_jsonl(events), key="export_usage", mime="application/jsonl",
+                       file_name=f"usage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+
+
 with st.sidebar:
     # initialize default only once
     if "chat_mode" not in st.session_state:
@@ -659,7 +974,7 @@ with st.sidebar:
     
     with col1:
         if st.button("🗑️ Clear Chat", use_container_width=True, key="clear_chat"):
-            st.session_state.messages = []
+            start_session()
             st.session_state.active_suggestion = None
             st.toast("Chat history cleared!", icon="🧹")
             st.rerun()
@@ -672,7 +987,7 @@ with st.sidebar:
                 "messages": []
             }
             
-            for msg in st.session_state.messages:
+            for msg in get_conversation_store().load_all(st.session_state.session_id):
                 if msg["role"] == "user":
                     chat_export["messages"].append({"role": "user", "text": msg["content"][0]["text"]})
                 else:
@@ -687,6 +1002,21 @@ with st.sidebar:
                 mime="application/json",
                 key="download_chat"
             )
+
+    with st.expander("💰 Usage", expanded=False):
+        render_usage_dashboard()
+
+    with st.expander("🕘 Previous Sessions", expanded=False):
+        owner = session_owner()
+        if owner is None:
+            st.caption("Sign in to keep your sessions across visits.")
+        for session in get_conversation_store().list_sessions(owner) if owner else []:
+            if session["session_id"] == st.session_state.session_id:
+                continue
+            label = f"{session['title']} ({session['message_count']} msgs)"
+            if st.button(label, key=f"resume_{session['session_id']}", use_container_width=True):
+                start_session(session["session_id"])
+                st.rerun()
     
     # Sample questions with improved styling
     st.markdown("### Sample Questions")
@@ -702,17 +1032,27 @@ with st.sidebar:
                 st.session_state.active_suggestion = question
                 st.rerun()
     else:
-        sample_questions2 = [
-            "What are the top 5 companies by deal count?",
-            "Show me asset distribution by region",
-            "Compare deal values year over year",
-            "Which sectors have the highest growth rate?"
-        ]
-        for idx, question in enumerate(sample_questions2):
+        for idx, question in enumerate(SAMPLE_QUESTIONS):
             if st.button(f"🔍 {question}", key=f"sample_question_{idx}", use_container_width=True):
                 st.session_state.active_suggestion = question
                 st.rerun()
     
+    if st.session_state.get("chat_mode", "Structured Data Search") == "Structured Data Search":
+        with st.expander("✅ Verified Queries", expanded=False):
+            verified_entries = get_verified_query_store().entries
+            if not verified_entries:
+                st.caption("Mark an answer correct to add it here.")
+            for entry in verified_entries:
+                entry_col, remove_col = st.columns([5, 1])
+                with entry_col:
+                    if st.button(entry["question"], key=f"verified_{entry['name']}", use_container_width=True):
+                        st.session_state.active_suggestion = entry["question"]
+                        st.rerun()
+                with remove_col:
+                    if st.button("✖", key=f"remove_verified_{entry['name']}", help="Remove this verified query"):
+                        get_verified_query_store().remove(entry["name"])
+                        st.rerun()
+    
     # Enhanced Help & Resources section
     with st.expander("ℹ️ Help & Resources", expanded=False):
         st.markdown("""
@@ -738,6 +1078,14 @@ with st.sidebar:
                  help="Control the speed of chart animations")
         st.toggle("Auto-expand SQL queries", value=False, key="auto_expand_sql",
                  help="Automatically show SQL queries for each response")
+        st.toggle("Prefetch suggested follow-ups", value=PREFETCH_SUGGESTIONS, key="prefetch_suggestions",
+                  help="Answer the top suggestions in the background so clicking one is instant")
+        if st.session_state.prefetch_suggestions:
+            prefetch_report = get_prefetcher().report()
+            st.caption(f"Prefetch hit rate {prefetch_report['hit_rate']:.0%} "
+                       f"({prefetch_report['hits']}/{prefetch_report['clicks']} clicks) · "
+                       f"wasted {prefetch_report['wasted_cortex_calls']} Cortex calls, "
+                       f"{prefetch_report['wasted_warehouse_seconds']:.1f} warehouse-s")
         theme = st.selectbox("UI Theme", ["Light", "Dark"], index=0, key="ui_theme",
                             help="Change the appearance of the interface")
         
@@ -899,6 +1247,16 @@ def render_chat_bubble(role: str, message: str, timestamp=None):
 #     </div>
 #     """
 
+def render_cache_badge(cache_hit: Dict[str, Any]):
+    """Show which earlier question a cached or verified answer came from and how confident the match is"""
+    if cache_hit.get("source") == "verified":
+        st.caption(f"✅ Verified answer for “{cache_hit['question']}” ({cache_hit['similarity']:.0%} match)")
+    elif cache_hit.get("source") == "shared_cache":
+        st.caption("⚡ Reused an identical recent request")
+    else:
+        st.caption(f"⚡ Reused the answer to “{cache_hit['question']}” "
+                   f"({cache_hit['similarity']:.0%} match)")
+
 def render_suggestion_button(label: str, key: str):
     """Render an improved suggestion button"""
     if st.button(label, key=key, help="Click to use this suggestion", 
@@ -907,67 +1265,51 @@ def render_suggestion_button(label: str, key: str):
         st.session_state.active_suggestion = label
         st.rerun()
 
-def suggest_chart_type(df, x_col, y_col):
-    """Intelligently suggest chart type based on data characteristics"""
-    # Check if x is categorical/date and y is numeric
-    x_is_numeric = pd.api.types.is_numeric_dtype(df[x_col])
-    x_is_datetime = pd.api.types.is_datetime64_dtype(df[x_col])
-    y_is_numeric = pd.api.types.is_numeric_dtype(df[y_col])
-    unique_x = df[x_col].nunique()
-    
-    if unique_x <= 8 and y_is_numeric:
-        return "Bar Chart 📊"  # Small number of categories
-    elif (x_is_datetime or x_is_numeric) and y_is_numeric:
-        return "Line Chart 📈"  # Time series or continuous x-axis
-    elif x_is_numeric and y_is_numeric:
-        return "Scatter Plot 📊"  # Two numeric variables
-    elif unique_x <= 6 and y_is_numeric:
-        return "Pie Chart 🥧"  # Very few categories
-    else:
-        return "Bar Chart 📊"  # Default
+PROVIDER_LABELS = {"cortex": "Cortex Analyst", "openai": "OpenAI", "azure_search": "Azure AI Search",
+                   "snowflake": "the warehouse"}
 
-def send_message(prompt: str) -> Dict[str, Any]:
-    request_body = {
-        "messages": [{"role": "user", "content": [{"type": "text", "text": get_better_prompt(prompt)}]}],
-        "semantic_model_file": f"@{DATABASE}.{SCHEMA}.{STAGE}/{FILE}",
-    }
-    
-    try:
-        print(st.session_state.CONN.rest.token)
-        with st.spinner("Talking to Cortex..."):
-            resp = requests.post(
-                url=f"https://{HOST}/api/v2/cortex/analyst/message",
-                json=request_body,
-                headers={
-                    "Authorization": f'Snowflake Token="{st.session_state.CONN.rest.token}"',
-                    "Content-Type": "application/json",
-                },
-                timeout=5000
-            )
-        
-        request_id = resp.headers.get("X-Snowflake-Request-Id")
-        
-        if resp.status_code < 400:
-            return {**resp.json(), "request_id": request_id}
+
+@contextmanager
+def session_caller(status: Any = None, question: Optional[str] = None):
+    """Queue and account provider calls as this session's; while one is queued, its position is shown in status"""
+    def show_position(provider: str, position: int):
+        if position:
+            status.info(f"Waiting for {PROVIDER_LABELS.get(provider, provider)}: "
+                        f"{position} request{'s' if position > 1 else ''} ahead of yours", icon="⏳")
         else:
-            error_message = f"API Error ({resp.status_code}): {resp.text}"
-            st.toast("Error communicating with Cortex", icon="🚨")
-            return {
-                "message": {"content": [{"type": "text", "text": error_message}]},
-                "request_id": request_id,
-            }
-    except requests.Timeout:
+            status.empty()
+
+    session_id = st.session_state.get("session_id", "anonymous")
+    with caller(session_id, on_wait=show_position if status is not None else None), \
+            attribute(session_id=session_id, user=current_user(), question=question):
+        yield
+
+
+def send_message(prompt: str, history: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    messages = build_analyst_messages(history or [], prompt)
+
+    # A clicked suggestion may already have been answered in the background
+    if st.session_state.get("prefetch_suggestions"):
+        prefetched = get_prefetcher().take(st.session_state.session_id, prompt, messages)
+        if prefetched:
+            for sql, result in prefetched["results"].items():
+                st.session_state.result_cache[sql] = build_query_result(result)
+            return {**prefetched["response"], "prefetched": True}
+
+    with session_caller(st.empty(), prompt), st.spinner("Talking to Cortex..."):
+        response = get_pipeline().answer(prompt, messages)
+    rewrite_error = (response.get("rewrite") or {}).get("error")
+    if rewrite_error:
+        st.warning(f"Prompt enhancement failed: {rewrite_error}. Using original prompt.", icon="⚠️")
+    if response.get("error") == "api":
+        st.toast("Error communicating with Cortex", icon="🚨")
+    elif response.get("error") == "timeout":
         st.toast("Request timed out! The server may be busy.", icon="⏱️")
-        return {
-            "message": {"content": [{"type": "text", "text": "I'm sorry, but the request timed out. Please try again in a moment."}]},
-            "request_id": "N/A",
-        }
-    except Exception as e:
+    elif response.get("error") == "busy":
+        st.toast("Too many requests are waiting for Cortex. Please try again shortly.", icon="⏱️")
+    elif response.get("error") == "connection":
         st.toast("Connection error occurred!", icon="🚨")
-        return {
-            "message": {"content": [{"type": "text", "text": f"Connection error: {str(e)}. Please check your network connection and try again."}]},
-            "request_id": "N/A",
-        }
+    return response
 
 def get_llm_summary(user_prompt: str, df: pd.DataFrame) -> str:
     if df.empty:
@@ -986,11 +1328,15 @@ def get_llm_summary(user_prompt: str, df: pd.DataFrame) -> str:
     )
 
     try:
-        client = openai.Client(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-                model="o3-mini",  # Or "gpt-4" / "gpt-4-0125-preview"
-                messages=[{"role": "user", "content": prompt}],
-            )
+        client = openai_client()
+        with session_caller(st.empty(), user_prompt):
+            with slot("openai"):
+                started = time.perf_counter()
+                response = client.chat.completions.create(
+                        model="o3-mini",  # Or "gpt-4" / "gpt-4-0125-preview"
+                        messages=[{"role": "user", "content": prompt}],
+                    )
+            record_openai("summary", response, time.perf_counter() - started)
         return response.choices[0].message.content
     except Exception as e:
         st.warning(f"Failed to summarize: {str(e)}", icon="⚠️")
@@ -998,51 +1344,81 @@ def get_llm_summary(user_prompt: str, df: pd.DataFrame) -> str:
 
 
 
-def get_better_prompt(prompt):
-    if os.getenv("OPENAI_API_KEY") is None:
-        return prompt
-    
-    try:
-        with open("pppcdmai.yaml", "r") as f:
-            yaml_content = f.read()
-    except FileNotFoundError:
-        st.warning("YAML file not found. Using original prompt.", icon="⚠️")
-        return prompt
-    
-
-
-    context = f"""
-You are a helpful assistant that rewrites user questions so they are better understood by Cortex Analyst, 
-which generates SQL based on a semantic model.
-
-Here is the semantic model (YAML format) defining the available tables, fields, and relationships:
-{yaml_content}
+def get_query_result(sql: str, query_id: Optional[str] = None, question: Optional[str] = None) -> Dict[str, Any]:
+    """Load a statement's result once per session and keep the frame, an Arrow copy and its chart profile
 
-Your job is to take the user's question and rephrase it into a clear, structured analytical request that:
-- Uses fully-qualified field names (e.g. `TABLE.COLUMN`) wherever possible
-- Hints at how tables should be joined using keys defined in the model
-- Requests aggregations like counts, averages, or groupings where relevant
-- Preserves all the original analytical intent
-
-Use clear language and help Cortex Analyst build the most accurate query.
-"""
-    new_prompt = f"{context}\nUser Question: {prompt}\nRephrased Question:"
-
-    try:
-        client = openai.Client(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model="o3-mini",  # Or "gpt-4" / "gpt-4-0125-preview"
-            messages=[{"role": "user", "content": new_prompt}],
-            
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        st.warning(f"Prompt enhancement failed: {str(e)}. Using original prompt.", icon="⚠️")
-        return prompt
+    A statement that already ran is re-read by its Snowflake query id instead of executed again.
+    """
+    cached = st.session_state.result_cache.get(sql)
+    if cached is None:
+        with session_caller(st.empty(), question):
+            cached = build_query_result(load_result(st.session_state.CONN, sql, query_id, get_local_mirror(),
+                                                       get_shared_cache()))
+        RESULT_ROWS.observe(cached["arrow"].num_rows, cached["source"])
+        RESULT_BYTES.observe(cached["memory_bytes"], cached["source"])
+        st.session_state.result_cache[sql] = cached
+    return cached
+
+
+def remember_query_id(message_id: int, sql: str, query_id: str):
+    """Store the id of a re-executed statement on its message, since the old result has expired"""
+    for message in st.session_state.messages:
+        if message.get("id") == message_id:
+            message.setdefault("query_ids", {})[sql] = query_id
+            get_conversation_store().update(message_id, message)
+            return
+
+
+def build_query_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Compacted frame plus the Arrow copy, chart profile and recommendation the result card renders from
+
+    Large results keep only a memory-mapped Arrow file; the frame is rebuilt from it when rendered.
+    """
+    df = compact_frame(result["df"], profile_result(result["df"]))
+    profile = profile_result(df)
+    cached = {
+        "df": df,
+        "source": result["source"],
+        "query_id": result["query_id"],
+        "route": result.get("route"),
+        "arrow": to_arrow(df),
+        "spill_path": None,
+        "stats": {},
+        "views": {},
+        "profile": profile,
+        "recommendation": recommend_chart(profile),
+        "memory_bytes": frame_bytes(df),
+    }
+    if cached["memory_bytes"] > RESULT_SPILL_BYTES:
+        directory = get_spill_dir()
+        cached["arrow"], cached["spill_path"] = spill_table(cached["arrow"], directory)
+        prune_spill_files(directory, RESULT_SPILL_MAX_BYTES, RESULT_SPILL_MAX_AGE_SECONDS, keep=cached["spill_path"])
+        cached["df"] = None
+    return cached
+
+
+def prefetch_suggestions(content: List[Dict[str, Any]]):
+    """Start answering the top follow-up suggestions of the reply that was just stored"""
+    suggestions = [s for item in content if item["type"] == "suggestions" for s in item["suggestions"]]
+    if not suggestions or not any(item["type"] == "sql" for item in content):
+        return
+    candidates = []
+    for suggestion in suggestions:
+        messages = build_analyst_messages(st.session_state.messages, suggestion)
+        # Standalone questions go through the rewrite and caches, which stay on the script thread
+        if len(messages) > 1:
+            candidates.append((suggestion, messages))
+    # The same answer path as a typed follow-up: entity hints and the shared cache included
+    user = current_user()
+    # Speculative work queues behind every session's interactive requests
+    run = as_caller(attributed(get_pipeline().follow_up, session_id=st.session_state.session_id, user=user),
+                    st.session_state.session_id, BACKGROUND)
+    get_prefetcher().schedule(st.session_state.session_id, candidates, run, user=user)
 
 
 def display_content(content: List[Dict[str, str]], request_id: Optional[str] = None, 
-                   message_index: Optional[int] = None, prompt: Optional[str] = None):
+                   message_index: Optional[int] = None, prompt: Optional[str] = None,
+                   query_ids: Optional[Dict[str, str]] = None):
     """Enhanced content display with improved visualizations and front-end integration"""
     message_index = message_index or len(st.session_state.messages)
     
@@ -1064,215 +1440,265 @@ def display_content(content: List[Dict[str, str]], request_id: Optional[str] = N
                     st.rerun()
             st.markdown('</div>', unsafe_allow_html=True)
         elif item["type"] == "sql":
-            sql = item["statement"]
-            with st.expander("💾 SQL Query", expanded=st.session_state.get("auto_expand_sql", False)):
-                st.code(sql, language="sql")
-                if st.button("📋 Copy SQL", key=f"copy_sql_{message_index}"):
-                    st.toast("SQL copied to clipboard!", icon="📋")
-            try:
-                with st.expander("📊 Results", expanded=True):
-                    with st.spinner("⏳ Running query and processing results..."):
-                        df = pd.read_sql(sql, st.session_state.CONN)
-                        if df.empty:
-                            st.info("Query returned no data.", icon="ℹ️")
-                            return
-                        df.to_csv("temp.csv", index=False)
-                        tabs = st.tabs(["📄 Data Table", "📈 Visualization", "📝 Summary", "⚙️ Export"])
+            render_result_card(item["statement"], message_index, prompt, (query_ids or {}).get(item["statement"]))
+
+
+def render_result_card(sql: str, message_index: int, prompt: Optional[str] = None, query_id: Optional[str] = None):
+    """Result card for one statement; widget changes inside it rerun only this card"""
+    started = time.perf_counter()
+    render_result_body(sql, message_index, prompt, query_id)
+    st.session_state.card_render_times[message_index] = time.perf_counter() - started
+
+
+if RESULT_CARD_FRAGMENT:
+    render_result_card = st.fragment(render_result_card)
+
+
+def render_result_body(sql: str, message_index: int, prompt: Optional[str] = None, query_id: Optional[str] = None):
+    """Render the SQL, results table, visualization, summary and export tabs"""
+    with st.expander("💾 SQL Query", expanded=st.session_state.get("auto_expand_sql", False)):
+        st.code(sql, language="sql")
+        if st.button("📋 Copy SQL", key=f"copy_sql_{message_index}"):
+            st.toast("SQL copied to clipboard!", icon="📋")
+        if prompt and st.button("✅ Mark answer correct", key=f"verify_sql_{message_index}",
+                                help="Save this question and SQL as a verified query"):
+            get_verified_query_store().add(prompt, sql)
+            st.toast("Saved as a verified query", icon="✅")
+    try:
+        with st.expander("📊 Results", expanded=True):
+            with st.spinner("⏳ Running query and processing results..."):
+                result = get_query_result(sql, query_id, prompt)
+                if query_id and result["query_id"] not in (None, query_id):
+                    remember_query_id(message_index, sql, result["query_id"])
+                # Spilled results stay in their mapped Arrow file; each tab reads only what it shows
+                table = result["arrow"]
+                if table.num_rows == 0:
+                    st.info("Query returned no data.", icon="ℹ️")
+                    return
+                tabs = st.tabs(["📄 Data Table", "📈 Visualization", "📝 Summary", "⚙️ Export"])
+                
+                with tabs[0]:
+                    # Data table with enhanced options
+                    col1, col2, _ = st.columns([1, 1, 3])
+                    with col1:
+                        st.metric("Rows", f"{table.num_rows:,}")
+                    with col2:  
+                        st.metric("Columns", f"{table.num_columns:,}")
+                    if result["source"] == "mirror":
+                        synced_at = get_local_mirror().synced_at()
+                        st.caption("⚡ Answered from the local mirror, synced "
+                                   f"{datetime.fromtimestamp(synced_at).strftime('%H:%M')}")
+                    elif result["source"] == "shared_cache":
+                        st.caption(f"⚡ Reused a result fetched in the last {SQL_CACHE_TTL_SECONDS / 60:.0f} minutes")
+                    if result["route"]:
+                        st.caption(f"Ran on {result['route']['warehouse']}", help=result["route"]["reason"])
+                    render_paged_table(table, key=f"table_{message_index}",
+                                       stats_cache=result["stats"], view_cache=result["views"])
                         
-                        with tabs[0]:
-                            # Data table with enhanced options
-                            col1, col2, col3 = st.columns([3, 1, 1])
-                            with col1:
-                                st.dataframe(df, use_container_width=True)
-                            with col2:
-                                st.metric("Rows", f"{len(df):,}")
-                            with col3:  
-                                st.metric("Columns", f"{len(df.columns):,}")
-                                
-                        with tabs[1]:
-                            if len(df.columns) >= 2:
-                                st.markdown("### Data Visualization")
-                                
-                                col1, col2, col3 = st.columns([1, 1, 1])
+                with tabs[1]:
+                    if table.num_columns >= 2:
+                        st.markdown("### Data Visualization")
+                        
+                        col1, col2, col3 = st.columns([1, 1, 1])
+                        
+                        profile = result["profile"]
+                        recommendation = result["recommendation"]
+                        
+                        with col1:
+                            chart_type = st.selectbox(
+                                "Chart Type", 
+                                CHART_TYPES,
+                                index=CHART_TYPES.index(recommendation["chart_type"]),
+                                key=f"chart_type_{message_index}"
+                            )
+                        
+                        with col2:
+                            x_options = recommendation["x_candidates"]
+                            x_col = st.selectbox("X-axis", x_options, index=x_options.index(recommendation["x"]),
+                                                 key=f"x_{message_index}")
+                        
+                        with col3:
+                            y_options = [col for col in recommendation["y_candidates"] if col != x_col]
+                            if y_options:
+                                y_col = st.selectbox("Y-axis", y_options, key=f"y_{message_index}")
+                            else:
+                                st.warning("No numeric columns available for Y-axis. Please select a different X-axis or check your data.")
+                                y_col = None
+                        
+                        if y_col and x_col:
+                            # Additional chart options
+                            show_advanced = st.checkbox("Show Advanced Options", key=f"advanced_{message_index}")
+                            
+                            color_by = "None"
+                            sort_by = "None"
+                            if show_advanced:
+                                col1, col2 = st.columns(2)
                                 
                                 with col1:
-                                    chart_type = st.selectbox(
-                                        "Chart Type", 
-                                        ["Bar Chart 📊", "Line Chart 📈", "Scatter Plot 📍", "Area Chart 🏔️", "Pie Chart 🥧"],
-                                        key=f"chart_type_{message_index}"
+                                    color_options = ["None"] + [col for col in table.column_names
+                                                                if col != x_col and col != y_col]
+                                    color_default = recommendation["color"] if recommendation["color"] in color_options else "None"
+                                    color_by = st.selectbox(
+                                        "Color by", 
+                                        color_options,
+                                        index=color_options.index(color_default),
+                                        key=f"color_{message_index}"
                                     )
                                 
                                 with col2:
-                                    x_options = [col for col in df.columns]
-                                    x_col = st.selectbox("X-axis", x_options, key=f"x_{message_index}")
-                                
-                                with col3:
-                                    y_options = [col for col in df.columns if col != x_col and pd.api.types.is_numeric_dtype(df[col])]
-                                    if y_options:
-                                        y_col = st.selectbox("Y-axis", y_options, key=f"y_{message_index}")
-                                    else:
-                                        st.warning("No numeric columns available for Y-axis. Please select a different X-axis or check your data.")
-                                        y_col = None
-                                
-                                if y_col and x_col:
-                                    # Additional chart options
-                                    show_advanced = st.checkbox("Show Advanced Options", key=f"advanced_{message_index}")
-                                    
-                                    color_by = "None"
-                                    sort_by = "None"
-                                    if show_advanced:
-                                        col1, col2 = st.columns(2)
-                                        
-                                        with col1:
-                                            color_by = st.selectbox(
-                                                "Color by", 
-                                                ["None"] + [col for col in df.columns if col != x_col and col != y_col],
-                                                key=f"color_{message_index}"
-                                            )
-                                        
-                                        with col2:
-                                            if chart_type != "Pie Chart 🥧":
-                                                sort_by = st.selectbox(
-                                                    "Sort by", 
-                                                    ["None", "X Ascending", "X Descending", "Y Ascending", "Y Descending"],
-                                                    key=f"sort_{message_index}"
-                                                )
-                                    
-                                    # Validate data before charting
-                                    if df[x_col].isnull().all() or df[y_col].isnull().all():
-                                        st.error("Selected columns contain only null values. Please choose different columns.")
-                                        return
-                                    
-                                    # Prepare data
-                                    chart_df = df.copy()
-                                    
-                                    # Sort if specified
-                                    try:
-                                        if sort_by != "None" and chart_type != "Pie Chart 🥧":
-                                            if sort_by == "X Ascending":
-                                                chart_df = chart_df.sort_values(by=x_col)
-                                            elif sort_by == "X Descending":
-                                                chart_df = chart_df.sort_values(by=x_col, ascending=False)
-                                            elif sort_by == "Y Ascending":
-                                                chart_df = chart_df.sort_values(by=y_col)
-                                            elif sort_by == "Y Descending":
-                                                chart_df = chart_df.sort_values(by=y_col, ascending=False)
-                                        
-                                        # Create the chart
-                                        chart = None
-                                        if chart_type == "Bar Chart 📊":
-                                            chart = alt.Chart(chart_df).mark_bar().encode(
-                                                x=alt.X(x_col, type="nominal" if not pd.api.types.is_numeric_dtype(df[x_col]) else "quantitative"),
-                                                y=alt.Y(y_col, type="quantitative"),
-                                                color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
-                                                tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
-                                            ).interactive()
-                                        
-                                        elif chart_type == "Line Chart 📈":
-                                            chart = alt.Chart(chart_df).mark_line().encode(
-                                                x=alt.X(x_col, type="temporal" if pd.api.types.is_datetime64_dtype(df[x_col]) else "quantitative"),
-                                                y=alt.Y(y_col, type="quantitative"),
-                                                color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
-                                                tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
-                                            ).interactive()
-                                        
-                                        elif chart_type == "Scatter Plot 📍":
-                                            chart = alt.Chart(chart_df).mark_circle(size=60).encode(
-                                                x=alt.X(x_col, type="quantitative"),
-                                                y=alt.Y(y_col, type="quantitative"),
-                                                color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
-                                                tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
-                                            ).interactive()
-                                        
-                                        elif chart_type == "Area Chart 🏔️":
-                                            chart = alt.Chart(chart_df).mark_area(opacity=0.7).encode(
-                                                x=alt.X(x_col, type="temporal" if pd.api.types.is_datetime64_dtype(df[x_col]) else "quantitative"),
-                                                y=alt.Y(y_col, type="quantitative"),
-                                                color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
-                                                tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
-                                            ).interactive()
-                                        
-                                        elif chart_type == "Pie Chart 🥧":
-                                            pie_data = df.groupby(x_col)[y_col].sum().reset_index()
-                                            chart = alt.Chart(pie_data).mark_arc().encode(
-                                                theta=alt.Theta(field=y_col, type="quantitative"),
-                                                color=alt.Color(field=x_col, type="nominal"),
-                                                tooltip=[x_col, y_col]
-                                            ).properties(
-                                                width=400,
-                                                height=400
-                                            )
-                                        
-                                        if chart:
-                                            st.altair_chart(chart, use_container_width=True)
-                                        
-                                    except Exception as chart_err:
-                                        st.error(f"Failed to generate chart: {str(chart_err)}")
-                                        st.markdown("""
-                                        ### Chart Troubleshooting:
-                                        - Ensure selected columns have valid data types
-                                        - Check for missing or null values
-                                        - Try a different chart type or column combination
-                                        """)
-                                else:
-                                    st.warning("Need at least 2 valid columns to create a visualization.")
-                        
-                        with tabs[2]:
-                            st.markdown("### Data Analysis Summary")
-                            with st.spinner("Generating summary..."):
-                                summary = get_llm_summary(prompt or "Analyze this data", df)
-                                st.markdown(summary)
-                        
-                        with tabs[3]:
-                            st.subheader("Export Options")
+                                    if chart_type != "Pie Chart 🥧":
+                                        sort_by = st.selectbox(
+                                            "Sort by", 
+                                            ["None", "X Ascending", "X Descending", "Y Ascending", "Y Descending"],
+                                            key=f"sort_{message_index}"
+                                        )
                             
-                            export_col1, export_col2 = st.columns(2)
+                            # Validate data before charting
+                            if profile[x_col]["all_null"] or profile[y_col]["all_null"]:
+                                st.error("Selected columns contain only null values. Please choose different columns.")
+                                return
                             
-                            with export_col1:
-                                # Create export buttons
-                                csv = df.to_csv(index=False)
-                                st.download_button(
-                                    label="Download CSV",
-                                    data=csv,
-                                    file_name=f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                    mime="text/csv",
-                                )
+                            # Results are compacted when loaded, so the frame charts as is; sorting returns a new frame.
+                            # Only the charted columns are read, which matters for spilled results
+                            chart_columns = [x_col, y_col] + ([color_by] if color_by != "None" else [])
+                            chart_df = prepare_chart_frame(result_frame(result, chart_columns),
+                                                           {col: profile[col] for col in chart_columns})
                             
-                            with export_col2:
-                                buffer = BytesIO()
-                                with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-                                    df.to_excel(writer, sheet_name="Data", index=False)
-                                excel_data = buffer.getvalue()
+                            # Sort if specified
+                            try:
+                                if sort_by != "None" and chart_type != "Pie Chart 🥧":
+                                    if sort_by == "X Ascending":
+                                        chart_df = chart_df.sort_values(by=x_col)
+                                    elif sort_by == "X Descending":
+                                        chart_df = chart_df.sort_values(by=x_col, ascending=False)
+                                    elif sort_by == "Y Ascending":
+                                        chart_df = chart_df.sort_values(by=y_col)
+                                    elif sort_by == "Y Descending":
+                                        chart_df = chart_df.sort_values(by=y_col, ascending=False)
                                 
-                                st.download_button(
-                                    label="Download Excel",
-                                    data=excel_data,
-                                    file_name=f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                    mime="application/vnd.ms-excel",
-                                )
-                            
-                            # Additional information - not inside an expander
-                            st.subheader("Additional Information")
-                            st.write("Need help with this data? Check the summary tab for insights.")
-                            
-                            # Troubleshooting help - not inside an expander
-                            st.subheader("Troubleshooting Tips")
-                            st.markdown("""
-                            - If charts aren't rendering correctly, try a different chart type
-                            - For large datasets, consider filtering or aggregating the data
-                            - Check column types if visualization options are limited
-                            """)
-            except Exception as e:
-                st.error(f"Error processing query results: {str(e)}")
-                st.code(str(e), language="text")
-                st.subheader("Troubleshooting Help")
-                st.markdown("""
-                ### Common Issues:
-                - Check that all table references are valid
-                - Verify column names and data types
-                - Ensure your warehouse has access to the requested data
-                - Check for syntax errors in the SQL query
-                """)
+                                # Create the chart
+                                chart = None
+                                if chart_type == "Bar Chart 📊":
+                                    chart = alt.Chart(chart_df).mark_bar().encode(
+                                        x=alt.X(x_col, type=altair_type(profile, x_col)),
+                                        y=alt.Y(y_col, type="quantitative"),
+                                        color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
+                                        tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
+                                    ).interactive()
+                                
+                                elif chart_type == "Line Chart 📈":
+                                    chart = alt.Chart(chart_df).mark_line().encode(
+                                        x=alt.X(x_col, type=altair_type(profile, x_col)),
+                                        y=alt.Y(y_col, type="quantitative"),
+                                        color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
+                                        tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
+                                    ).interactive()
+                                
+                                elif chart_type == "Scatter Plot 📍":
+                                    chart = alt.Chart(chart_df).mark_circle(size=60).encode(
+                                        x=alt.X(x_col, type=altair_type(profile, x_col)),
+                                        y=alt.Y(y_col, type="quantitative"),
+                                        color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
+                                        tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
+                                    ).interactive()
+                                
+                                elif chart_type == "Area Chart 🏔️":
+                                    chart = alt.Chart(chart_df).mark_area(opacity=0.7).encode(
+                                        x=alt.X(x_col, type=altair_type(profile, x_col)),
+                                        y=alt.Y(y_col, type="quantitative"),
+                                        color=color_by if color_by != "None" else alt.value(ACCENT_COLOR),
+                                        tooltip=[x_col, y_col] + ([color_by] if color_by != "None" else [])
+                                    ).interactive()
+                                
+                                elif chart_type == "Pie Chart 🥧":
+                                    pie_data = chart_df.groupby(x_col, observed=True)[y_col].sum().reset_index()
+                                    chart = alt.Chart(pie_data).mark_arc().encode(
+                                        theta=alt.Theta(field=y_col, type="quantitative"),
+                                        color=alt.Color(field=x_col, type="nominal"),
+                                        tooltip=[x_col, y_col]
+                                    ).properties(
+                                        width=400,
+                                        height=400
+                                    )
+                                
+                                if chart:
+                                    st.altair_chart(chart, use_container_width=True)
+                                
+                            except Exception as chart_err:
+                                st.error(f"Failed to generate chart: {str(chart_err)}")
+                                st.markdown("""
+                                ### Chart Troubleshooting:
+                                - Ensure selected columns have valid data types
+                                - Check for missing or null values
+                                - Try a different chart type or column combination
+                                """)
+                        else:
+                            st.warning("Need at least 2 valid columns to create a visualization.")
+                
+                with tabs[2]:
+                    st.markdown("### Data Analysis Summary")
+                    with st.spinner("Generating summary..."):
+                        summary_prompt = prompt or "Analyze this data"
+                        summaries = result.setdefault("summaries", {})
+                        summary = summaries.get(summary_prompt)
+                        if summary is None:
+                            summary = get_llm_summary(summary_prompt, result_frame(result))
+                            # Failures come back as the exception; only cache real summaries
+                            if isinstance(summary, str):
+                                summaries[summary_prompt] = summary
+                        st.markdown(summary)
+                
+                with tabs[3]:
+                    st.subheader("Export Options")
+                    
+                    export_col1, export_col2 = st.columns(2)
+                    
+                    with export_col1:
+                        # Files are only built when a button is clicked, not on every rerun
+                        st.download_button(
+                            label="Download CSV",
+                            data=lambda: result_frame(result).to_csv(index=False),
+                            file_name=f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                            mime="text/csv",
+                        )
+                    
+                    with export_col2:
+                        def excel_data() -> bytes:
+                            buffer = BytesIO()
+                            with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+                                result_frame(result).to_excel(writer, sheet_name="Data", index=False)
+                            return buffer.getvalue()
+                        
+                        st.download_button(
+                            label="Download Excel",
+                            data=excel_data,
+                            file_name=f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                            mime="application/vnd.ms-excel",
+                        )
+                    
+                    # Additional information - not inside an expander
+                    st.subheader("Additional Information")
+                    st.write("Need help with this data? Check the summary tab for insights.")
+                    
+                    # Troubleshooting help - not inside an expander
+                    st.subheader("Troubleshooting Tips")
+                    st.markdown("""
+                    - If charts aren't rendering correctly, try a different chart type
+                    - For large datasets, consider filtering or aggregating the data
+                    - Check column types if visualization options are limited
+                    """)
+    except Exception as e:
+        st.error(f"Error processing query results: {str(e)}")
+        st.code(str(e), language="text")
+        st.subheader("Troubleshooting Help")
+        st.markdown("""
+        ### Common Issues:
+        - Check that all table references are valid
+        - Verify column names and data types
+        - Ensure your warehouse has access to the requested data
+        - Check for syntax errors in the SQL query
+        """)
+
 
 def render_typing_indicator():
     return """
@@ -1326,14 +1752,17 @@ def show_multimodel_interface(user_prompt):
 
     # Vector store
     embeddings = OpenAIEmbeddings(model="text-embedding-3-small", openai_api_key=openai_api_key)
-    vector_store = AzureSearchStore(
-        azure_search_endpoint=azure_search_service,
-        azure_search_key=azure_search_api_key,
-        index_name=INDEX_NAME,
-        embedding_function=embeddings.embed_query,
-        content_field=CONTENT_FIELD,
-        vector_field=VECTOR_FIELD,
-    )
+    if FILE_INDEX_TARGET == "local":
+        vector_store = None
+    else:
+        vector_store = AzureSearchStore(
+            azure_search_endpoint=azure_search_service,
+            azure_search_key=azure_search_api_key,
+            index_name=INDEX_NAME,
+            embedding_function=embeddings.embed_query,
+            content_field=CONTENT_FIELD,
+            vector_field=VECTOR_FIELD,
+        )
 
     llms = {
         "ChatGPT": ChatOpenAI(model="o3-mini", openai_api_key=openai_api_key),
@@ -1351,73 +1780,92 @@ def show_multimodel_interface(user_prompt):
     # run_query = st.button("Run", type="primary")
 
     if  user_prompt.strip():
-        retriever = vector_store.as_retriever(search_type="similarity", k=4)
+        if RETRIEVAL_MODE == "hybrid":
+            if vector_store is None:
+                vector_search = local_vector_search(get_local_file_index(), embeddings.embed_query)
+            else:
+                vector_search = azure_vector_search(vector_store)
+            retriever = HybridRetriever(vector_search, get_lexical_index(), get_reranker(),
+                                        depth=RETRIEVAL_CANDIDATES, k=4).as_retriever()
+        elif vector_store is None:
+            retriever = get_local_file_index().as_retriever(embeddings.embed_query, k=4)
+        else:
+            retriever = admitted_retriever(vector_store.as_retriever(search_type="similarity", k=4))
         results_by_model = {}
+        # Retrieved once for every model; the chunks it returns are part of each answer's cache key
+        with session_caller(st.empty(), user_prompt):
+            documents = retriever.invoke(user_prompt)
+        display_sources = [
+            f"{doc.metadata.get('filename')} (chunk {doc.metadata.get('chunk_index')}, page {doc.metadata.get('source_page')})"
+            for doc in documents
+        ]
 
         for model_name, llm in llms.items():
             with st.spinner(f"{model_name} is thinking..."):
                 start = time.time()
-                qa_chain = RetrievalQA.from_chain_type(
-                    llm=llm,
-                    retriever=retriever,
-                    return_source_documents=True
-                )
-                result = qa_chain.invoke({"query": user_prompt})
+
+                def generate() -> Dict[str, Any]:
+                    qa_chain = RetrievalQA.from_chain_type(
+                        llm=llm,
+                        retriever=fixed_retriever(documents),
+                        return_source_documents=True
+                    )
+                    with session_caller(st.empty(), user_prompt):
+                        with slot("openai"), get_openai_callback() as tokens:
+                            result = qa_chain.invoke({"query": user_prompt})
+                        # Counts OpenAI chat models only; the retrieval's query embedding is not included
+                        record("openai", "retrieval_qa", model=model_name, prompt_tokens=tokens.prompt_tokens,
+                               completion_tokens=tokens.completion_tokens, elapsed_seconds=time.time() - start,
+                               cost_usd=tokens.total_cost or None)
+                    return {"answer": result["result"], "sources": display_sources,
+                            "seconds": round(time.time() - start, 2)}
+
+                cached, hit = get_qa_cache().get_or_answer(
+                    f"{model_name}:{getattr(llm, 'model_name', '')}", user_prompt, documents, generate)
                 end = time.time()
 
-                answer = result['result']
-                sources = result["source_documents"]
+                answer = cached["answer"]
                 duration = round(end - start, 2)
-                display_sources = [
-                    f"{doc.metadata.get('filename')} (chunk {doc.metadata.get('chunk_index')}, page {doc.metadata.get('source_page')})"
-                    for doc in sources
-                ]
 
                 # Fancy display with chat bubbles
                 st.markdown(f"#### 🤖 {model_name}")
                 render_chat_bubble("analyst", answer, timestamp=f"{duration}s")
+                if hit:
+                    st.caption("⚡ Reused the answer generated "
+                               f"{datetime.fromtimestamp(cached['created']).strftime('%d %b %H:%M')} "
+                               f"from the same sources (took {cached['seconds']}s)")
                 st.markdown("**📁 Please refer to the following sources for further information:**")
-                for src in display_sources:
+                for src in cached["sources"]:
                     st.markdown(f"→ {src}")
 
+                # A reused answer is logged with the time it originally took, flagged so latency figures skip it
                 results_by_model[model_name] = {
                     "answer": answer,
-                    "time": duration,
-                    "sources": display_sources
+                    "time": cached["seconds"] if hit else duration,
+                    "sources": cached["sources"],
+                    "cached": hit,
                 }
 
                 # Save to session history
-                st.session_state.messages.append({
+                add_message({
                     "role": "analyst",
                     "content": [{"type": "text", "text": answer}],
                     "timestamp": datetime.now().isoformat(),
                     "model": model_name
                 })
 
-        # Optional CSV logging
-        try:
-            csv_path = "multimodel_answers_log.csv"
-            if not os.path.exists(csv_path):
-                with open(csv_path, 'w', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(["Question"] + [item for model in llms for item in [f"{model} Answer", f"{model} Time", f"{model} Sources"]])
-            with open(csv_path, 'a', newline='') as f:
-                writer = csv.writer(f)
-                row = [user_prompt] + [
-                    val for model in llms for val in [
-                        results_by_model[model]['answer'],
-                        results_by_model[model]['time'],
-                        "; ".join(results_by_model[model]['sources'])
-                    ]
-                ]
-                writer.writerow(row)
-        except Exception as e:
-            st.warning(f"Failed to write to CSV: {e}")
+        # Queued for the background writer; one row per model
+        get_answer_log().log(user_prompt, results_by_model, session_id=st.session_state.session_id)
 
 
 def process_message(prompt: str):
     # Add user message to history and display
-    st.session_state.messages.append({"role": "user", "content": [{"type": "text", "text": prompt}]})
+    user_message = {"role": "user", "content": [{"type": "text", "text": prompt}]}
+    add_message(user_message)
+    # Reserve the reply's row now: other sessions' messages share the id sequence, so its widgets
+    # are keyed by the id it will really be stored under
+    reply_index = get_conversation_store().reserve(st.session_state.session_id)
+    reply_stored = False
     render_chat_bubble("user", prompt)
     
     # Show typing indicator
@@ -1427,7 +1875,7 @@ def process_message(prompt: str):
     
     try:
             st.session_state.typing = True
-            response = send_message(prompt=prompt)
+            response = send_message(prompt=prompt, history=st.session_state.messages[:-1])
             request_id = response.get("request_id")
             
             # Check if expected keys are present
@@ -1437,6 +1885,9 @@ def process_message(prompt: str):
                 st.error(f"Unexpected API response format. Response: {response}")
                 return  # Exit the function to prevent further processing
             
+            if response.get("cache_hit"):
+                render_cache_badge(response["cache_hit"])
+            
             # Process response content
             for item in content:
                 if item["type"] == "text":
@@ -1475,40 +1926,91 @@ def process_message(prompt: str):
                     
                     st.markdown('</div>', unsafe_allow_html=True)
                 elif item["type"] == "sql":
-                    display_content([item], request_id=request_id, prompt=prompt)
+                    display_content([item], request_id=request_id, message_index=reply_index, prompt=prompt)
             
             # Save response to history
-            st.session_state.messages.append({
+            add_message({
                 "role": "analyst", 
                 "content": content, 
                 "request_id": request_id,
+                "cache_hit": response.get("cache_hit"),
+                "rewrite": response.get("rewrite"),
+                # Lets later views re-read each result instead of running the SQL again
+                "query_ids": {
+                    item["statement"]: st.session_state.result_cache[item["statement"]]["query_id"]
+                    for item in content
+                    if item["type"] == "sql" and item["statement"] in st.session_state.result_cache
+                },
+                # Which warehouse each statement was routed to, and why
+                "routes": {
+                    item["statement"]: st.session_state.result_cache[item["statement"]]["route"]
+                    for item in content
+                    if item["type"] == "sql" and st.session_state.result_cache.get(item["statement"], {}).get("route")
+                },
                 "timestamp": datetime.now().isoformat()
-            })
+            }, reply_index)
+            reply_stored = True
+            if st.session_state.get("prefetch_suggestions"):
+                prefetch_suggestions(content)
         
     finally:
         # Ensure typing indicator is always removed, even if an error occurs
         typing_placeholder.empty()
         st.session_state.typing = False
+        if not reply_stored:
+            get_conversation_store().delete(reply_index)
         # Save response to history
 
+def render_collapsed_message(message: Dict[str, Any]):
+    """Lightweight rendering for older turns: text bubbles and SQL, without re-running queries"""
+    for item in message["content"]:
+        if item["type"] == "text":
+            render_chat_bubble(message["role"], item["text"])
+        elif item["type"] == "sql":
+            st.code(item["statement"], language="sql")
+
+
 # Container for chat history
 chat_container = st.container()
 
 # Show chat history with better spacing and styling
 with chat_container:
-    for message_index, message in enumerate(st.session_state.messages):
+    older_messages = st.session_state.messages[:-HISTORY_EAGER_MESSAGES]
+    recent_messages = st.session_state.messages[-HISTORY_EAGER_MESSAGES:]
+    oldest_loaded_id = st.session_state.messages[0]["id"] if st.session_state.messages else None
+    stored_count = get_conversation_store().count_before(st.session_state.session_id, oldest_loaded_id)
+    hidden_count = len(older_messages) + stored_count
+
+    if hidden_count and st.toggle(f"🕘 Show {hidden_count} earlier messages", key="show_earlier"):
+        if len(st.session_state.earlier_messages) < stored_count:
+            if st.button("⬆️ Load older messages", key="load_older"):
+                before_id = (st.session_state.earlier_messages[0]["id"]
+                             if st.session_state.earlier_messages else oldest_loaded_id)
+                st.session_state.earlier_messages = get_conversation_store().load_page(
+                    st.session_state.session_id, before_id, HISTORY_PAGE_SIZE
+                ) + st.session_state.earlier_messages
+        for message in st.session_state.earlier_messages + older_messages:
+            render_collapsed_message(message)
+
+    question = None
+    for message in recent_messages:
+        message_index = message["id"]
         if message["role"] == "user":
             # For user messages, we just need the text content
             for item in message["content"]:
                 if item["type"] == "text":
                     render_chat_bubble(message["role"], item["text"])
+                    question = item["text"]
         else:
+            if message.get("cache_hit"):
+                render_cache_badge(message["cache_hit"])
             # For analyst messages, process each content item
             for item in message["content"]:
                 if item["type"] == "text":
                     render_chat_bubble(message["role"], item["text"])
                 elif  item["type"] == "sql":
-                    display_content([item], request_id=message.get("request_id"), message_index=message_index)
+                    display_content([item], request_id=message.get("request_id"), message_index=message_index,
+                                    prompt=question, query_ids=message.get("query_ids"))
 
 # Initial onboarding
 
@@ -1554,3 +2056,6 @@ window.addEventListener('resize', handleResize);
 handleResize();
 </script>
 """, unsafe_allow_html=True)
+
+# Runs cut short by st.rerun() or st.stop() end before this line and are not observed
+SCRIPT_RUN_SECONDS.observe(time.perf_counter() - script_started)
@@ -0,0 +1,126 @@
+"""Structured-search steps that do not touch Streamlit, so they can also run off the script thread."""
+import time
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import requests
+
+import metrics
+import warehouse_routing
+from admission import slot
+from shared_cache import decode_frame, encode_frame
+from usage import record, record_cortex_message
+
+# Warehouse results shared between replicas go stale with the tables; keep them briefly
+SQL_CACHE_TTL_SECONDS = 900
+
+# One pooled session, so Cortex calls reuse open TLS connections instead of handshaking each time
+cortex_http = requests.Session()
+cortex_http.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=16))
+cortex_http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=16))
+
+CORTEX_SECONDS = metrics.histogram(
+    "ppp_cortex_request_seconds", "Cortex Analyst request latency by HTTP status, or timeout/connection", ["status"])
+
+
+def post_analyst_message(base_url: str, token: str, messages: List[Dict[str, Any]], semantic_model_file: str,
+                         timeout: float = 5000) -> requests.Response:
+    """Send one Cortex Analyst request"""
+    with slot("cortex"):
+        started = time.perf_counter()
+        try:
+            resp = cortex_http.post(
+                url=f"{base_url}/api/v2/cortex/analyst/message",
+                json={"messages": messages, "semantic_model_file": semantic_model_file},
+                headers={
+                    "Authorization": f'Snowflake Token="{token}"',
+                    "Content-Type": "application/json",
+                },
+                timeout=timeout,
+            )
+        except requests.RequestException as e:
+            CORTEX_SECONDS.observe(time.perf_counter() - started,
+                                   "timeout" if isinstance(e, requests.Timeout) else "connection")
+            raise
+    elapsed = time.perf_counter() - started
+    CORTEX_SECONDS.observe(elapsed, str(resp.status_code))
+    record_cortex_message(resp.headers.get("X-Snowflake-Request-Id"), elapsed, resp.status_code < 400)
+    return resp
+
+
+def warm_http(base_url: str, timeout: float = 10) -> int:
+    """Open a pooled connection to the Cortex host ahead of the first message; returns the HTTP status"""
+    return cortex_http.head(base_url, timeout=timeout).status_code
+
+
+def _frame(cursor: Any) -> pd.DataFrame:
+    return pd.DataFrame(cursor.fetchall(), columns=[col[0] for col in cursor.description])
+
+
+def run_sql(conn: Any, sql: str, mirror: Any = None, cache: Any = None,
+            cache_ttl: float = SQL_CACHE_TTL_SECONDS) -> Dict[str, Any]:
+    """Run a statement on the local mirror when it can answer it, else on Snowflake
+
+    Returns the frame, the seconds it kept the warehouse busy, where it ran, the Snowflake
+    query id (None for the mirror) and the warehouse routing decision (None when no router
+    is installed or the warehouse was not used). With a shared cache, a statement another
+    replica ran within the TTL is served from there, with the decision made when it ran.
+    """
+    if mirror is not None:
+        df = mirror.query(sql)
+        if df is not None:
+            return {"df": df, "warehouse_seconds": 0.0, "source": "mirror", "query_id": None, "route": None}
+    if cache is None:
+        return _run_on_warehouse(conn, sql)
+    return cache.get_or_compute(
+        "sql", [sql], lambda: _run_on_warehouse(conn, sql), cache_ttl,
+        encode=lambda result: encode_frame(result["df"], {"query_id": result["query_id"], "route": result["route"]}),
+        decode=_decode_result,
+    )[0]
+
+
+def _decode_result(data: bytes) -> Dict[str, Any]:
+    df, metadata = decode_frame(data)
+    return {"df": df, "warehouse_seconds": 0.0, "source": "shared_cache", "query_id": metadata.get("query_id"),
+            "route": metadata.get("route")}
+
+
+def _run_on_warehouse(conn: Any, sql: str) -> Dict[str, Any]:
+    route = warehouse_routing.choose(sql)
+    with slot("snowflake"), warehouse_routing.connection(conn, route) as connection:
+        started = time.perf_counter()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql)
+            df = _frame(cursor)
+            query_id = cursor.sfqid
+        finally:
+            cursor.close()
+    elapsed = time.perf_counter() - started
+    record("snowflake", "query", reference=query_id, rows=len(df), elapsed_seconds=elapsed)
+    return {"df": df, "warehouse_seconds": elapsed, "source": "snowflake", "query_id": query_id, "route": route}
+
+
+def fetch_result(conn: Any, query_id: str) -> pd.DataFrame:
+    """Re-read a finished statement's result, which Snowflake keeps for 24 hours, without running it again"""
+    with slot("snowflake"):
+        cursor = conn.cursor()
+        try:
+            cursor.get_results_from_sfqid(query_id)
+            df = _frame(cursor)
+        finally:
+            cursor.close()
+    record("snowflake", "result_scan", reference=query_id, rows=len(df))
+    return df
+
+
+def load_result(conn: Any, sql: str, query_id: Optional[str] = None, mirror: Any = None,
+                cache: Any = None) -> Dict[str, Any]:
+    """Result of a statement seen before: its stored Snowflake result if still there, else a fresh run"""
+    if query_id:
+        try:
+            return {"df": fetch_result(conn, query_id), "warehouse_seconds": 0.0, "source": "result_scan",
+                    "query_id": query_id, "route": None}
+        except Exception as e:
+            print(f"[RESULT SCAN] {query_id} unavailable, re-executing: {e}")
+    return run_sql(conn, sql, mirror, cache)
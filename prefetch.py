@@ -0,0 +1,157 @@
+"""Speculative prefetch of Cortex follow-up suggestions on a bounded background worker pool."""
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from semantic_cache import normalize_question
+
+# Unused prefetched answers are dropped after this long
+PREFETCH_TTL_SECONDS = 600
+# How long a click waits for a prefetch that is still running
+PREFETCH_WAIT_SECONDS = 120
+QUOTA_WINDOW_SECONDS = 3600
+
+
+def context_key(messages: List[Dict[str, Any]]) -> str:
+    """Identity of a Cortex request: the same question asked after the same conversation"""
+    return hashlib.sha1(json.dumps(messages, sort_keys=True).encode()).hexdigest()
+
+
+class SuggestionPrefetcher:
+    """Runs the top suggestions of each answer ahead of the click, within per-user and warehouse budgets
+
+    Prefetched answers belong to an owner (a session); the hourly quota is charged to a user, who may
+    have several sessions open. `run(messages)` must return {"response", "results", "cost": {"cortex_calls", "warehouse_seconds"}}
+    and must not use Streamlit.
+    """
+
+    def __init__(self, max_workers: int = 4, top_k: int = 2, user_limit: int = 20,
+                 warehouse_seconds_per_hour: float = 300.0):
+        self.top_k = top_k
+        self.user_limit = user_limit
+        self.warehouse_seconds_per_hour = warehouse_seconds_per_hour
+        self.max_pending = max_workers * 2
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        # Reentrant: done-callbacks run inline when a future has already finished
+        self._lock = threading.RLock()
+        # owner -> {context key: {"question", "future", "created"}}
+        self._entries: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # owner -> normalized suggestions offered with the latest answer
+        self._offered: Dict[str, set] = {}
+        # user -> prefetch start times within the quota window
+        self._user_starts: Dict[str, Deque[float]] = {}
+        self._warehouse_spend: Deque[Tuple[float, float]] = deque()
+        self.stats = {
+            "scheduled": 0, "skipped_quota": 0, "skipped_budget": 0, "skipped_busy": 0, "failed": 0,
+            "clicks": 0, "hits": 0, "wasted": 0, "wasted_cortex_calls": 0, "wasted_warehouse_seconds": 0.0,
+            "warehouse_seconds": 0.0,
+        }
+
+    def _pending(self) -> int:
+        return sum(not entry["future"].done() for owner in self._entries.values() for entry in owner.values())
+
+    def _warehouse_seconds_last_hour(self, now: float) -> float:
+        while self._warehouse_spend and now - self._warehouse_spend[0][0] > QUOTA_WINDOW_SECONDS:
+            self._warehouse_spend.popleft()
+        return sum(seconds for _, seconds in self._warehouse_spend)
+
+    def _discard(self, entry: Dict[str, Any]):
+        """Count an answer that was fetched but never used"""
+        future: Future = entry["future"]
+        if not future.cancel():
+            # Already running or finished: charge it once it is done
+            future.add_done_callback(self._charge_waste)
+
+    def _charge_waste(self, future: Future):
+        if future.exception() is not None:
+            return
+        cost = future.result()["cost"]
+        with self._lock:
+            self.stats["wasted"] += 1
+            self.stats["wasted_cortex_calls"] += cost["cortex_calls"]
+            self.stats["wasted_warehouse_seconds"] += cost["warehouse_seconds"]
+
+    def _record_cost(self, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            if not future.cancelled():
+                print(f"[PREFETCH] failed: {future.exception()}")
+                with self._lock:
+                    self.stats["failed"] += 1
+            return
+        seconds = future.result()["cost"]["warehouse_seconds"]
+        with self._lock:
+            self._warehouse_spend.append((time.time(), seconds))
+            self.stats["warehouse_seconds"] += seconds
+
+    def schedule(self, owner: str, candidates: List[Tuple[str, List[Dict[str, Any]]]],
+                 run: Callable[[List[Dict[str, Any]]], Dict[str, Any]], user: Optional[str] = None) -> int:
+        """Replace the owner's prefetches with the top-k of (suggestion, Cortex messages); returns how many started
+
+        The quota is charged to `user`, or to the owner when no user is given.
+        """
+        now = time.time()
+        started = 0
+        with self._lock:
+            for entry in self._entries.pop(owner, {}).values():
+                self._discard(entry)
+            self._offered[owner] = {normalize_question(question) for question, _ in candidates}
+            entries = self._entries.setdefault(owner, {})
+            user_starts = self._user_starts.setdefault(user or owner, deque())
+            while user_starts and now - user_starts[0] > QUOTA_WINDOW_SECONDS:
+                user_starts.popleft()
+
+            for question, messages in candidates[:self.top_k]:
+                if len(user_starts) >= self.user_limit:
+                    self.stats["skipped_quota"] += 1
+                    continue
+                if self._warehouse_seconds_last_hour(now) >= self.warehouse_seconds_per_hour:
+                    self.stats["skipped_budget"] += 1
+                    continue
+                if self._pending() >= self.max_pending:
+                    self.stats["skipped_busy"] += 1
+                    continue
+                future = self._pool.submit(run, messages)
+                future.add_done_callback(self._record_cost)
+                entries[context_key(messages)] = {"question": question, "future": future, "created": now}
+                user_starts.append(now)
+                self.stats["scheduled"] += 1
+                started += 1
+        return started
+
+    def take(self, owner: str, question: str, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The prefetched answer for this exact request, waiting for it if it is still running"""
+        with self._lock:
+            clicked = normalize_question(question) in self._offered.get(owner, set())
+            if clicked:
+                self.stats["clicks"] += 1
+            entries = self._entries.get(owner, {})
+            entry = entries.pop(context_key(messages), None)
+            # Any other prefetch for this owner answered a question that is no longer next
+            for other in entries.values():
+                self._discard(other)
+            self._entries.pop(owner, None)
+            self._offered.pop(owner, None)
+        if entry is None:
+            return None
+        if time.time() - entry["created"] > PREFETCH_TTL_SECONDS:
+            self._discard(entry)
+            return None
+        try:
+            result = entry["future"].result(timeout=PREFETCH_WAIT_SECONDS)
+        except Exception as e:
+            print(f"[PREFETCH] not used: {e}")
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return result
+
+    def report(self) -> Dict[str, Any]:
+        """Counters plus the hit rate (clicked suggestions served from a prefetch)"""
+        with self._lock:
+            report = dict(self.stats)
+        report["hit_rate"] = report["hits"] / report["clicks"] if report["clicks"] else 0.0
+        return report
@@ -0,0 +1,126 @@
+"""Score how well a question is already grounded in the semantic model, to decide whether it needs an LLM rewrite."""
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import yaml
+
+from semantic_cache import normalize_question
+
+# Score at or above which the question goes to Cortex as asked
+REWRITE_BYPASS_THRESHOLD = 0.8
+# Score at or above which the question is expanded with a local template instead of the LLM
+REWRITE_TEMPLATE_THRESHOLD = 0.5
+
+AGGREGATION = re.compile(
+    r"\b(count|counts|number of|how many|total|sum|average|avg|mean|median|max|maximum|min|minimum|"
+    r"top \d+|bottom \d+|highest|lowest|most|least|largest|smallest|percentage|percent|share|ratio|rate|"
+    r"growth|distribution|breakdown)\b"
+)
+TIME_RANGE = re.compile(
+    r"\b((19|20)\d{2}|last \d* ?(day|week|month|quarter|year)s?|this (week|month|quarter|year)|"
+    r"(year|quarter|month) over (year|quarter|month)|ytd|year to date|q[1-4]|since|between|before|after|"
+    r"january|february|march|april|may|june|july|august|september|october|november|december|"
+    r"daily|weekly|monthly|quarterly|yearly|annual|trend)\b"
+)
+GROUPING = re.compile(r"\b(by|per|for each|each|across|grouped|compare|comparison|versus|vs)\b")
+QUALIFIED_COLUMN = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*)\.([A-Za-z_][A-Za-z0-9_]*)\b")
+
+
+def _phrase(name: str) -> str:
+    return normalize_question(name.replace("_", " "))
+
+
+class GroundingIndex:
+    """Column names and synonyms of the semantic model, matched against questions"""
+
+    def __init__(self, model_path: str, canned_questions: Iterable[str] = ()):
+        with open(model_path, "r") as f:
+            model = yaml.safe_load(f)
+        self.canned = {normalize_question(question) for question in canned_questions}
+        # phrase -> qualified columns it names; multi-word phrases are much stronger evidence
+        self.phrases: Dict[str, set] = {}
+        self.columns = set()
+        for table in model.get("tables") or []:
+            for kind in ("dimensions", "time_dimensions", "facts", "metrics"):
+                for column in table.get(kind) or []:
+                    qualified = f"{table['name']}.{column['name']}"
+                    self.columns.add(qualified.upper())
+                    for name in [column["name"], *(column.get("synonyms") or [])]:
+                        # Both "sales amount" and the identifier itself, "sales_amount"
+                        for phrase in {_phrase(name), name.lower()}:
+                            self.phrases.setdefault(phrase, set()).add(qualified)
+        self._pattern = re.compile(
+            r"\b(" + "|".join(re.escape(p) for p in sorted(self.phrases, key=len, reverse=True) if p) + r")s?\b"
+        )
+
+    def score(self, question: str) -> Dict[str, Any]:
+        """Grounding score in [0, 1] with the evidence behind it"""
+        normalized = normalize_question(question)
+        if normalized in self.canned:
+            return {"score": 1.0, "canned": True, "columns": [], "aggregation": None, "time_range": None}
+
+        columns: List[str] = [
+            f"{table}.{column}".upper() for table, column in QUALIFIED_COLUMN.findall(question)
+            if f"{table}.{column}".upper() in self.columns
+        ]
+        evidence = 2.0 * len(columns)
+        for match in self._pattern.finditer(normalized):
+            phrase = match.group(1)
+            evidence += 1.0 if " " in phrase or "_" in phrase else 0.5
+            columns.extend(sorted(self.phrases[phrase]))
+        aggregation = AGGREGATION.search(normalized)
+        time_range = TIME_RANGE.search(normalized)
+        grouping = GROUPING.search(normalized)
+        score = (
+            0.5 * min(evidence, 2.0) / 2.0
+            + 0.2 * bool(aggregation)
+            + 0.15 * bool(time_range)
+            + 0.15 * bool(grouping)
+        )
+        return {
+            "score": round(score, 3),
+            "canned": False,
+            "columns": list(dict.fromkeys(columns)),
+            "aggregation": aggregation.group(0) if aggregation else None,
+            "time_range": time_range.group(0) if time_range else None,
+        }
+
+
+def rewrite_mode(grounding: Dict[str, Any]) -> str:
+    """'skip', 'template' or 'llm'"""
+    if grounding["score"] >= REWRITE_BYPASS_THRESHOLD:
+        return "skip"
+    if grounding["score"] >= REWRITE_TEMPLATE_THRESHOLD and grounding["columns"]:
+        return "template"
+    return "llm"
+
+
+def template_expansion(question: str, grounding: Dict[str, Any], max_columns: int = 6) -> str:
+    """Cheap local rewrite: the question plus the fully qualified columns it refers to"""
+    hints = [f"Use {', '.join(grounding['columns'][:max_columns])}."]
+    if grounding["aggregation"]:
+        hints.append(f"Aggregate as asked ({grounding['aggregation']}).")
+    if grounding["time_range"]:
+        hints.append(f"Apply the time range or grain \"{grounding['time_range']}\".")
+    return f"{question}\n\n{' '.join(hints)}"
+
+
+def summarize_modes(messages: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per rewrite mode: answers, share that produced SQL and share that failed"""
+    summary: Dict[str, Dict[str, Any]] = {}
+    for message in messages:
+        rewrite: Optional[Dict[str, Any]] = message.get("rewrite")
+        if message.get("role") != "analyst" or not rewrite:
+            continue
+        entry = summary.setdefault(rewrite["mode"], {"answers": 0, "with_sql": 0, "failed": 0, "score_sum": 0.0})
+        entry["answers"] += 1
+        entry["score_sum"] += rewrite["score"]
+        entry["with_sql"] += any(item["type"] == "sql" for item in message["content"])
+        entry["failed"] += message.get("request_id") in (None, "N/A") or any(
+            item["type"] == "text" and item["text"].startswith("API Error") for item in message["content"]
+        )
+    for entry in summary.values():
+        entry["sql_rate"] = entry["with_sql"] / entry["answers"]
+        entry["failure_rate"] = entry["failed"] / entry["answers"]
+        entry["mean_score"] = entry.pop("score_sum") / entry["answers"]
+    return summary
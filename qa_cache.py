@@ -0,0 +1,55 @@
+"""Unstructured Chat answers cached per model, question and retrieved chunks.
+
+An answer is reused when the same model is asked the same question (after
+normalize_question) and retrieval returns the same chunks, in the same order and with
+the same text. The chunk text is part of the key, so re-ingesting a chunk with new
+content invalidates every answer built on it; the orphaned entries age out with the TTL.
+Entries live in a SharedCache, so replicas share them when CACHE_BACKEND is set and
+concurrent askers of one question wait for a single generation.
+"""
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from file_index import content_hash
+from semantic_cache import normalize_question
+from shared_cache import SharedCache
+
+QA_CACHE_TTL_SECONDS = 86400
+
+
+def chunk_fingerprint(documents: List[Any]) -> List[List[Any]]:
+    """File, position and text hash of each retrieved LangChain Document, in retrieval order"""
+    return [
+        [doc.metadata.get("filename"), doc.metadata.get("chunk_index"), content_hash(doc.page_content)]
+        for doc in documents
+    ]
+
+
+def fixed_retriever(documents: List[Any]):
+    """LangChain retriever that returns documents already retrieved, so each model reuses one search"""
+    from langchain_core.retrievers import BaseRetriever
+
+    class FixedRetriever(BaseRetriever):
+        def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Any]:
+            return list(documents)
+
+    return FixedRetriever()
+
+
+class AnswerCache:
+    """{"answer", "sources", "seconds", "created"} per (model, question, retrieved chunks)"""
+
+    def __init__(self, cache: SharedCache, ttl: float = QA_CACHE_TTL_SECONDS):
+        self.cache = cache
+        self.ttl = ttl
+
+    def get_or_answer(self, model: str, question: str, documents: List[Any],
+                      answer: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """(entry, hit): the cached entry, or answer() (answer, sources, seconds) stored for next time"""
+        def compute() -> Dict[str, Any]:
+            return {**answer(), "created": time.time()}
+
+        return self.cache.get_or_compute(
+            "qa", [model, normalize_question(question), chunk_fingerprint(documents)], compute, self.ttl,
+            cacheable=lambda entry: bool(entry.get("answer")),
+        )
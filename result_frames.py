@@ -0,0 +1,105 @@
+"""Compact, optionally disk-backed representation of query results kept in a session."""
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+# A text column becomes categorical when its distinct values are at most this share of the rows
+CATEGORY_MAX_SHARE = 0.5
+# Whole-number floats are only turned into integers while they stay exact
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+
+def _downcast(series: pd.Series) -> pd.Series:
+    """Smallest integer type for integral columns; floats are left as float64 (no precision lost by downcasting)"""
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+    if (pd.api.types.is_float_dtype(series) and len(series) and series.notna().all()
+            and (series % 1 == 0).all() and series.abs().max() < MAX_EXACT_FLOAT_INT):
+        # NUMBER(38,0) arrives as Decimal and parses to float64
+        return pd.to_numeric(series.astype("int64"), downcast="integer")
+    return series
+
+
+def compact_frame(df: pd.DataFrame, profile: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    """Parse dates and Decimals, downcast integers and store repetitive text as categoricals"""
+    converted = {}
+    for col, info in profile.items():
+        series = df[col]
+        if info["all_null"] or pd.api.types.is_bool_dtype(series):
+            continue
+        if info["parse_datetime"]:
+            converted[col] = pd.to_datetime(series, errors="coerce", format="mixed")
+        elif info["kind"] == "numeric":
+            converted[col] = _downcast(pd.to_numeric(series, errors="coerce") if info.get("parse_numeric") else series)
+        elif (series.dtype == object or isinstance(series.dtype, pd.StringDtype)) \
+                and info["cardinality"] <= CATEGORY_MAX_SHARE * len(df):
+            converted[col] = series.astype("category")
+    return df.assign(**converted) if converted else df
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True, index=False).sum())
+
+
+def spill_table(table: pa.Table, directory: str) -> Tuple[pa.Table, str]:
+    """Write the table to an Arrow IPC file and return a zero-copy, memory-mapped table over it"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{uuid.uuid4().hex}.arrow")
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all(), path
+
+
+def prune_spill_files(directory: str, max_bytes: int, max_age_seconds: float, keep: Optional[str] = None) -> int:
+    """Delete spill files older than max_age_seconds, then the oldest until the directory fits in max_bytes
+
+    Sessions still holding a deleted file keep reading its mapped pages; returns the files deleted.
+    """
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".arrow") and entry.path != keep:
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files) + (os.path.getsize(keep) if keep else 0)
+    cutoff = time.time() - max_age_seconds
+    deleted = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except OSError:
+            continue  # already gone, or still mapped on Windows
+        total -= size
+    return deleted
+
+
+def result_frame(result: Dict[str, Any], columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """The result, or only some of its columns, as a DataFrame
+
+    A spilled result is read from its mapped file for just those columns; callers that do
+    not need every row page or slice result["arrow"] instead.
+    """
+    if result["df"] is not None:
+        return result["df"] if columns is None else result["df"][columns]
+    table = result["arrow"] if columns is None else result["arrow"].select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+def release_result(result: Dict[str, Any]):
+    """Delete a dropped result's spill file (mapped pages stay valid until the table is collected)"""
+    path: Optional[str] = result.get("spill_path")
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,240 @@
+"""Semantic answer cache: reuse Cortex Analyst SQL for previously answered, equivalent questions."""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import yaml
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    model_hash TEXT NOT NULL,
+    question   TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    embedding  BLOB NOT NULL,
+    content    TEXT NOT NULL,
+    request_id TEXT,
+    created_at TEXT NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_semantic_cache_model ON semantic_cache(model_hash);
+"""
+
+EMBEDDING_MEMO_SIZE = 256
+
+# Words that flip the meaning of otherwise similar questions ("top 5" vs "bottom 5",
+# "year over year" vs "month over month"); a cached answer must agree on all of them.
+CRITICAL_TERMS = {
+    "top": "desc", "highest": "desc", "most": "desc", "largest": "desc", "biggest": "desc", "fastest": "desc",
+    "bottom": "asc", "lowest": "asc", "least": "asc", "smallest": "asc", "fewest": "asc", "slowest": "asc",
+    "day": "day", "daily": "day", "week": "week", "weekly": "week", "month": "month", "monthly": "month",
+    "quarter": "quarter", "quarterly": "quarter", "year": "year", "yearly": "year", "annual": "year",
+    "open": "open", "closed": "closed", "active": "active", "completed": "completed", "won": "won", "lost": "lost",
+    "region": "region", "regions": "region", "sector": "sector", "sectors": "sector",
+}
+NUMBER_WORDS = {"one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+                "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10"}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def critical_terms(normalized: str) -> frozenset:
+    """Numbers, ranking direction, time grain, status and grouping words in a normalized question"""
+    terms = set()
+    for token in normalized.split():
+        token = NUMBER_WORDS.get(token, token)
+        if token.isdigit():
+            terms.add(token)
+        elif token in CRITICAL_TERMS:
+            terms.add(CRITICAL_TERMS[token])
+    return frozenset(terms)
+
+
+# Capitalised words that start clauses or name the question's shape rather than a value
+QUESTION_WORDS = {
+    "i", "a", "an", "the", "and", "or", "of", "in", "for", "by", "per", "vs", "versus", "what", "which", "who",
+    "how", "when", "where", "why", "show", "list", "give", "compare", "count", "total", "average", "sum",
+}
+_QUOTED = re.compile(r"\"([^\"]+)\"|(?<!\w)'([^']+)'(?!\w)")
+
+
+def singular(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+class LiteralExtractor:
+    """Entity literals of a question: quoted values, capitalised names and source-system names
+
+    Two questions that differ in these ask about different customers, vendors or systems,
+    however similar the rest is, so a reused answer must agree on all of them. Capitalised
+    words after the first count unless they name a column of the semantic model; source
+    systems (BYNDER in PPP_CDM_BYNDER_MEDIA) count however they are written.
+    """
+
+    def __init__(self, columns: Iterable[str] = (), sources: Iterable[str] = ()):
+        self.columns = frozenset(columns)
+        self.sources = frozenset(sources)
+
+    @classmethod
+    def from_model(cls, model_path: str) -> "LiteralExtractor":
+        """Column names and synonyms, and the source systems named in the model's table names"""
+        with open(model_path, "r") as f:
+            model = yaml.safe_load(f)
+        tables = model.get("tables") or []
+        # "sales amount" and the identifier itself, "sales_amount"
+        columns = {
+            singular(form) for table in tables for kind in ("dimensions", "time_dimensions", "facts", "metrics")
+            for column in table.get(kind) or [] for name in [column["name"], *(column.get("synonyms") or [])]
+            for form in (normalize_question(name.replace("_", " ")), name.lower())
+        }
+        names = [table["name"].lower().split("_") for table in tables]
+        # Drop the prefix every table shares (PPP_CDM_); what precedes the entity is the system it comes from
+        prefix = 0
+        while len(names) > 1 and all(len(name) > prefix + 1 and name[prefix] == names[0][prefix] for name in names):
+            prefix += 1
+        entities = {singular(name[-1]) for name in names}
+        sources = {name[prefix] for name in names if len(name) - prefix > 1} - entities
+        return cls(columns, sources)
+
+    def __call__(self, question: str) -> frozenset:
+        literals = {normalize_question(double or single) for double, single in _QUOTED.findall(question)}
+        for position, word in enumerate(re.findall(r"\w+", question)):
+            token = word.lower()
+            if token in self.sources:
+                literals.add(token)
+            elif (position and word[0].isupper() and not token.isdigit() and token not in QUESTION_WORDS
+                  and token not in CRITICAL_TERMS and token not in NUMBER_WORDS
+                  and singular(token) not in self.columns):
+                literals.add(token)
+        return frozenset(literals)
+
+
+def semantic_model_hash(path: str) -> str:
+    """Hash of the semantic model file; cached SQL is only valid for the model it was generated from"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+class SemanticCache:
+    """Nearest-neighbour lookup of successful (question, Cortex response) pairs by embedding similarity"""
+
+    def __init__(self, path: str, embed: Callable[[str], List[float]], threshold: float = 0.90,
+                 literals: Optional[LiteralExtractor] = None):
+        self.embed = embed
+        self.threshold = threshold
+        self.literals = literals or LiteralExtractor()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # model_hash -> {"ids": [...], "normalized": [...], "matrix": unit-normalized embeddings}
+        self._indexes: Dict[str, Dict[str, Any]] = {}
+        self._embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def _embedding(self, normalized: str) -> np.ndarray:
+        with self._lock:
+            if normalized in self._embeddings:
+                self._embeddings.move_to_end(normalized)
+                return self._embeddings[normalized]
+        vector = np.asarray(self.embed(normalized), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._embeddings[normalized] = vector
+            if len(self._embeddings) > EMBEDDING_MEMO_SIZE:
+                self._embeddings.popitem(last=False)
+        return vector
+
+    def _index(self, model_hash: str) -> Dict[str, Any]:
+        """Load (once) the in-memory index for one semantic model; caller holds the lock"""
+        index = self._indexes.get(model_hash)
+        if index is None:
+            rows = self._conn.execute(
+                "SELECT id, normalized, embedding, question FROM semantic_cache WHERE model_hash = ? ORDER BY id",
+                (model_hash,),
+            ).fetchall()
+            index = {
+                "ids": [row[0] for row in rows],
+                "normalized": [row[1] for row in rows],
+                "terms": [critical_terms(row[1]) for row in rows],
+                "literals": [self.literals(row[3]) for row in rows],
+                "matrix": (np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+                           if rows else None),
+            }
+            self._indexes[model_hash] = index
+        return index
+
+    def lookup(self, question: str, model_hash: str) -> Optional[Dict[str, Any]]:
+        """Best cached answer at or above the similarity threshold, or None"""
+        normalized = normalize_question(question)
+        with self._lock:
+            index = self._index(model_hash)
+            if index["matrix"] is None:
+                return None
+            if normalized in index["normalized"]:
+                entry_id, similarity = index["ids"][index["normalized"].index(normalized)], 1.0
+            else:
+                entry_id = None
+        if entry_id is None:
+            vector = self._embedding(normalized)
+            terms = critical_terms(normalized)
+            literals = self.literals(question)
+            with self._lock:
+                index = self._index(model_hash)
+                scores = index["matrix"] @ vector
+                # Entries that disagree on numbers, direction, grain, status or the entities named can never match
+                for position, (entry_terms, entry_literals) in enumerate(zip(index["terms"], index["literals"])):
+                    if entry_terms != terms or entry_literals != literals:
+                        scores[position] = -1.0
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+                entry_id = index["ids"][best]
+            if similarity < self.threshold:
+                return None
+
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE semantic_cache SET hits = hits + 1 WHERE id = ?", (entry_id,))
+            row = self._conn.execute(
+                "SELECT question, content, request_id FROM semantic_cache WHERE id = ?", (entry_id,)
+            ).fetchone()
+        return {
+            "id": entry_id,
+            "question": row[0],
+            "content": json.loads(row[1]),
+            "request_id": row[2],
+            "similarity": similarity,
+        }
+
+    def add(self, question: str, model_hash: str, content: List[Dict[str, Any]], request_id: Optional[str] = None):
+        """Remember a successful answer (only responses that contain SQL are worth caching)"""
+        if not any(item["type"] == "sql" for item in content):
+            return
+        normalized = normalize_question(question)
+        vector = self._embedding(normalized)
+        with self._lock, self._conn:
+            index = self._index(model_hash)
+            if normalized in index["normalized"]:
+                return
+            cursor = self._conn.execute(
+                "INSERT INTO semantic_cache (model_hash, question, normalized, embedding, content, request_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (model_hash, question, normalized, vector.tobytes(), json.dumps(content), request_id,
+                 datetime.now().isoformat()),
+            )
+            index["ids"].append(cursor.lastrowid)
+            index["normalized"].append(normalized)
+            index["terms"].append(critical_terms(normalized))
+            index["literals"].append(self.literals(question))
+            index["matrix"] = vector[None, :] if index["matrix"] is None else np.vstack([index["matrix"], vector])
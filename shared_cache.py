@@ -0,0 +1,451 @@
+"""Cache tier shared between app replicas: pluggable byte stores behind one typed interface.
+
+Backends store opaque bytes with a TTL: an in-process LRU, a directory (local or on a
+shared volume) and a Redis-protocol key-value server. SharedCache layers versioned
+keys, compact encodings (zlib JSON, zstd Arrow IPC) and stampede protection on top,
+so a value missing on every replica is computed by one of them while the rest wait.
+"""
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import Empty, Full, LifoQueue
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+import pandas as pd
+import pyarrow as pa
+
+import metrics
+
+# Bump when an encoding or a cached value's shape changes; old entries then simply miss
+CACHE_VERSION = 1
+LOCK_TTL_SECONDS = 120
+LOCK_POLL_SECONDS = 0.05
+PRUNE_INTERVAL_SECONDS = 60
+
+
+class MemoryBackend:
+    """Least-recently-used bytes in this process, bounded by total size"""
+
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        """Caller holds the lock"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._bytes -= len(self._entries.pop(key)[1])
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._live(key)
+
+    def _store(self, key: str, value: bytes, ttl: float) -> bool:
+        """Caller holds the lock; evicts least recently used entries to stay within max_bytes"""
+        if len(value) > self.max_bytes:
+            return False
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[1])
+        self._entries[key] = (time.time() + ttl, value)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            self._bytes -= len(self._entries.popitem(last=False)[1][1])
+        return True
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """Set only if absent; True when this call set it"""
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            return self._store(key, value, ttl)
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= len(entry[1])
+
+
+class DiskBackend:
+    """One file per key (expiry header + payload); shared by replicas when the directory is
+
+    Writers prune the directory every PRUNE_INTERVAL_SECONDS, or sooner once a tenth of
+    max_bytes was written since: expired files go first, then the oldest until the
+    directory fits in max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._pruned_at = 0.0
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.prune()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        (expires,) = struct.unpack("<d", data[:8])
+        if expires < time.time():
+            self.delete(key)
+            return None
+        return data[8:]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack("<d", time.time() + ttl) + value)
+        os.replace(tmp_path, path)
+        self._wrote(len(value))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        path = self._path(key)
+        if self.get(key) is not None:
+            return False
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "wb") as f:
+            f.write(struct.pack("<d", time.time() + ttl) + value)
+        self._wrote(len(value))
+        return True
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _wrote(self, size: int):
+        with self._lock:
+            self._written += size
+            due = (time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS
+                   or (self.max_bytes is not None and self._written >= self.max_bytes // 10))
+        if due:
+            self.prune()
+
+    def prune(self) -> Dict[str, int]:
+        """Remove expired files and abandoned temp files, then the oldest files beyond max_bytes"""
+        if not self._prune_lock.acquire(blocking=False):
+            return {}  # another thread of this process is pruning
+        try:
+            with self._lock:
+                self._written, self._pruned_at = 0, time.monotonic()
+            now = time.time()
+            removed = {"expired": 0, "evicted": 0}
+            kept = []
+            for entry in os.scandir(self.directory):
+                try:
+                    stat = entry.stat()
+                    if entry.name.endswith(".tmp"):
+                        if stat.st_mtime < now - LOCK_TTL_SECONDS:
+                            os.remove(entry.path)
+                        continue
+                    with open(entry.path, "rb") as f:
+                        header = f.read(8)
+                    if len(header) < 8 or struct.unpack("<d", header)[0] < now:
+                        os.remove(entry.path)
+                        removed["expired"] += 1
+                        continue
+                except OSError:
+                    continue  # removed by another replica meanwhile
+                kept.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in kept)
+            if self.max_bytes is not None:
+                for _, size, path in sorted(kept):
+                    if total <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                        removed["evicted"] += 1
+                    except OSError:
+                        pass
+                    total -= size
+            return removed
+        finally:
+            self._prune_lock.release()
+
+
+class RedisBackend:
+    """Minimal Redis-protocol client (GET, SET PX [NX], DEL) over a small connection pool
+
+        redis://[:password@]host:port/db
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0, pool_size: int = 8):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or "127.0.0.1", parsed.port or 6379)
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._pool: LifoQueue = LifoQueue(maxsize=pool_size)
+
+    def _connect(self) -> Tuple[socket.socket, Any]:
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = sock.makefile("rb")
+        if self.password:
+            self._send(sock, reader, "AUTH", self.password)
+        if self.db:
+            self._send(sock, reader, "SELECT", str(self.db))
+        return sock, reader
+
+    @staticmethod
+    def _send(sock: socket.socket, reader: Any, *parts: Any) -> Any:
+        encoded = [part if isinstance(part, bytes) else str(part).encode("utf-8") for part in parts]
+        sock.sendall(b"*%d\r\n" % len(encoded) + b"".join(b"$%d\r\n%s\r\n" % (len(p), p) for p in encoded))
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("cache server closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        raise RuntimeError(f"unexpected reply {line!r}")
+
+    def _command(self, *parts: Any) -> Any:
+        try:
+            connection = self._pool.get_nowait()
+        except Empty:
+            connection = self._connect()
+        try:
+            reply = self._send(*connection, *parts)
+        except Exception:
+            connection[0].close()
+            raise
+        try:
+            self._pool.put_nowait(connection)
+        except Full:
+            connection[0].close()
+        return reply
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._command("SET", key, value, "PX", max(int(ttl * 1000), 1))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return self._command("SET", key, value, "PX", max(int(ttl * 1000), 1), "NX") == "OK"
+
+    def delete(self, key: str):
+        self._command("DEL", key)
+
+
+class TieredBackend:
+    """A small per-process tier in front of a shared one; locks only live in the shared tier"""
+
+    def __init__(self, local: MemoryBackend, shared: Any, local_ttl: float = 60):
+        self.local = local
+        self.shared = shared
+        self.local_ttl = local_ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value, self.local_ttl)
+        return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.shared.set(key, value, ttl)
+        self.local.set(key, value, min(ttl, self.local_ttl))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return self.shared.add(key, value, ttl)
+
+    def delete(self, key: str):
+        self.local.delete(key)
+        self.shared.delete(key)
+
+
+def build_backend(kind: str, url: Optional[str] = None, directory: str = "cache",
+                  max_bytes: int = 256 * 2**20) -> Any:
+    """"memory", "disk" or "redis" (each shared tier gets an in-process tier in front)
+
+    max_bytes bounds the in-process tier and the cache directory; Redis applies its own maxmemory.
+    """
+    if kind == "memory":
+        return MemoryBackend(max_bytes)
+    if kind == "disk":
+        return TieredBackend(MemoryBackend(max_bytes), DiskBackend(directory, max_bytes))
+    if kind == "redis":
+        return TieredBackend(MemoryBackend(max_bytes), RedisBackend(url or "redis://127.0.0.1:6379/0"))
+    raise ValueError(f"unknown cache backend {kind!r}")
+
+
+def encode_json(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":"), default=str).encode("utf-8"), 6)
+
+
+def decode_json(data: bytes) -> Any:
+    return json.loads(zlib.decompress(data))
+
+
+def encode_frame(df: pd.DataFrame, metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """zstd-compressed Arrow IPC stream; metadata rides in the schema"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}), b"cache": json.dumps(metadata, default=str).encode("utf-8"),
+        })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_frame(data: bytes) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    table = pa.ipc.open_stream(data).read_all()
+    metadata = json.loads((table.schema.metadata or {}).get(b"cache", b"{}"))
+    return table.to_pandas(), metadata
+
+
+class SharedCache:
+    """Versioned, stampede-protected get-or-compute over a byte backend
+
+    Backend failures are reported and treated as misses, so a cache outage only costs speed.
+    """
+
+    def __init__(self, backend: Any, version: int = CACHE_VERSION, lock_ttl: float = LOCK_TTL_SECONDS,
+                 name: str = "shared"):
+        self.backend = backend
+        self.name = name
+        self.version = version
+        self.lock_ttl = lock_ttl
+        self._flights: Dict[str, list] = {}
+        self._guard = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "computed": 0, "waited": 0, "errors": 0}
+        _caches.add(self)
+
+    def key(self, namespace: str, parts: Iterable[Any]) -> str:
+        digest = hashlib.sha256(json.dumps(list(parts), default=str).encode("utf-8")).hexdigest()
+        return f"ppp:v{self.version}:{namespace}:{digest}"
+
+    def _count(self, name: str):
+        with self._guard:
+            self.stats[name] += 1
+
+    def _call(self, method: str, *args: Any) -> Any:
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            self._count("errors")
+            print(f"[CACHE] {method} failed: {e}")
+            return None
+
+    @contextmanager
+    def _single_flight(self, key: str):
+        """One computation per key in this process; the others wait for it"""
+        with self._guard:
+            flight = self._flights.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._guard:
+                flight[1] -= 1
+                if not flight[1]:
+                    self._flights.pop(key, None)
+
+    def get_or_compute(self, namespace: str, parts: Iterable[Any], compute: Callable[[], Any], ttl: float,
+                       encode: Callable[[Any], bytes] = encode_json, decode: Callable[[bytes], Any] = decode_json,
+                       cacheable: Callable[[Any], bool] = lambda value: True) -> Tuple[Any, bool]:
+        """(value, hit): the cached value, or compute() stored for later callers on every replica"""
+        key = self.key(namespace, parts)
+        data = self._call("get", key)
+        if data is not None:
+            self._count("hits")
+            return decode(data), True
+        with self._single_flight(key):
+            data = self._call("get", key)
+            if data is not None:
+                self._count("hits")
+                return decode(data), True
+            # Another replica may be computing it: wait for its result rather than repeating the work
+            lock_key = f"{key}:lock"
+            deadline = time.monotonic() + self.lock_ttl
+            locked = self._call("add", lock_key, b"1", self.lock_ttl)
+            while locked is False and time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_SECONDS)
+                data = self._call("get", key)
+                if data is not None:
+                    self._count("waited")
+                    return decode(data), True
+                locked = self._call("add", lock_key, b"1", self.lock_ttl)
+            self._count("misses")
+            try:
+                value = compute()
+                self._count("computed")
+                if cacheable(value):
+                    try:
+                        encoded = encode(value)
+                    except Exception as e:
+                        print(f"[CACHE] {namespace} value not cacheable: {e}")
+                    else:
+                        self._call("set", key, encoded, ttl)
+            finally:
+                if locked:
+                    self._call("delete", lock_key)
+        return value, False
+
+    def report(self) -> Dict[str, Any]:
+        with self._guard:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["waited"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["waited"]) / lookups if lookups else 0.0
+        return stats
+
+
+_caches: "weakref.WeakSet[SharedCache]" = weakref.WeakSet()
+metrics.collect(
+    "ppp_cache_lookups_total", "Shared cache lookups by cache and result (hits, waited, misses, errors)", "counter",
+    lambda: {(cache.name, result): cache.stats[result] for cache in list(_caches)
+             for result in ("hits", "waited", "misses", "errors")},
+    ["cache", "result"],
+)
@@ -0,0 +1,801 @@
+"""Headless structured-question pipeline shared by the Streamlit UI, the batch runner and the HTTP API.
+
+Verified queries, the semantic cache, the prompt rewrite, entity hints, Cortex Analyst and
+SQL execution run here without Streamlit. The UI wraps the same resources in
+st.cache_resource; the CLI builds them once per process from the same settings and files.
+
+    python structured_pipeline.py batch questions.csv --out answers.parquet [--concurrency 4]
+    python structured_pipeline.py serve [--port 8600]
+"""
+import argparse
+import copy
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import openai
+import pandas as pd
+import requests
+import snowflake.connector
+from dotenv import load_dotenv
+
+import metrics
+from admission import BACKGROUND, MAX_WAIT_SECONDS, AdmissionController, AdmissionTimeout, caller, install, slot
+from analyst_context import build_analyst_messages
+from entity_index import EntityIndex, literal_hints
+from local_mirror import LocalMirror, duckdb
+from pipeline import post_analyst_message, run_sql, warm_http
+from prompt_grounding import GroundingIndex, rewrite_mode, template_expansion
+from semantic_cache import LiteralExtractor, SemanticCache, semantic_model_hash
+from shared_cache import SharedCache, build_backend
+from usage import UsageLedger, attribute, install as install_usage_ledger, record_openai
+from verified_queries import VerifiedQueryStore
+from warehouse_routing import CostEstimator, WarehouseRouter, explain_on, install as install_warehouse_router, \
+    installed as installed_warehouse_router, parse_routes
+from warmup import Warmer, keep_warehouse_alive, preload_modules
+
+# Settings are read at import, so the UI, the batch runner and the API see the same .env
+load_dotenv()
+
+SEMANTIC_MODEL_PATH = "pppcdmai.yaml"
+SEMANTIC_CACHE_DB_PATH = os.getenv("SEMANTIC_CACHE_DB_PATH", "semantic_cache.db")
+# Cosine similarity for reusing SQL. 0.90 is a conservative guess for EMBEDDING_MODEL, not a measured
+# value: tune it with `python -m benchmarks.semantic_cache_eval --openai`
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.90"))
+VERIFIED_QUERIES_PATH = os.getenv("VERIFIED_QUERIES_PATH", "verified_queries.yaml")
+# Local DuckDB/Parquet copy of the semantic-model tables (off unless enabled)
+MIRROR_ENABLED = os.getenv("MIRROR_ENABLED", "0") == "1"
+MIRROR_DIR = os.getenv("MIRROR_DIR", "mirror")
+MIRROR_SYNC_MINUTES = float(os.getenv("MIRROR_SYNC_MINUTES", "15"))
+MIRROR_FULL_REFRESH_HOURS = float(os.getenv("MIRROR_FULL_REFRESH_HOURS", "24"))
+# Distinct values of the string dimensions, used to pin literals in questions (off unless enabled)
+ENTITY_INDEX_ENABLED = os.getenv("ENTITY_INDEX_ENABLED", "0") == "1"
+ENTITY_INDEX_PATH = os.getenv("ENTITY_INDEX_PATH", "entity_values.json")
+ENTITY_INDEX_REFRESH_MINUTES = float(os.getenv("ENTITY_INDEX_REFRESH_MINUTES", "60"))
+# Cache tier shared between replicas: "memory", "disk" (CACHE_DIR, e.g. a shared volume) or "redis" (CACHE_URL)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "none")
+CACHE_URL = os.getenv("CACHE_URL", "redis://127.0.0.1:6379/0")
+CACHE_DIR = os.getenv("CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(float(os.getenv("CACHE_MAX_MB", "256")) * 2**20)
+CACHE_ANSWER_TTL_SECONDS = float(os.getenv("CACHE_ANSWER_TTL_SECONDS", "86400"))
+# Fair queueing and rate limits for Cortex, OpenAI, Azure AI Search and the warehouse (off unless enabled);
+# ADMISSION_LIMITS overrides admission.DEFAULT_LIMITS, e.g. {"openai": {"rate": 2, "per_user": 1}}
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "0") == "1"
+ADMISSION_LIMITS = json.loads(os.getenv("ADMISSION_LIMITS", "{}"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", str(MAX_WAIT_SECONDS)))
+# Ledger of tokens, Cortex messages and warehouse queries (empty path turns accounting off)
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage.db")
+USAGE_ENRICH_MINUTES = float(os.getenv("USAGE_ENRICH_MINUTES", "10"))
+# Warm-up at process start and after idle periods (see warmup.py)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "0") == "1"
+WARMUP_IDLE_MINUTES = float(os.getenv("WARMUP_IDLE_MINUTES", "10"))
+WARMUP_SAMPLES = os.getenv("WARMUP_SAMPLES", "1") == "1"
+# Cost-based routing of warehouse queries: a JSON list of routes, smallest warehouse first (empty: off)
+WAREHOUSE_ROUTES = os.getenv("WAREHOUSE_ROUTES", "")
+# Bearer token required by the HTTP API when set
+PIPELINE_API_TOKEN = os.getenv("PIPELINE_API_TOKEN")
+
+SAMPLE_QUESTIONS = [
+    "What are the top 5 companies by deal count?",
+    "Show me asset distribution by region",
+    "Compare deal values year over year",
+    "Which sectors have the highest growth rate?"
+]
+
+REWRITE_MODEL = "o3-mini"
+EMBEDDING_MODEL = "text-embedding-3-small"
+API_MAX_ROWS = 1000
+
+
+CONNECT_SECONDS = metrics.histogram("ppp_snowflake_connect_seconds", "Snowflake logins by outcome", ["outcome"])
+ANSWER_SECONDS = metrics.histogram("ppp_answer_seconds", "Seconds to a Cortex Analyst answer by source and error",
+                                   ["source", "error"])
+
+
+def connect(secrets: Any, warehouse: Optional[str] = None) -> Any:
+    """Snowflake connection from the app secrets (st.secrets or .streamlit/secrets.toml), on `warehouse` if given"""
+    started = time.perf_counter()
+    try:
+        conn = snowflake.connector.connect(
+            user=secrets["user_name"],
+            password=secrets["password"],
+            account=secrets["account"],
+            host=secrets["host"],
+            port=443,
+            warehouse=warehouse or secrets["warehouse"],
+            role=secrets["role"],
+        )
+    except Exception:
+        CONNECT_SECONDS.observe(time.perf_counter() - started, "error")
+        raise
+    CONNECT_SECONDS.observe(time.perf_counter() - started, "ok")
+    return conn
+
+
+def load_secrets(path: str = ".streamlit/secrets.toml") -> Dict[str, Any]:
+    import tomllib
+
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def semantic_model_file(secrets: Any) -> str:
+    return f"@{secrets['database']}.{secrets['schema']}.{secrets['stage']}/{secrets['yaml_name']}"
+
+
+def cortex_base_url(secrets: Any) -> str:
+    """The account's Cortex endpoint; CORTEX_BASE_URL points it at the load-test stand-in instead"""
+    return os.getenv("CORTEX_BASE_URL", f"https://{secrets['host']}")
+
+
+@functools.lru_cache(maxsize=1)
+def openai_client() -> openai.Client:
+    """One client per process, so OpenAI calls share its connection pool"""
+    return openai.Client(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+_semantic_model: Dict[str, Tuple[float, str]] = {}
+
+
+def semantic_model_text(path: str = SEMANTIC_MODEL_PATH) -> str:
+    """The semantic model YAML, read again only when the file changes"""
+    mtime = os.path.getmtime(path)
+    cached = _semantic_model.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r") as f:
+            cached = _semantic_model[path] = (mtime, f.read())
+    return cached[1]
+
+
+def build_semantic_cache() -> Optional[SemanticCache]:
+    if not os.getenv("OPENAI_API_KEY"):
+        return None
+
+    def embed(text: str) -> List[float]:
+        with slot("openai"):
+            response = openai_client().embeddings.create(model=EMBEDDING_MODEL, input=text)
+        record_openai("embedding", response)
+        return response.data[0].embedding
+
+    return SemanticCache(SEMANTIC_CACHE_DB_PATH, embed, threshold=SEMANTIC_CACHE_THRESHOLD,
+                         literals=LiteralExtractor.from_model(SEMANTIC_MODEL_PATH))
+
+
+def build_verified_store() -> VerifiedQueryStore:
+    return VerifiedQueryStore(VERIFIED_QUERIES_PATH, LiteralExtractor.from_model(SEMANTIC_MODEL_PATH))
+
+
+def build_local_mirror(conn: Any) -> Optional[LocalMirror]:
+    if not MIRROR_ENABLED or duckdb is None or conn is None:
+        return None
+    mirror = LocalMirror(SEMANTIC_MODEL_PATH, MIRROR_DIR, lambda sql: pd.read_sql(sql, conn),
+                         full_refresh_hours=MIRROR_FULL_REFRESH_HOURS,
+                         max_staleness_minutes=MIRROR_SYNC_MINUTES * 4)
+    mirror.start_schedule(MIRROR_SYNC_MINUTES)
+    return mirror
+
+
+def build_entity_index(conn: Any, mirror: Optional[LocalMirror] = None) -> Optional[EntityIndex]:
+    if not ENTITY_INDEX_ENABLED or conn is None:
+        return None
+    # Distinct-value scans are cheap on the mirror when it is fresh
+    index = EntityIndex(SEMANTIC_MODEL_PATH, ENTITY_INDEX_PATH, lambda sql: run_sql(conn, sql, mirror)["df"],
+                        full_refresh_hours=MIRROR_FULL_REFRESH_HOURS)
+    index.start_schedule(ENTITY_INDEX_REFRESH_MINUTES)
+    return index
+
+
+def build_shared_cache() -> Optional[SharedCache]:
+    if CACHE_BACKEND == "none":
+        return None
+    return SharedCache(build_backend(CACHE_BACKEND, CACHE_URL, CACHE_DIR, CACHE_MAX_BYTES))
+
+
+def build_admission_controller() -> Optional[AdmissionController]:
+    """The process-wide admission controller, installed so every provider call goes through it"""
+    if not ADMISSION_ENABLED:
+        return None
+    controller = AdmissionController(ADMISSION_LIMITS, max_wait=ADMISSION_MAX_WAIT_SECONDS)
+    install(controller)
+    return controller
+
+
+def build_usage_ledger(conn: Any = None) -> Optional[UsageLedger]:
+    """The process-wide usage ledger, installed so every provider call is recorded"""
+    if not USAGE_DB_PATH:
+        return None
+    ledger = UsageLedger(USAGE_DB_PATH)
+    install_usage_ledger(ledger)
+    if conn is not None:
+        # Straight on the connection: the history lookups are bookkeeping, not usage to account for
+        ledger.start_enrichment(lambda sql: pd.read_sql(sql, conn), USAGE_ENRICH_MINUTES)
+    return ledger
+
+
+def build_warehouse_router(conn: Any, secrets: Any) -> Optional[WarehouseRouter]:
+    """The process-wide warehouse router, installed so every warehouse query runs where its cost fits"""
+    routes = parse_routes(WAREHOUSE_ROUTES)
+    if not routes or conn is None:
+        return None
+    # Statements are estimated on the app's own connection; the routes open theirs on first use
+    router = WarehouseRouter(routes, lambda warehouse: connect(secrets, warehouse), CostEstimator(explain_on(conn)))
+    install_warehouse_router(router)
+    return router
+
+
+def build_grounding_index() -> GroundingIndex:
+    return GroundingIndex(SEMANTIC_MODEL_PATH, canned_questions=SAMPLE_QUESTIONS)
+
+
+def llm_rewrite(prompt: str) -> str:
+    """Rephrase a question for Cortex Analyst with o3-mini, given the semantic model; raises on failure"""
+    if os.getenv("OPENAI_API_KEY") is None:
+        return prompt
+    yaml_content = semantic_model_text()
+
+    context = f"""
+You are a helpful assistant that rewrites user questions so they are better understood by Cortex Analyst,
+which generates SQL based on a semantic model.
+
+Here is the semantic model (YAML format) defining the available tables, fields, and relationships:
+{yaml_content}
+
+Your job is to take the user's question and rephrase it into a clear, structured analytical request that:
+- Uses fully-qualified field names (e.g. `TABLE.COLUMN`) wherever possible
+- Hints at how tables should be joined using keys defined in the model
+- Requests aggregations like counts, averages, or groupings where relevant
+- Preserves all the original analytical intent
+
+Use clear language and help Cortex Analyst build the most accurate query.
+"""
+    new_prompt = f"{context}\nUser Question: {prompt}\nRephrased Question:"
+    with slot("openai"):
+        started = time.perf_counter()
+        response = openai_client().chat.completions.create(
+            model=REWRITE_MODEL,
+            messages=[{"role": "user", "content": new_prompt}],
+        )
+    record_openai("rewrite", response, time.perf_counter() - started)
+    return response.choices[0].message.content
+
+
+class StructuredPipeline:
+    """Question -> Cortex Analyst response -> SQL results, with the caches the UI uses"""
+
+    def __init__(self, conn: Any, base_url: str, model_file: str,
+                 semantic_cache: Optional[SemanticCache] = None,
+                 verified_store: Optional[VerifiedQueryStore] = None,
+                 grounding: Optional[GroundingIndex] = None,
+                 entity_index: Optional[EntityIndex] = None,
+                 mirror: Optional[LocalMirror] = None,
+                 shared_cache: Optional[SharedCache] = None,
+                 rewrite: Callable[[str], str] = llm_rewrite):
+        self.conn = conn
+        self.base_url = base_url
+        self.model_file = model_file
+        self.semantic_cache = semantic_cache
+        self.verified_store = verified_store
+        self.grounding = grounding
+        self.entity_index = entity_index
+        self.mirror = mirror
+        self.shared_cache = shared_cache
+        self.rewrite = rewrite
+
+    @classmethod
+    def from_secrets(cls, secrets: Any) -> "StructuredPipeline":
+        """A pipeline over its own connection and the same cache files as the UI"""
+        conn = connect(secrets)
+        mirror = build_local_mirror(conn)
+        return cls(
+            conn, cortex_base_url(secrets), semantic_model_file(secrets),
+            semantic_cache=build_semantic_cache(),
+            verified_store=build_verified_store(),
+            grounding=build_grounding_index(),
+            entity_index=build_entity_index(conn, mirror),
+            mirror=mirror,
+            shared_cache=build_shared_cache(),
+        )
+
+    def _shared(self, namespace: str, parts: List[Any], compute: Callable[[], Any],
+                cacheable: Callable[[Any], bool] = lambda value: True) -> Tuple[Any, bool]:
+        """(value, hit) of compute() through the shared cache, keyed on the semantic model as well"""
+        if self.shared_cache is None:
+            return compute(), False
+        parts = [semantic_model_hash(SEMANTIC_MODEL_PATH), self.model_file, *parts]
+        return self.shared_cache.get_or_compute(namespace, parts, compute, CACHE_ANSWER_TTL_SECONDS,
+                                                cacheable=cacheable)
+
+    def answer(self, prompt: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Cortex Analyst response for the last user message
+
+        Failures come back as a response whose text explains them, with "error" set to
+        "api", "timeout", "busy" (no Cortex slot within the admission wait) or "connection".
+        """
+        started = time.perf_counter()
+        response = self._answer(prompt, messages)
+        ANSWER_SECONDS.observe(time.perf_counter() - started, answer_source(response), response.get("error") or "")
+        return response
+
+    def _answer(self, prompt: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Curated verified queries answer known questions without any LLM call
+        if len(messages) == 1 and self.verified_store is not None:
+            self.verified_store.reload()
+            verified = self.verified_store.match(prompt)
+            if verified and not verified["exact"] and not self._same_entities(prompt, verified["entry"]["question"]):
+                verified = None
+            if verified:
+                entry = verified["entry"]
+                return {
+                    "message": {"content": [
+                        {"type": "text", "text": f"This is a verified answer to the question: {entry['question']}"},
+                        {"type": "sql", "statement": entry["sql"]},
+                    ]},
+                    "request_id": f"verified:{entry['name']}",
+                    "cache_hit": {"question": entry["question"], "similarity": verified["score"],
+                                  "source": "verified"},
+                }
+
+        # Standalone questions may reuse SQL from an equivalent question answered earlier
+        semantic_cache = self.semantic_cache if len(messages) == 1 else None
+        model_hash = None
+        if semantic_cache is not None:
+            try:
+                model_hash = semantic_model_hash(SEMANTIC_MODEL_PATH)
+                hit = semantic_cache.lookup(prompt, model_hash)
+            except Exception as e:
+                print(f"[SEMANTIC CACHE] lookup failed: {e}")
+                semantic_cache, hit = None, None
+            if hit and hit["similarity"] < 1.0 and not self._same_entities(prompt, hit["question"]):
+                hit = None
+            if hit:
+                return {
+                    "message": {"content": hit["content"]},
+                    "request_id": hit["request_id"],
+                    "cache_hit": {"question": hit["question"], "similarity": hit["similarity"]},
+                }
+
+        # Follow-ups already carry prior questions and their SQL, so only a new thread needs the rewrite,
+        # and only when the question is not already grounded in the semantic model
+        rewrite = None
+        if len(messages) == 1:
+            grounding = self.grounding.score(prompt) if self.grounding is not None else None
+            rewrite = {"mode": rewrite_mode(grounding) if grounding else "llm",
+                       "score": grounding["score"] if grounding else 0.0}
+            print(f"[REWRITE] mode={rewrite['mode']} score={rewrite['score']:.2f}")
+            if rewrite["mode"] == "template":
+                messages[0]["content"][0]["text"] = template_expansion(prompt, grounding)
+            elif rewrite["mode"] == "llm":
+                try:
+                    messages[0]["content"][0]["text"], _ = self._shared(
+                        "rewrite", [REWRITE_MODEL, prompt], lambda: self.rewrite(prompt))
+                except Exception as e:
+                    print(f"[REWRITE] failed, using the original question: {e}")
+                    rewrite["error"] = str(e)
+
+        # Spell the companies, sectors, stages etc. the question names exactly as they are stored
+        if self.entity_index is not None:
+            resolved = self.entity_index.resolve(prompt)
+            if resolved:
+                print("[ENTITY] " + "; ".join(f"{e['mention']} -> {e['column']} = {e['value']!r}" for e in resolved))
+                messages[-1]["content"][0]["text"] += "\n\n" + literal_hints(resolved)
+
+        # Another replica (or this one, earlier) may have sent the very same messages
+        response, hit = self._shared("cortex", [messages], lambda: self._post(messages),
+                                     cacheable=lambda response: not response.get("error"))
+        response = {**response, "rewrite": rewrite}
+        if hit:
+            response["cache_hit"] = {"question": prompt, "similarity": 1.0, "source": "shared_cache"}
+        elif semantic_cache is not None and not response.get("error"):
+            try:
+                semantic_cache.add(prompt, model_hash, response["message"]["content"], response["request_id"])
+            except Exception as e:
+                print(f"[SEMANTIC CACHE] store failed: {e}")
+        return response
+
+    def _same_entities(self, question: str, other: str) -> bool:
+        """Whether both questions name the same warehouse values (assumed without an entity index)"""
+        if self.entity_index is None:
+            return True
+
+        def values(text: str) -> set:
+            return {(entity["column"], entity["value"]) for entity in self.entity_index.resolve(text)}
+
+        return values(question) == values(other)
+
+    def _post(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """One Cortex Analyst call; failures become an explanatory response"""
+        try:
+            resp = post_analyst_message(self.base_url, self.conn.rest.token, messages, self.model_file)
+            request_id = resp.headers.get("X-Snowflake-Request-Id")
+            if resp.status_code < 400:
+                return {**resp.json(), "request_id": request_id}
+            return {
+                "message": {"content": [{"type": "text", "text": f"API Error ({resp.status_code}): {resp.text}"}]},
+                "request_id": request_id,
+                "error": "api",
+            }
+        except requests.Timeout:
+            return {
+                "message": {"content": [{"type": "text", "text": "I'm sorry, but the request timed out. Please try again in a moment."}]},
+                "request_id": "N/A",
+                "error": "timeout",
+            }
+        except AdmissionTimeout:
+            return {
+                "message": {"content": [{"type": "text", "text": "Cortex Analyst is busy with other requests. Please try again in a moment."}]},
+                "request_id": "N/A",
+                "error": "busy",
+            }
+        except Exception as e:
+            return {
+                "message": {"content": [{"type": "text", "text": f"Connection error: {str(e)}. Please check your network connection and try again."}]},
+                "request_id": "N/A",
+                "error": "connection",
+            }
+
+    def execute(self, response: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """run_sql result of every statement in a response, by statement"""
+        results = {}
+        for item in response["message"]["content"]:
+            if item["type"] == "sql" and item["statement"] not in results:
+                results[item["statement"]] = run_sql(self.conn, item["statement"], self.mirror,
+                                                     self.shared_cache)
+        return results
+
+    def follow_up(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Answer and run the last user message of a conversation, for the suggestion prefetcher
+
+        Returns {"response", "results", "cost"}; a failed answer raises, so it is never served from a prefetch.
+        """
+        # answer() adds entity hints to the messages, which the prefetcher still uses as the request's key
+        messages = copy.deepcopy(messages)
+        response = self.answer(messages[-1]["content"][0]["text"], messages)
+        if response.get("error"):
+            raise RuntimeError(response["message"]["content"][0]["text"])
+        results = self.execute(response)
+        return {
+            "response": response,
+            "results": results,
+            "cost": {"cortex_calls": 0 if response.get("cache_hit") else 1,
+                     "warehouse_seconds": sum(result["warehouse_seconds"] for result in results.values())},
+        }
+
+    def ask(self, question: str, history: Optional[List[Dict[str, Any]]] = None,
+            execute: bool = True) -> Dict[str, Any]:
+        """Answer one question end to end; history uses the UI's message format"""
+        started = time.perf_counter()
+        with attribute(question=question):
+            response = self.answer(question, build_analyst_messages(history or [], question))
+            results, sql_error = {}, None
+            if execute and not response.get("error"):
+                try:
+                    results = self.execute(response)
+                except Exception as e:
+                    sql_error = str(e)
+        return {"question": question, "response": response, "results": results, "sql_error": sql_error,
+                "seconds": time.perf_counter() - started}
+
+
+def answer_source(response: Dict[str, Any]) -> str:
+    cache_hit = response.get("cache_hit")
+    if cache_hit:
+        return cache_hit.get("source", "semantic_cache")
+    return "cortex"
+
+
+def preload_semantic_model(pipeline: StructuredPipeline) -> str:
+    """Read and hash the semantic model and make sure the pipeline's grounding index is built"""
+    semantic_model_text()
+    semantic_model_hash(SEMANTIC_MODEL_PATH)
+    if pipeline.grounding is None:
+        pipeline.grounding = build_grounding_index()
+    if pipeline.verified_store is not None:
+        pipeline.verified_store.reload()
+    return f"{len(pipeline.grounding.columns)} columns indexed"
+
+
+def answer_samples(pipeline: StructuredPipeline) -> str:
+    """Answer SAMPLE_QUESTIONS through the caches; returns how many came from where
+
+    Their SQL only runs when a shared cache can hand the results to user sessions.
+    """
+    execute = pipeline.shared_cache is not None
+    sources = Counter(answer_source(pipeline.ask(question, execute=execute)["response"])
+                      for question in SAMPLE_QUESTIONS)
+    return ", ".join(f"{count} from {source}" for source, count in sources.most_common())
+
+
+def warm_warehouse(pipeline: StructuredPipeline) -> str:
+    """Keep the warehouse the smallest statements run on awake: the first route's, or the connection's own"""
+    router = installed_warehouse_router()
+    if router is None:
+        return keep_warehouse_alive(pipeline.conn)
+    warehouse = router.routes[0]["warehouse"]
+    with router.connection(warehouse) as conn:
+        return f"{warehouse}: {keep_warehouse_alive(conn)}"
+
+
+def build_warmer(pipeline: StructuredPipeline, samples: bool = WARMUP_SAMPLES) -> Warmer:
+    """Warm-up stages for the pipeline's connection, endpoints, semantic model and sample answers"""
+    stages: Dict[str, Callable[[], Any]] = {
+        "imports": preload_modules,
+        "snowflake": lambda: warm_warehouse(pipeline),
+        "cortex": lambda: f"HTTP {warm_http(pipeline.base_url)}",
+    }
+    if os.getenv("OPENAI_API_KEY"):
+        stages["openai"] = lambda: f"{len(openai_client().models.list().data)} models"
+    stages["semantic_model"] = lambda: preload_semantic_model(pipeline)
+    if samples:
+        stages["samples"] = lambda: answer_samples(pipeline)
+    return Warmer(stages)
+
+
+def start_warmer(pipeline: StructuredPipeline) -> Optional[Warmer]:
+    """The pipeline's warmer, started in the background, when WARMUP_ENABLED"""
+    if not WARMUP_ENABLED:
+        return None
+    warmer = build_warmer(pipeline)
+    warmer.start(WARMUP_IDLE_MINUTES)
+    return warmer
+
+
+def answer_row(answer: Dict[str, Any]) -> Dict[str, Any]:
+    """Flat summary of an ask() result"""
+    response = answer["response"]
+    content = response["message"]["content"]
+    statements = [item["statement"] for item in content if item["type"] == "sql"]
+    text = next((item["text"] for item in content if item["type"] == "text"), None)
+    first = answer["results"].get(statements[0]) if statements else None
+    error = response.get("error") or ("sql" if answer["sql_error"] else None)
+    return {
+        "question": answer["question"],
+        "status": "error" if error else ("ok" if statements else "no_sql"),
+        "error": error and (answer["sql_error"] or text),
+        "source": answer_source(response),
+        "request_id": response.get("request_id"),
+        "rewrite_mode": (response.get("rewrite") or {}).get("mode"),
+        "interpretation": text,
+        "sql": statements[0] if statements else None,
+        "row_count": len(first["df"]) if first else None,
+        "result_source": first["source"] if first else None,
+        "query_id": first["query_id"] if first else None,
+        "warehouse": first["route"]["warehouse"] if first and first.get("route") else None,
+        "route_reason": first["route"]["reason"] if first and first.get("route") else None,
+        "warehouse_seconds": sum(result["warehouse_seconds"] for result in answer["results"].values()),
+        "seconds": answer["seconds"],
+    }
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    """Questions with ids from a CSV ("question" column, optional "id") or JSONL file"""
+    if path.endswith((".jsonl", ".ndjson")):
+        questions = []
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    questions.append(record if isinstance(record, dict) else {"question": record})
+    else:
+        frame = pd.read_csv(path)
+        column = "question" if "question" in frame.columns else frame.columns[0]
+        questions = [{"id": row.get("id"), "question": row[column]} for row in frame.to_dict("records")]
+    for position, record in enumerate(questions):
+        if record.get("id") is None or pd.isna(record.get("id")):
+            record["id"] = str(position)
+        record["id"] = str(record["id"])
+    return questions
+
+
+def run_batch(pipeline: StructuredPipeline, questions: List[Dict[str, Any]], concurrency: int = 4,
+              results_dir: Optional[str] = None) -> pd.DataFrame:
+    """Answer every question with bounded concurrency; one summary row per question
+
+    Ids must be unique: each names the question's row and its <id>.parquet result.
+    """
+    duplicates = sorted(question_id for question_id, count in Counter(record["id"] for record in questions).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"duplicate question ids: {', '.join(duplicates)}")
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+    run_id = time.strftime("batch-%Y%m%d-%H%M%S")
+
+    def one(record: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            with caller("batch", BACKGROUND), attribute(user="batch", session_id=run_id):
+                answer = pipeline.ask(record["question"])
+        except Exception as e:
+            return {"id": record["id"], "question": record["question"], "status": "error", "error": str(e)}
+        row = {"id": record["id"], **answer_row(answer)}
+        if results_dir and row["sql"] in answer["results"]:
+            row["result_path"] = os.path.join(results_dir, f"{record['id']}.parquet")
+            answer["results"][row["sql"]]["df"].to_parquet(row["result_path"], index=False)
+        return row
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(one, record) for record in questions]
+        for done, future in enumerate(as_completed(futures), start=1):
+            rows.append(future.result())
+            if done % 25 == 0:
+                print(f"[BATCH] {done}/{len(questions)} answered")
+    order = {record["id"]: position for position, record in enumerate(questions)}
+    return pd.DataFrame(sorted(rows, key=lambda row: order[row["id"]]))
+
+
+def json_result(result: Dict[str, Any], max_rows: int = API_MAX_ROWS) -> Dict[str, Any]:
+    df = result["df"]
+    return {
+        "columns": [str(col) for col in df.columns],
+        "rows": json.loads(df.head(max_rows).to_json(orient="values", date_format="iso", default_handler=str)),
+        "row_count": len(df),
+        "truncated": len(df) > max_rows,
+        "source": result["source"],
+        "query_id": result["query_id"],
+        "route": result.get("route"),
+    }
+
+
+def _valid_content_item(item: Any) -> bool:
+    """A message content item as the UI stores it: sql items carry a statement, text items their text"""
+    if not isinstance(item, dict) or not isinstance(item.get("type"), str):
+        return False
+    if item["type"] == "sql":
+        return isinstance(item.get("statement"), str)
+    return item["type"] != "text" or isinstance(item.get("text"), str)
+
+
+def parse_ask_request(body: Any) -> Dict[str, Any]:
+    """Checked POST /ask fields; ValueError names the first bad one, before any work is spent"""
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object")
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError('"question" must be a non-empty string')
+    history = body.get("history")
+    if history is None:
+        history = []
+    if not isinstance(history, list):
+        raise ValueError('"history" must be a list of messages')
+    for position, message in enumerate(history):
+        if not isinstance(message, dict) or message.get("role") not in ("user", "analyst"):
+            raise ValueError(f'history[{position}] needs a "role" of "user" or "analyst"')
+        content = message.get("content")
+        if not isinstance(content, list) or not all(_valid_content_item(item) for item in content):
+            raise ValueError(f'history[{position}] needs a "content" list of typed items')
+    execute = body.get("execute", True)
+    if not isinstance(execute, bool):
+        raise ValueError('"execute" must be true or false')
+    max_rows = body.get("max_rows", API_MAX_ROWS)
+    if isinstance(max_rows, bool) or not isinstance(max_rows, int) or max_rows < 0:
+        raise ValueError('"max_rows" must be a non-negative integer')
+    return {"question": question, "history": history, "execute": execute, "max_rows": max_rows}
+
+
+def make_api_handler(pipeline: StructuredPipeline, concurrency: int, warmer: Optional[Warmer] = None):
+    """HTTP handler class: GET /health, GET /metrics, POST /ask {"question", "history"?, "execute"?, "max_rows"?}"""
+    slots = threading.BoundedSemaphore(concurrency)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            data = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            return not PIPELINE_API_TOKEN or self.headers.get("Authorization") == f"Bearer {PIPELINE_API_TOKEN}"
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            elif self.path == "/metrics":
+                data = metrics.REGISTRY.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", metrics.CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/ask":
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+                return
+            if not self._authorized():
+                self._send_json(401, {"error": "missing or invalid bearer token"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": 'expected a JSON body with a "question"'})
+                return
+            try:
+                request = parse_ask_request(body)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            question, max_rows = request["question"], request["max_rows"]
+            if warmer is not None:
+                warmer.touch()
+            # Fair shares are per API client, named by X-Pipeline-User or else the client address
+            user = self.headers.get("X-Pipeline-User") or self.client_address[0]
+            try:
+                with slots, caller(f"api:{user}"), attribute(user=f"api:{user}"):
+                    answer = pipeline.ask(question, request["history"], execute=request["execute"])
+            except Exception as e:
+                print(f"[API] /ask failed: {e}")
+                self._send_json(500, {"error": f"internal error: {e}"})
+                return
+            response = answer["response"]
+            self._send_json(200, {
+                "question": question,
+                "request_id": response.get("request_id"),
+                "source": answer_source(response),
+                "rewrite": response.get("rewrite"),
+                "error": response.get("error") or answer["sql_error"],
+                "content": response["message"]["content"],
+                "results": [{"sql": sql, **json_result(result, max_rows)} for sql, result in answer["results"].items()],
+                "seconds": answer["seconds"],
+            })
+
+        def log_message(self, format: str, *args):
+            print(f"[API] {self.address_string()} {format % args}")
+
+    return Handler
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Answer structured questions without the UI")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    commands = parser.add_subparsers(dest="command", required=True)
+    batch = commands.add_parser("batch", help="answer questions from a CSV or JSONL file into Parquet")
+    batch.add_argument("questions")
+    batch.add_argument("--out", default="answers.parquet")
+    batch.add_argument("--results-dir", help="also write each question's result rows as <id>.parquet here")
+    batch.add_argument("--concurrency", type=int, default=4)
+    serve = commands.add_parser("serve", help="serve POST /ask over HTTP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8600)
+    serve.add_argument("--concurrency", type=int, default=4, help="questions answered at once")
+    args = parser.parse_args(argv)
+
+    build_admission_controller()
+    secrets = load_secrets(args.secrets)
+    pipeline = StructuredPipeline.from_secrets(secrets)
+    build_usage_ledger(pipeline.conn)
+    build_warehouse_router(pipeline.conn, secrets)
+    if args.command == "serve":
+        warmer = None
+        if WARMUP_ENABLED:
+            # Warm before listening, so the first request does not pay for it
+            warmer = build_warmer(pipeline)
+            warmer.run("start")
+            warmer.start(WARMUP_IDLE_MINUTES, run_now=False)
+        server = ThreadingHTTPServer((args.host, args.port), make_api_handler(pipeline, args.concurrency, warmer))
+        print(f"Serving on http://{args.host}:{args.port}")
+        server.serve_forever()
+        return
+
+    questions = read_questions(args.questions)
+    started = time.perf_counter()
+    answers = run_batch(pipeline, questions, concurrency=args.concurrency, results_dir=args.results_dir)
+    minutes = (time.perf_counter() - started) / 60
+    answers.to_parquet(args.out, index=False)
+    status = answers["status"].value_counts().to_dict()
+    print(f"{len(answers)} questions in {minutes * 60:.1f}s: {len(answers) / minutes:.1f} questions/minute, "
+          f"p50 {answers['seconds'].median():.1f}s per question")
+    print(f"status {status}, source {answers['source'].value_counts().to_dict()} -> {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""Token, request and warehouse accounting per call, aggregated per session, user and question.
+
+record() appends one event per provider call to a SQLite ledger: OpenAI prompt and
+completion tokens, Cortex Analyst messages, and Snowflake query ids with the client-side
+elapsed time. enrich() later fills in bytes scanned, execution time and the credits of
+each query from INFORMATION_SCHEMA.QUERY_HISTORY. Events are attributed to the caller
+set with attribute() on the current thread.
+
+    python usage.py export --out usage.jsonl [--since 2025-06-01] [--session <id>]
+    python usage.py summary [--by session|user|question|provider]
+"""
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+import metrics
+
+# USD per million tokens (input, output)
+OPENAI_PRICES = {
+    "o3-mini": (1.10, 4.40),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+CORTEX_ANALYST_CREDITS_PER_MESSAGE = 0.067
+WAREHOUSE_CREDITS_PER_HOUR = {
+    "X-Small": 1, "Small": 2, "Medium": 4, "Large": 8, "X-Large": 16, "2X-Large": 32, "3X-Large": 64,
+    "4X-Large": 128,
+}
+CREDIT_PRICE_USD = float(os.getenv("SNOWFLAKE_CREDIT_PRICE_USD", "3.0"))
+# QUERY_HISTORY lags a little behind the query itself
+ENRICH_DELAY_SECONDS = 60
+ENRICH_BATCH_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_events (
+    id                INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at        TEXT NOT NULL,
+    session_id        TEXT,
+    user              TEXT,
+    question          TEXT,
+    provider          TEXT NOT NULL,
+    operation         TEXT NOT NULL,
+    model             TEXT,
+    reference         TEXT,
+    requests          INTEGER NOT NULL DEFAULT 1,
+    prompt_tokens     INTEGER,
+    completion_tokens INTEGER,
+    rows              INTEGER,
+    elapsed_seconds   REAL,
+    bytes_scanned     INTEGER,
+    execution_seconds REAL,
+    warehouse_size    TEXT,
+    credits           REAL,
+    cost_usd          REAL
+);
+CREATE INDEX IF NOT EXISTS idx_usage_session ON usage_events(session_id, id);
+CREATE INDEX IF NOT EXISTS idx_usage_created ON usage_events(created_at);
+"""
+RECORD_FIELDS = ["created_at", "session_id", "user", "question", "provider", "operation", "model", "reference",
+                 "requests", "prompt_tokens", "completion_tokens", "rows", "elapsed_seconds", "credits", "cost_usd"]
+GROUPINGS = ("session", "user", "question", "provider")
+
+_attribution: contextvars.ContextVar = contextvars.ContextVar("usage_attribution", default={})
+_ledger: Optional["UsageLedger"] = None
+
+CALL_SECONDS = metrics.histogram("ppp_provider_call_seconds", "Upstream call latency by provider, operation and model",
+                                 ["provider", "operation", "model"])
+
+
+def openai_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """USD for a call; dated model names (o3-mini-2025-01-31) use their base model's price"""
+    name = next((known for known in sorted(OPENAI_PRICES, key=len, reverse=True)
+                 if model and model.startswith(known)), None)
+    if name is None:
+        return None
+    input_price, output_price = OPENAI_PRICES[name]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1e6
+
+
+class UsageLedger:
+    """Append-only SQLite table of provider calls; safe to share across Streamlit sessions"""
+
+    def __init__(self, path: str = "usage.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(self, event: Dict[str, Any]):
+        event = {"created_at": datetime.now().isoformat(timespec="milliseconds"), **event}
+        names = [name for name in event if name in RECORD_FIELDS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO usage_events ({', '.join(names)}) VALUES ({', '.join('?' for _ in names)})",
+                [event[name] for name in names],
+            )
+
+    def events(self, since: Optional[str] = None, session_id: Optional[str] = None,
+               user: Optional[str] = None) -> pd.DataFrame:
+        sql, params = "SELECT * FROM usage_events WHERE 1 = 1", []
+        if since:
+            sql, params = sql + " AND created_at >= ?", params + [since]
+        if session_id:
+            sql, params = sql + " AND session_id = ?", params + [session_id]
+        if user:
+            sql, params = sql + " AND user = ?", params + [user]
+        with self._lock:
+            return pd.read_sql_query(sql + " ORDER BY id", self._conn, params=params)
+
+    def summary(self, by: str = "session", since: Optional[str] = None,
+                session_id: Optional[str] = None, user: Optional[str] = None) -> pd.DataFrame:
+        return summarize(self.events(since, session_id, user), by)
+
+    def export(self, path: str, since: Optional[str] = None, session_id: Optional[str] = None,
+               user: Optional[str] = None) -> int:
+        """Write events as JSON lines; returns how many"""
+        events = self.events(since, session_id, user)
+        with open(path, "w") as f:
+            f.write(self.to_jsonl(events))
+        return len(events)
+
+    @staticmethod
+    def to_jsonl(events: pd.DataFrame) -> str:
+        records = json.loads(events.to_json(orient="records"))
+        return "".join(json.dumps({k: v for k, v in record.items() if v is not None}) + "\n" for record in records)
+
+    def enrich(self, fetch: Callable[[str], pd.DataFrame]) -> int:
+        """Fill bytes scanned, execution time and credits of recorded queries from QUERY_HISTORY; returns how many"""
+        cutoff = (datetime.now() - timedelta(seconds=ENRICH_DELAY_SECONDS)).isoformat()
+        week_ago = (datetime.now() - timedelta(days=7)).isoformat()
+        with self._lock:
+            query_ids = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT reference FROM usage_events WHERE provider = 'snowflake' AND operation = 'query' "
+                "AND reference IS NOT NULL AND bytes_scanned IS NULL AND created_at BETWEEN ? AND ?",
+                (week_ago, cutoff),
+            )]
+        enriched = 0
+        for start in range(0, len(query_ids), ENRICH_BATCH_SIZE):
+            batch = query_ids[start:start + ENRICH_BATCH_SIZE]
+            history = fetch(
+                "SELECT QUERY_ID, BYTES_SCANNED, EXECUTION_TIME, WAREHOUSE_SIZE, CREDITS_USED_CLOUD_SERVICES "
+                "FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY("
+                "END_TIME_RANGE_START => DATEADD('day', -7, CURRENT_TIMESTAMP()), RESULT_LIMIT => 10000)) "
+                "WHERE QUERY_ID IN (" + ", ".join(f"'{query_id}'" for query_id in batch) + ")"
+            )
+            history.columns = [str(name).upper() for name in history.columns]
+            updates = []
+            for row in history.to_dict("records"):
+                execution_seconds = (row["EXECUTION_TIME"] or 0) / 1000
+                size = row["WAREHOUSE_SIZE"]
+                # Execution time at the warehouse's hourly rate; ignores the 60s minimum and idle time
+                credits = (execution_seconds / 3600 * WAREHOUSE_CREDITS_PER_HOUR.get(size, 0)
+                           + float(row["CREDITS_USED_CLOUD_SERVICES"] or 0))
+                updates.append((int(row["BYTES_SCANNED"] or 0), execution_seconds, size, credits,
+                                credits * CREDIT_PRICE_USD, row["QUERY_ID"]))
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "UPDATE usage_events SET bytes_scanned = ?, execution_seconds = ?, warehouse_size = ?, "
+                    "credits = ?, cost_usd = ? WHERE provider = 'snowflake' AND operation = 'query' AND reference = ?",
+                    updates,
+                )
+            enriched += len(updates)
+        return enriched
+
+    def start_enrichment(self, fetch: Callable[[str], pd.DataFrame], interval_minutes: float):
+        """Enrich every interval on a daemon thread"""
+        def loop():
+            while True:
+                time.sleep(interval_minutes * 60)
+                try:
+                    self.enrich(fetch)
+                except Exception as e:
+                    print(f"[USAGE] enrichment failed: {e}")
+
+        threading.Thread(target=loop, name="usage-enrichment", daemon=True).start()
+
+
+def summarize(events: pd.DataFrame, by: Optional[str] = "session") -> pd.DataFrame:
+    """Totals per session, user, question or provider (one row overall for None), most expensive first"""
+    key = {"session": "session_id"}.get(by, by)
+    events = events.assign(
+        openai_tokens=events["prompt_tokens"].fillna(0) + events["completion_tokens"].fillna(0),
+        cortex_messages=(events["provider"] == "cortex") * events["requests"],
+        queries=(events["operation"] == "query").astype(int),
+        warehouse_seconds=events["execution_seconds"],
+        total="all",
+    )
+    key = key or "total"
+    events[key] = events[key].fillna("(none)")
+    totals = events.groupby(key).agg(
+        openai_tokens=("openai_tokens", "sum"), cortex_messages=("cortex_messages", "sum"),
+        queries=("queries", "sum"), bytes_scanned=("bytes_scanned", "sum"),
+        warehouse_seconds=("warehouse_seconds", "sum"), credits=("credits", "sum"),
+        cost_usd=("cost_usd", "sum"),
+    )
+    return totals.sort_values("cost_usd", ascending=False).reset_index()
+
+
+def install(ledger: Optional[UsageLedger]):
+    """Record every provider call in this process to the ledger (None turns accounting off)"""
+    global _ledger
+    _ledger = ledger
+
+
+@contextmanager
+def attribute(**attribution: Optional[str]) -> Iterator[None]:
+    """Attribute the calls made inside the block to a session_id, user and/or question (nested blocks add to it)"""
+    merged = {**_attribution.get(), **{k: v for k, v in attribution.items() if v is not None}}
+    token = _attribution.set(merged)
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def attributed(fn: Callable[..., Any], **attribution: Optional[str]) -> Callable[..., Any]:
+    """fn wrapped to run with the current attribution plus the given one, for work handed to another thread"""
+    merged = {**_attribution.get(), **{k: v for k, v in attribution.items() if v is not None}}
+
+    def run(*args, **kwargs):
+        with attribute(**merged):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+def record(provider: str, operation: str, **fields: Any):
+    """Add one call to the installed ledger and its latency to the metrics; never raises"""
+    if fields.get("elapsed_seconds") is not None:
+        CALL_SECONDS.observe(fields["elapsed_seconds"], provider, operation, fields.get("model") or "")
+    ledger = _ledger
+    if ledger is None:
+        return
+    try:
+        ledger.add({**_attribution.get(), "provider": provider, "operation": operation, **fields})
+    except Exception as e:
+        print(f"[USAGE] record failed: {e}")
+
+
+def record_openai(operation: str, response: Any, elapsed_seconds: Optional[float] = None):
+    """Tokens and cost of an OpenAI chat completion or embeddings response"""
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    model = getattr(response, "model", None)
+    record("openai", operation, model=model, reference=getattr(response, "id", None),
+           prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, elapsed_seconds=elapsed_seconds,
+           cost_usd=openai_cost(model, prompt_tokens, completion_tokens))
+
+
+def record_cortex_message(request_id: Optional[str], elapsed_seconds: float, ok: bool):
+    """Cortex Analyst bills successful messages"""
+    credits = CORTEX_ANALYST_CREDITS_PER_MESSAGE if ok else 0.0
+    record("cortex", "message", reference=request_id, requests=1, elapsed_seconds=elapsed_seconds,
+           credits=credits, cost_usd=credits * CREDIT_PRICE_USD)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Export or summarize recorded usage")
+    parser.add_argument("--db", default=os.getenv("USAGE_DB_PATH", "usage.db"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write events as JSONL")
+    export.add_argument("--out", default="usage.jsonl")
+    export.add_argument("--since", help="ISO date or timestamp")
+    export.add_argument("--session")
+    export.add_argument("--user")
+    summary = commands.add_parser("summary", help="print totals")
+    summary.add_argument("--by", choices=GROUPINGS, default="session")
+    summary.add_argument("--since")
+    summary.add_argument("--user")
+    args = parser.parse_args(argv)
+
+    ledger = UsageLedger(args.db)
+    if args.command == "export":
+        print(f"{ledger.export(args.out, args.since, args.session, args.user)} events -> {args.out}")
+    else:
+        with pd.option_context("display.width", 200, "display.max_columns", 20):
+            print(ledger.summary(args.by, args.since, user=args.user).to_string(index=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Curated question -> SQL repository consulted before Cortex Analyst.
+
+Entries use the same fields as the semantic model's `verified_queries` section, so they can be
+emitted into pppcdmai.yaml:
+
+    python verified_queries.py emit --model pppcdmai.yaml --out pppcdmai.yaml
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import yaml
+
+from semantic_cache import LiteralExtractor, critical_terms, normalize_question
+
+# Minimum Jaccard overlap of content tokens for a non-exact match
+TOKEN_OVERLAP_THRESHOLD = 0.8
+
+STOPWORDS = {
+    "a", "an", "the", "of", "by", "for", "in", "on", "to", "and", "or", "is", "are", "was", "were",
+    "me", "show", "list", "give", "what", "which", "who", "how", "many", "much", "do", "does", "did",
+    "with", "have", "has", "there", "their", "all", "our", "we", "i", "please", "can", "you", "tell",
+}
+
+
+def content_tokens(normalized: str) -> Set[str]:
+    """Question tokens without stopwords, with a trailing plural 's' stripped"""
+    tokens = set()
+    for token in normalized.split():
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.add(token)
+    return tokens
+
+
+def entry_name(question: str) -> str:
+    """Readable slug of the question plus a hash of its normalized form, so truncated slugs stay unique"""
+    slug = re.sub(r"_+", "_", re.sub(r"[^a-z0-9]", "_", question.lower())).strip("_")[:60] or "query"
+    digest = hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()[:8]
+    return f"{slug}_{digest}"
+
+
+@contextmanager
+def _file_lock(path: str) -> Iterator[None]:
+    """Exclusive lock on a sidecar file, held across processes sharing the store"""
+    with open(f"{path}.lock", "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class VerifiedQueryStore:
+    """Loads, matches and persists verified queries kept in a YAML file"""
+
+    def __init__(self, path: str, literals: Optional[LiteralExtractor] = None):
+        self.path = path
+        self.literals = literals or LiteralExtractor()
+        self._lock = threading.Lock()
+        self._entries: List[Dict[str, Any]] = []
+        self._exact: Dict[str, int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._tokens: List[Set[str]] = []
+        self._terms: List[frozenset] = []
+        self._literals: List[frozenset] = []
+        self._mtime: Optional[float] = None
+        self.reload()
+
+    def reload(self):
+        """(Re)read the YAML file if it changed on disk"""
+        with self._lock:
+            self._reload()
+
+    def _reload(self, force: bool = False):
+        """reload() for a caller holding the lock; force rereads even when the mtime looks unchanged"""
+        mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        if mtime == self._mtime and self._entries and not force:
+            return
+        entries: List[Dict[str, Any]] = []
+        if mtime is not None:
+            with open(self.path, "r") as f:
+                entries = (yaml.safe_load(f) or {}).get("verified_queries") or []
+        self._mtime = mtime
+        self._rebuild(entries)
+
+    def _rebuild(self, entries: List[Dict[str, Any]]):
+        """Rebuild the exact-match map and the token inverted index; caller holds the lock"""
+        self._entries = entries
+        self._exact, self._postings, self._tokens, self._terms, self._literals = {}, {}, [], [], []
+        names = set()
+        for position, entry in enumerate(entries):
+            # Entries written before names carried a hash can share a truncated slug
+            if entry.get("name") in names:
+                entry["name"] = entry_name(entry["question"])
+            names.add(entry.get("name"))
+            normalized = normalize_question(entry["question"])
+            self._exact[normalized] = position
+            self._terms.append(critical_terms(normalized))
+            self._literals.append(self.literals(entry["question"]))
+            tokens = content_tokens(normalized)
+            self._tokens.append(tokens)
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(position)
+
+    @property
+    def entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._entries)
+
+    def match(self, question: str) -> Optional[Dict[str, Any]]:
+        """Exact normalized match, else the best token-overlap match above the threshold
+
+        A non-exact match must agree on the numbers, direction, grain and status words and on
+        the entity literals, so a question about one vendor never gets another vendor's SQL.
+        """
+        normalized = normalize_question(question)
+        with self._lock:
+            if normalized in self._exact:
+                return {"entry": self._entries[self._exact[normalized]], "score": 1.0, "exact": True}
+            tokens = content_tokens(normalized)
+            candidates: Set[int] = set()
+            for token in tokens:
+                candidates |= self._postings.get(token, set())
+            terms = critical_terms(normalized)
+            literals = self.literals(question)
+            best, best_score = None, 0.0
+            for position in candidates:
+                if self._terms[position] != terms or self._literals[position] != literals:
+                    continue
+                entry_tokens = self._tokens[position]
+                score = len(tokens & entry_tokens) / len(tokens | entry_tokens)
+                if score > best_score:
+                    best, best_score = position, score
+            if best is None or best_score < TOKEN_OVERLAP_THRESHOLD:
+                return None
+            return {"entry": self._entries[best], "score": best_score, "exact": False}
+
+    def add(self, question: str, sql: str, verified_by: Optional[str] = None,
+            use_as_onboarding_question: bool = False) -> Dict[str, Any]:
+        """Add or replace the verified SQL for a question and persist the store"""
+        entry = {
+            "name": entry_name(question),
+            "question": question,
+            "sql": sql,
+            "verified_at": int(time.time()),
+            "verified_by": verified_by or "app",
+            "use_as_onboarding_question": use_as_onboarding_question,
+        }
+        normalized = normalize_question(question)
+        with self._lock, _file_lock(self.path):
+            # Start from the file, not memory, so another process's edits since our last read survive
+            self._reload(force=True)
+            entries = [e for e in self._entries if normalize_question(e["question"]) != normalized]
+            entries.append(entry)
+            self._save(entries)
+            self._rebuild(entries)
+        return entry
+
+    def remove(self, name: str):
+        with self._lock, _file_lock(self.path):
+            self._reload(force=True)
+            entries = [e for e in self._entries if e["name"] != name]
+            self._save(entries)
+            self._rebuild(entries)
+
+    def _save(self, entries: List[Dict[str, Any]]):
+        """Write through a uniquely named temp file in the same directory, then swap it in"""
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(self.path)}.", suffix=".tmp",
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                yaml.safe_dump({"verified_queries": entries}, f, sort_keys=False, allow_unicode=True, width=1000)
+            # mkstemp creates the file private; keep the store's own permissions
+            os.chmod(tmp_path, os.stat(self.path).st_mode if os.path.exists(self.path) else 0o644)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._mtime = os.path.getmtime(self.path)
+
+
+def emit_to_semantic_model(store: VerifiedQueryStore, model_path: str, out_path: str) -> int:
+    """Merge the store into the semantic model's verified_queries section; returns the entry count"""
+    with open(model_path, "r") as f:
+        model = yaml.safe_load(f)
+    merged = {normalize_question(e["question"]): e for e in model.get("verified_queries") or []}
+    for entry in store.entries:
+        merged[normalize_question(entry["question"])] = entry
+    model["verified_queries"] = list(merged.values())
+    with open(out_path, "w") as f:
+        yaml.safe_dump(model, f, sort_keys=False, allow_unicode=True, width=1000)
+    return len(merged)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Manage the verified query repository")
+    parser.add_argument("--store", default=os.getenv("VERIFIED_QUERIES_PATH", "verified_queries.yaml"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    emit = commands.add_parser("emit", help="write the entries into a semantic model's verified_queries")
+    emit.add_argument("--model", default="pppcdmai.yaml")
+    emit.add_argument("--out", default="pppcdmai.yaml")
+    commands.add_parser("list", help="print the stored questions")
+    args = parser.parse_args(argv)
+
+    store = VerifiedQueryStore(args.store)
+    if args.command == "emit":
+        count = emit_to_semantic_model(store, args.model, args.out)
+        print(f"Wrote {count} verified queries to {args.out}")
+    else:
+        for entry in store.entries:
+            print(f"{entry['name']}: {entry['question']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
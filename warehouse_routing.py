@@ -0,0 +1,282 @@
+"""Cost-based routing of generated SQL to one of several warehouses, each with its own connection pool.
+
+Before a statement runs on Snowflake, the router estimates its cost and picks the first
+route, smallest first, whose limits it fits:
+
+    WAREHOUSE_ROUTES='[
+        {"warehouse": "PPP_XS_WH", "max_bytes": 50e6, "max_joins": 1, "pool_size": 4},
+        {"warehouse": "PPP_M_WH", "max_bytes": 5e9, "max_joins": 3},
+        {"warehouse": "PPP_L_WH", "pool_size": 2}
+    ]'
+
+Limits are max_bytes and max_partitions (what EXPLAIN says the scan is assigned),
+max_joins and max_tables; a route without limits takes everything, and a statement over
+every route's limits goes to the last one. EXPLAIN only compiles the statement, so it
+needs no running warehouse: a point lookup is estimated and sent to the small warehouse
+without waking the large one. Estimates are kept per statement text. When EXPLAIN
+fails, the joins and tables are counted in the SQL text and byte limits count as exceeded.
+
+Each route keeps up to pool_size connections to its warehouse, opened on first use. The
+decision ({"warehouse", "reason", "bytes", "partitions", "joins", "tables", "explained"})
+comes back with every run_sql result. install() makes a router govern every warehouse
+query in the process; without one, statements run on the caller's connection as before.
+"""
+import json
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+import metrics
+
+LIMITS = ("max_bytes", "max_partitions", "max_joins", "max_tables")
+COST_FIELDS = {"max_bytes": "bytes", "max_partitions": "partitions", "max_joins": "joins", "max_tables": "tables"}
+DEFAULT_POOL_SIZE = 2
+CHECKOUT_TIMEOUT_SECONDS = 120
+ESTIMATE_CACHE_SIZE = 512
+
+_router: Optional["WarehouseRouter"] = None
+
+CHECKOUT_SECONDS = metrics.histogram("ppp_warehouse_checkout_seconds", "Seconds waited for a pooled connection",
+                                     ["warehouse"])
+ROUTED = metrics.counter("ppp_warehouse_routed_total", "Statements routed per warehouse", ["warehouse"])
+EXPLAIN_SECONDS = metrics.histogram("ppp_warehouse_explain_seconds", "Seconds to estimate a statement with EXPLAIN",
+                                    ["outcome"])
+
+_IDENTIFIER = r'(?:"[^"]+"|[\w$]+)'
+_TABLE_REFERENCE = re.compile(rf"\b(?:FROM|JOIN)\s+({_IDENTIFIER}(?:\.{_IDENTIFIER})*)", re.IGNORECASE)
+_CTE_NAME = re.compile(rf"(?:\bWITH|,)\s*({_IDENTIFIER})\s+AS\s*\(", re.IGNORECASE)
+_JOIN = re.compile(r"\bJOIN\b", re.IGNORECASE)
+
+
+def _table_name(reference: str) -> str:
+    """Unqualified, upper-cased table name: PPP.CDM."Media" -> MEDIA"""
+    return reference.split(".")[-1].strip('"').upper()
+
+
+def referenced_tables(sql: str) -> Set[str]:
+    """Tables named after FROM or JOIN, without the statement's own CTEs"""
+    ctes = {_table_name(name) for name in _CTE_NAME.findall(sql)}
+    return {_table_name(reference) for reference in _TABLE_REFERENCE.findall(sql)} - ctes
+
+
+def static_estimate(sql: str) -> Dict[str, Any]:
+    """Joins and tables counted in the SQL text; bytes and partitions unknown"""
+    return {"bytes": None, "partitions": None, "joins": len(_JOIN.findall(sql)),
+            "tables": len(referenced_tables(sql)), "explained": False}
+
+
+def parse_explain(plan: str) -> Dict[str, Any]:
+    """Cost from the output of EXPLAIN USING JSON: bytes and partitions assigned, joins and tables scanned"""
+    plan = json.loads(plan)
+    stats = plan.get("GlobalStats", {})
+    operations = [operation for step in plan.get("Operations", []) for operation in step]
+    tables = {_table_name(name) for operation in operations if operation.get("operation") == "TableScan"
+              for name in operation.get("objects", [])}
+    return {
+        "bytes": stats.get("bytesAssigned", 0),
+        "partitions": stats.get("partitionsAssigned", 0),
+        "joins": sum(1 for operation in operations if "Join" in operation.get("operation", "")),
+        "tables": len(tables),
+        "explained": True,
+    }
+
+
+def explain_on(conn: Any) -> Callable[[str], str]:
+    """EXPLAIN USING JSON on a connection; compiling needs no running warehouse"""
+    def explain(sql: str) -> str:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"EXPLAIN USING JSON {sql.strip().rstrip(';')}")
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+    return explain
+
+
+class CostEstimator:
+    """EXPLAIN-based cost per statement, remembered for the most recent ESTIMATE_CACHE_SIZE statements"""
+
+    def __init__(self, explain: Optional[Callable[[str], str]], max_entries: int = ESTIMATE_CACHE_SIZE):
+        self.explain = explain
+        self.max_entries = max_entries
+        self._estimates: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"explained": 0, "reused": 0, "failed": 0}
+
+    def estimate(self, sql: str) -> Dict[str, Any]:
+        with self._lock:
+            cached = self._estimates.get(sql)
+            if cached is not None:
+                self._estimates.move_to_end(sql)
+                self.stats["reused"] += 1
+                return cached
+        estimate = static_estimate(sql)
+        if self.explain is not None:
+            started = time.perf_counter()
+            try:
+                estimate = parse_explain(self.explain(sql))
+                EXPLAIN_SECONDS.observe(time.perf_counter() - started, "ok")
+                self.stats["explained"] += 1
+            except Exception as e:
+                # Not cached: the next run of the statement tries EXPLAIN again
+                EXPLAIN_SECONDS.observe(time.perf_counter() - started, "error")
+                self.stats["failed"] += 1
+                print(f"[ROUTING] EXPLAIN failed, estimating from the SQL text: {e}")
+                return estimate
+        with self._lock:
+            self._estimates[sql] = estimate
+            while len(self._estimates) > self.max_entries:
+                self._estimates.popitem(last=False)
+        return estimate
+
+
+class ConnectionPool:
+    """Up to `size` connections from connect(), opened on first use and handed out most recently used first"""
+
+    def __init__(self, name: str, connect: Callable[[], Any], size: int = DEFAULT_POOL_SIZE,
+                 timeout: float = CHECKOUT_TIMEOUT_SECONDS):
+        self.name = name
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        started = time.perf_counter()
+        conn = self._checkout()
+        CHECKOUT_SECONDS.observe(time.perf_counter() - started, self.name)
+        try:
+            yield conn
+        finally:
+            # A dropped session goes back as None, so the next checkout opens a replacement
+            self._idle.put(None if _is_closed(conn) else conn)
+
+    def _checkout(self) -> Any:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                opening = self._opened < self.size
+                self._opened += opening
+            try:
+                conn = None if opening else self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"no {self.name} connection free within {self.timeout:g}s") from None
+        if conn is None:
+            try:
+                return self.connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return conn
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if conn is not None:
+                conn.close()
+
+
+def _is_closed(conn: Any) -> bool:
+    is_closed = getattr(conn, "is_closed", None)
+    return bool(is_closed()) if callable(is_closed) else False
+
+
+def _within(value: Optional[float], limit: float) -> bool:
+    # An unknown amount (EXPLAIN failed) never fits a limit on it
+    return value is not None and value <= limit
+
+
+def _amount(value: Optional[float]) -> str:
+    return "unknown" if value is None else f"{value:,.0f}"
+
+
+def parse_routes(value: str) -> List[Dict[str, Any]]:
+    """Routes from WAREHOUSE_ROUTES JSON, checked: each needs a warehouse and takes only known limits"""
+    routes = json.loads(value) if value else []
+    if not isinstance(routes, list):
+        raise ValueError("WAREHOUSE_ROUTES must be a JSON list of routes")
+    for route in routes:
+        if not route.get("warehouse"):
+            raise ValueError(f"route without a warehouse: {route}")
+        unknown = set(route) - {"warehouse", "pool_size", *LIMITS}
+        if unknown:
+            raise ValueError(f"route {route['warehouse']} has unknown keys {sorted(unknown)}")
+    return routes
+
+
+class WarehouseRouter:
+    """Picks a warehouse per statement from its estimated cost and lends out that warehouse's connections"""
+
+    def __init__(self, routes: List[Dict[str, Any]], connect: Callable[[str], Any], estimator: CostEstimator):
+        if not routes:
+            raise ValueError("a router needs at least one route")
+        self.routes = routes
+        self.estimator = estimator
+        self.pools = {
+            route["warehouse"]: ConnectionPool(route["warehouse"], lambda name=route["warehouse"]: connect(name),
+                                               route.get("pool_size", DEFAULT_POOL_SIZE))
+            for route in routes
+        }
+
+    def choose(self, sql: str) -> Dict[str, Any]:
+        """The routing decision for a statement: its warehouse, why, and the estimate it was based on"""
+        cost = self.estimator.estimate(sql)
+        skipped = []
+        for route in self.routes:
+            over = [f"{COST_FIELDS[limit]} {_amount(cost[COST_FIELDS[limit]])} > {_amount(route[limit])}"
+                    for limit in LIMITS if limit in route and not _within(cost[COST_FIELDS[limit]], route[limit])]
+            if not over:
+                break
+            skipped.append(f"{route['warehouse']}: {', '.join(over)}")
+        else:
+            route = self.routes[-1]
+        reason = "; ".join(skipped) if skipped else "within the smallest route's limits"
+        ROUTED.inc(route["warehouse"])
+        return {"warehouse": route["warehouse"], "reason": reason, **cost}
+
+    def connection(self, warehouse: str) -> Any:
+        """Context manager lending a pooled connection to the warehouse"""
+        return self.pools[warehouse].connection()
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+
+def install(router: Optional[WarehouseRouter]):
+    """Route every warehouse query in this process through the router (None: run on the caller's connection)"""
+    global _router
+    _router = router
+
+
+def installed() -> Optional[WarehouseRouter]:
+    return _router
+
+
+def choose(sql: str) -> Optional[Dict[str, Any]]:
+    """The installed router's decision for a statement, None without a router"""
+    router = _router
+    return router.choose(sql) if router is not None else None
+
+
+@contextmanager
+def connection(conn: Any, decision: Optional[Dict[str, Any]]) -> Iterator[Any]:
+    """A pooled connection to the decided warehouse, or conn itself without a decision"""
+    router = _router
+    if decision is None or router is None:
+        yield conn
+        return
+    with router.connection(decision["warehouse"]) as routed:
+        yield routed
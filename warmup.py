@@ -0,0 +1,147 @@
+"""Warm-up: pay the cold-start costs before users do, and again after idle periods.
+
+A Warmer runs named stages in order and logs how long each took ("[WARMUP] snowflake
+2.31s"). structured_pipeline.build_warmer() assembles them for a pipeline:
+
+- imports: SDK modules otherwise imported on first use
+- snowflake: resume the warehouse, the smallest route's when warehouse routing is on
+  (or, without OPERATE on it, keep the login alive)
+- cortex, openai: open the pooled connections, TLS handshake included
+- semantic_model: read, hash and index pppcdmai.yaml
+- samples: answer SAMPLE_QUESTIONS, so the semantic and shared caches hold them
+
+With WARMUP_ENABLED=1 the app and `structured_pipeline.py serve` run one per process,
+and again whenever the process has been idle for WARMUP_IDLE_MINUTES. As a deploy step,
+`python warmup.py` warms what processes share: the warehouse, the semantic cache file
+and the shared cache tier.
+
+    python warmup.py [--secrets .streamlit/secrets.toml] [--no-samples]
+"""
+import argparse
+import importlib
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import metrics
+from admission import BACKGROUND, caller, slot
+from usage import attribute
+
+# Imported lazily by the app, so the first question would otherwise pay for them
+HEAVY_MODULES = (
+    "snowflake.connector", "openai", "pyarrow", "altair", "langchain.chains", "langchain_core.documents",
+    "langchain_core.retrievers", "langchain_openai", "langchain_community.vectorstores.azuresearch",
+)
+WARMUP_HISTORY = 20
+
+STAGE_SECONDS = metrics.gauge("ppp_warmup_stage_seconds", "Seconds each stage took in the last warm-up", ["stage"])
+STAGE_FAILURES = metrics.counter("ppp_warmup_failures_total", "Warm-up stages that failed", ["stage"])
+
+
+class Warmer:
+    """Runs warm-up stages now and whenever the process has been idle long enough"""
+
+    def __init__(self, stages: Dict[str, Callable[[], Any]]):
+        self.stages = stages
+        self.last_activity = time.monotonic()
+        self.last_run: Optional[float] = None
+        self.runs: Deque[Dict[str, Any]] = deque(maxlen=WARMUP_HISTORY)
+        self._lock = threading.Lock()
+
+    def touch(self):
+        """Note user activity; idle warm-ups wait until there has been none for the idle interval"""
+        self.last_activity = time.monotonic()
+
+    def run(self, reason: str = "start") -> Dict[str, Any]:
+        """Run every stage (failures are logged, not raised); returns seconds per stage"""
+        started = time.perf_counter()
+        report = {"reason": reason, "started_at": datetime.now().isoformat(timespec="seconds"),
+                  "stages": {}, "errors": {}}
+        with self._lock, caller("warmup", BACKGROUND), attribute(user="warmup", session_id="warmup"):
+            for name, stage in self.stages.items():
+                stage_started = time.perf_counter()
+                try:
+                    detail = stage()
+                except Exception as e:
+                    report["errors"][name] = str(e)
+                    detail = f"failed: {e}"
+                    STAGE_FAILURES.inc(name)
+                seconds = time.perf_counter() - stage_started
+                report["stages"][name] = seconds
+                STAGE_SECONDS.set(seconds, name)
+                print(f"[WARMUP] {name} {seconds:.2f}s" + (f" ({detail})" if detail else ""))
+            report["seconds"] = time.perf_counter() - started
+            self.last_run = time.monotonic()
+            self.runs.append(report)
+        print(f"[WARMUP] {reason} warm-up took {report['seconds']:.2f}s, {len(report['errors'])} stages failed")
+        return report
+
+    def start(self, idle_minutes: float, run_now: bool = True) -> threading.Thread:
+        """Warm up in the background now, then after every idle_minutes without activity (0: never again)"""
+        def loop():
+            if run_now:
+                self.run("start")
+            while idle_minutes > 0:
+                quiet_since = max(self.last_activity, self.last_run or 0.0)
+                remaining = quiet_since + idle_minutes * 60 - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                else:
+                    self.run("idle")
+
+        thread = threading.Thread(target=loop, name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+
+def preload_modules(names: List[str] = HEAVY_MODULES) -> str:
+    """Import the modules not loaded yet; ones that are not installed are skipped"""
+    imported = 0
+    for name in names:
+        if name in sys.modules:
+            continue
+        try:
+            importlib.import_module(name)
+            imported += 1
+        except ImportError:
+            pass
+    return f"{imported} modules imported"
+
+
+def keep_warehouse_alive(conn: Any) -> str:
+    """Resume the session's warehouse if suspended; a role without OPERATE on it runs SELECT 1 instead"""
+    with slot("snowflake"):
+        cursor = conn.cursor()
+        try:
+            try:
+                cursor.execute("ALTER WAREHOUSE RESUME IF SUSPENDED")
+                return "warehouse resumed"
+            except Exception as e:
+                cursor.execute("SELECT 1")
+                return f"session kept alive; resume refused: {e}"
+        finally:
+            cursor.close()
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Warm the warehouse and the shared caches before users arrive")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--no-samples", action="store_true", help="skip answering the sample questions")
+    args = parser.parse_args(argv)
+
+    from structured_pipeline import (StructuredPipeline, build_usage_ledger, build_warehouse_router, build_warmer,
+                                     load_secrets)
+
+    secrets = load_secrets(args.secrets)
+    pipeline = StructuredPipeline.from_secrets(secrets)
+    build_usage_ledger(pipeline.conn)
+    build_warehouse_router(pipeline.conn, secrets)
+    report = build_warmer(pipeline, samples=not args.no_samples).run("deploy")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())